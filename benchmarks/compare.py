@@ -0,0 +1,70 @@
+import sys
+import json
+import argparse
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.compare")
+    parser.add_argument("baseline", help="results from python -m benchmarks.run to compare against")
+    parser.add_argument("current")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=1.25,
+        help="fail if any benchmark is more than THRESHOLD times slower than the baseline",
+    )
+    args = parser.parse_args(argv[1:])
+
+    baseline = _read(args.baseline)
+    current = _read(args.current)
+    comparisons = compare(baseline, current)
+
+    slowdowns = []
+    for name, baseline_time, current_time in comparisons:
+        ratio = current_time / baseline_time
+        marker = ""
+        if ratio > args.threshold:
+            slowdowns.append(name)
+            marker = "  SLOWER"
+        sys.stdout.write("{0}: {1:.4f}s -> {2:.4f}s ({3:.2f}x){4}\n".format(
+            name,
+            baseline_time,
+            current_time,
+            ratio,
+            marker,
+        ))
+
+    if slowdowns:
+        sys.stdout.write("{0} benchmark(s) slower than {1:.2f}x the baseline\n".format(len(slowdowns), args.threshold))
+        return 1
+    else:
+        return 0
+
+
+def compare(baseline, current):
+    # Compares the fastest time of each benchmark that ran successfully in
+    # both sets of results, since it's the least affected by noise
+    baseline_times = _times(baseline)
+    current_times = _times(current)
+    return [
+        (name, baseline_times[name], current_times[name])
+        for name in sorted(current_times)
+        if name in baseline_times and baseline_times[name] > 0
+    ]
+
+
+def _times(report):
+    return dict(
+        (result["name"], result["min"])
+        for result in report["results"]
+        if result["status"] == "ok"
+    )
+
+
+def _read(path):
+    with open(path) as report_file:
+        return json.load(report_file)
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,48 @@
+import os
+import subprocess
+
+import tempman
+import yaml
+
+
+def create_project(file_count, ignored_file_count=0, git=False, travis_yml=None, file_size=1024):
+    # Files are spread over directories of up to 100 files each, as in a
+    # typical source tree. Ignored files are put in a single directory,
+    # like a node_modules or build directory, which is listed in .gitignore
+    # if the project is a git repository.
+    temp_dir = tempman.create_temp_dir()
+    try:
+        path = temp_dir.path
+        if travis_yml is None:
+            travis_yml = {"script": "true"}
+        with open(os.path.join(path, ".travis.yml"), "w") as travis_yml_file:
+            yaml.safe_dump(travis_yml, travis_yml_file)
+
+        _write_files(os.path.join(path, "src"), file_count, file_size)
+        _write_files(os.path.join(path, "ignored"), ignored_file_count, file_size)
+
+        if git:
+            with open(os.path.join(path, ".gitignore"), "w") as gitignore_file:
+                gitignore_file.write("/ignored/\n")
+            _git(path, "init", "--quiet")
+            _git(path, "add", ".")
+            _git(path, "-c", "user.name=Benchmark", "-c", "user.email=benchmark@example.com", "commit", "--quiet", "-m", "Initial commit")
+    except Exception:
+        temp_dir.close()
+        raise
+    return temp_dir
+
+
+def _write_files(path, file_count, file_size):
+    contents = (b"x" * 63 + b"\n") * (file_size // 64)
+    for index in range(file_count):
+        directory = os.path.join(path, "dir-{0}".format(index // 100))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(os.path.join(directory, "file-{0}.py".format(index)), "wb") as project_file:
+            project_file.write(contents)
+
+
+def _git(path, *args):
+    with open(os.devnull, "wb") as devnull:
+        subprocess.check_call(["git"] + list(args), cwd=path, stdout=devnull)
@@ -0,0 +1,159 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import shutil
+import traceback
+import subprocess
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.run")
+    parser.add_argument("--output", "-o", help="write results to OUTPUT as JSON, rather than to stdout")
+    parser.add_argument("--repeat", type=int, default=5, help="the number of times to run each benchmark")
+    parser.add_argument(
+        "--filter",
+        action="append",
+        default=[],
+        help="only run benchmarks whose names contain FILTER. Can be given more than once",
+    )
+    parser.add_argument(
+        "--find-links",
+        help="install packages from wheels in FIND_LINKS rather than PyPI when creating Python runtimes. It should contain wheels for pip, setuptools and virtualenv",
+    )
+    parser.add_argument("--list", action="store_true", help="list the benchmarks without running them")
+    args = parser.parse_args(argv[1:])
+
+    # Caches and temporary directories are kept out of the user's data
+    # directory, so that each run starts from the same state
+    data_dir = tempfile.mkdtemp()
+    os.environ["XDG_DATA_HOME"] = data_dir
+    os.environ["XDG_CACHE_HOME"] = data_dir
+    try:
+        from .suite import all_benchmarks
+        benchmarks = [
+            benchmark for benchmark in all_benchmarks(find_links=args.find_links)
+            if not args.filter or any(pattern in benchmark.full_name for pattern in args.filter)
+        ]
+        if args.list:
+            for benchmark in benchmarks:
+                sys.stdout.write(benchmark.full_name + "\n")
+            return 0
+
+        results = []
+        for benchmark in benchmarks:
+            sys.stderr.write("{0} ... ".format(benchmark.full_name))
+            sys.stderr.flush()
+            result = run_benchmark(benchmark, repeat=args.repeat)
+            sys.stderr.write(_describe_result(result) + "\n")
+            results.append(result)
+    finally:
+        shutil.rmtree(data_dir)
+
+    report = {
+        "environment": _environment(),
+        "repeat": args.repeat,
+        "results": results,
+    }
+    if args.output is None:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write("\n")
+    else:
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=2, sort_keys=True)
+
+    if any(result["status"] == "error" for result in results):
+        return 1
+    else:
+        return 0
+
+
+def run_benchmark(benchmark, repeat):
+    from .suite import SkipBenchmark
+
+    result = {
+        "name": benchmark.full_name,
+        "benchmark": benchmark.name,
+        "params": benchmark.params,
+        "operations": benchmark.operations,
+    }
+    try:
+        with benchmark.setup() as case:
+            times = []
+            for index in range(repeat):
+                if case.prepare is not None:
+                    case.prepare()
+                start = time.time()
+                case.run()
+                times.append(time.time() - start)
+    except SkipBenchmark as error:
+        result.update(status="skipped", reason=str(error))
+        return result
+    except Exception:
+        result.update(status="error", reason=traceback.format_exc())
+        return result
+
+    times.sort()
+    result.update(
+        status="ok",
+        times=times,
+        min=times[0],
+        median=_median(times),
+        mean=sum(times) / len(times),
+        per_operation=times[0] / benchmark.operations,
+    )
+    return result
+
+
+def _median(values):
+    middle = len(values) // 2
+    if len(values) % 2 == 1:
+        return values[middle]
+    else:
+        return (values[middle - 1] + values[middle]) / 2
+
+
+def _describe_result(result):
+    if result["status"] == "ok":
+        description = "{0:.4f}s (min), {1:.4f}s (median)".format(result["min"], result["median"])
+        if result["operations"] != 1:
+            description += ", {0:.2f}ms per operation".format(result["per_operation"] * 1000)
+        return description
+    else:
+        return "{0}: {1}".format(result["status"], result["reason"].strip().splitlines()[-1])
+
+
+def _environment():
+    return {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "revision": _git_revision(),
+        "time": time.time(),
+    }
+
+
+def _git_revision():
+    package_dir = os.path.join(os.path.dirname(__file__), "..")
+    try:
+        with open(os.devnull, "wb") as devnull:
+            process = subprocess.Popen(
+                ["git", "rev-parse", "HEAD"],
+                cwd=package_dir,
+                stdout=subprocess.PIPE,
+                stderr=devnull,
+            )
+            output = process.communicate()[0]
+    except OSError:
+        return None
+    if process.returncode == 0:
+        return output.decode("ascii").strip()
+    else:
+        return None
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,226 @@
+import io
+import os
+import sys
+import shutil
+import contextlib
+
+import spur
+import tempman
+
+from toodlepip import files, caches
+from toodlepip.build import create_builder
+from toodlepip.consoles import Console, Command
+from toodlepip.platforms import builders
+from . import projects
+
+
+def all_benchmarks(find_links=None):
+    # find_links is a directory of wheels for pip, setuptools and
+    # virtualenv, used in place of PyPI when creating Python runtimes
+    benchmarks = []
+
+    for file_count in [100, 1000, 5000]:
+        benchmarks.append(Benchmark(
+            "copy",
+            {"files": file_count, "ignored_files": 0, "git": False},
+            lambda file_count=file_count: _copy(files.copy, file_count=file_count),
+        ))
+    for git in [False, True]:
+        benchmarks.append(Benchmark(
+            "copy",
+            {"files": 1000, "ignored_files": 5000, "git": git},
+            lambda git=git: _copy(files.copy, file_count=1000, ignored_file_count=5000, git=git),
+        ))
+    benchmarks.append(Benchmark(
+        "snapshot_git",
+        {"files": 1000, "ignored_files": 5000, "git": True},
+        lambda: _copy(files.snapshot_git, file_count=1000, ignored_file_count=5000, git=True),
+    ))
+    benchmarks.append(Benchmark(
+        "sync_unchanged",
+        {"files": 5000, "ignored_files": 0, "git": False},
+        lambda: _sync_unchanged(file_count=5000),
+    ))
+
+    command_count = 50
+    benchmarks.append(Benchmark(
+        "console_run_all",
+        {"commands": command_count},
+        lambda: _console_run_all(command_count),
+        operations=command_count,
+    ))
+    benchmarks.append(Benchmark(
+        "session_run_all",
+        {"commands": command_count},
+        lambda: _session_run_all(command_count),
+        operations=command_count,
+    ))
+
+    python_version = "{0}.{1}".format(*sys.version_info[:2])
+    for cached in [False, True]:
+        benchmarks.append(Benchmark(
+            "python_create_runtime",
+            {"python": python_version, "cached_virtualenv": cached},
+            lambda cached=cached: _python_create_runtime(python_version, find_links, cached=cached),
+        ))
+
+    for file_count in [100, 1000]:
+        benchmarks.append(Benchmark(
+            "build",
+            {"language": "default", "files": file_count},
+            lambda file_count=file_count: _build(file_count, {"script": ["true"] * 5}, find_links),
+        ))
+    benchmarks.append(Benchmark(
+        "build",
+        {"language": "python", "files": 100},
+        lambda: _build(100, {"language": "python", "python": [python_version], "script": ["true"] * 5}, find_links),
+    ))
+
+    return benchmarks
+
+
+class Benchmark(object):
+    # setup is a context manager that yields the Case to time. operations
+    # is the number of operations timed by each run, such as the number of
+    # commands, so that the time per operation can be reported.
+    def __init__(self, name, params, setup, operations=1):
+        self.name = name
+        self.params = params
+        self.setup = setup
+        self.operations = operations
+
+    @property
+    def full_name(self):
+        params = ",".join(
+            "{0}={1}".format(key, _format_param(self.params[key]))
+            for key in sorted(self.params)
+        )
+        return "{0}[{1}]".format(self.name, params)
+
+
+class Case(object):
+    # prepare is called before each run, and isn't included in its time
+    def __init__(self, run, prepare=None):
+        self.run = run
+        self.prepare = prepare
+
+
+class SkipBenchmark(Exception):
+    pass
+
+
+def _format_param(value):
+    if value is True:
+        return "yes"
+    elif value is False:
+        return "no"
+    else:
+        return str(value)
+
+
+@contextlib.contextmanager
+def _copy(copy, file_count, ignored_file_count=0, git=False):
+    with projects.create_project(file_count, ignored_file_count=ignored_file_count, git=git) as project:
+        with tempman.create_temp_dir() as destinations:
+            destination = os.path.join(destinations.path, "project")
+
+            def _remove_destination():
+                if os.path.exists(destination):
+                    shutil.rmtree(destination)
+
+            def _run():
+                copy(project.path, destination)
+
+            yield Case(_run, prepare=_remove_destination)
+
+
+@contextlib.contextmanager
+def _sync_unchanged(file_count):
+    with projects.create_project(file_count) as project:
+        with tempman.create_temp_dir() as workdir:
+            destination = os.path.join(workdir.path, "project")
+            index_path = os.path.join(workdir.path, "project.index.json")
+            files.sync(project.path, destination, index_path)
+            yield Case(lambda: files.sync(project.path, destination, index_path))
+
+
+@contextlib.contextmanager
+def _console_run_all(command_count):
+    console = Console(spur.LocalShell(), io.BytesIO())
+    commands = [Command.shell("true")] * command_count
+    yield Case(lambda: console.run_all(None, commands, quiet=True))
+
+
+@contextlib.contextmanager
+def _session_run_all(command_count):
+    console = Console(spur.LocalShell(), io.BytesIO())
+    commands = [Command.shell("true")] * command_count
+    with tempman.create_temp_dir() as cwd:
+        with console.start_session(cwd=cwd.path) as session:
+            # The shell is started by the first command
+            session.run_all(None, [Command.shell("true")], quiet=True)
+            yield Case(lambda: session.run_all(None, commands, quiet=True))
+
+
+@contextlib.contextmanager
+def _python_create_runtime(python_version, find_links, cached):
+    with _local_index(find_links):
+        language_builder = _python_builder(python_version)
+
+        def _clear_cache():
+            caches.create_cache("virtualenvs").prune(max_size=0)
+
+        def _run():
+            with language_builder.create_runtime(None, python_version):
+                pass
+
+        yield Case(_run, prepare=None if cached else _clear_cache)
+
+
+@contextlib.contextmanager
+def _build(file_count, travis_yml, find_links):
+    with _local_index(find_links):
+        if travis_yml.get("language") == "python":
+            _python_builder(travis_yml["python"][0])
+
+        with projects.create_project(file_count, travis_yml=travis_yml) as project:
+            def _run():
+                builder = create_builder(spur.LocalShell(), io.BytesIO())
+                result = builder.build(project.path)
+                if result.return_code != 0:
+                    raise RuntimeError("Build failed with return code {0}".format(result.return_code))
+
+            yield Case(_run)
+
+
+def _python_builder(python_version):
+    # Creates a runtime once, which both checks that the interpreter and
+    # packages are available, and fills the virtualenv cache
+    language_builder = builders["python"](Console(spur.LocalShell(), io.BytesIO()))
+    try:
+        with language_builder.create_runtime(None, python_version):
+            pass
+    except Exception as error:
+        raise SkipBenchmark("Could not create runtime for python {0}, which needs --find-links to contain wheels for pip, setuptools and virtualenv: {1}".format(python_version, error))
+    return language_builder
+
+
+@contextlib.contextmanager
+def _local_index(find_links):
+    # Packages are installed from a local directory rather than PyPI, so
+    # that runtimes can be created without the network
+    with tempman.create_temp_dir() as empty_dir:
+        env = {
+            "PIP_NO_INDEX": "1",
+            "PIP_FIND_LINKS": empty_dir.path if find_links is None else os.path.abspath(find_links),
+        }
+        previous_env = dict((name, os.environ.get(name)) for name in env)
+        os.environ.update(env)
+        try:
+            yield
+        finally:
+            for name, value in previous_env.items():
+                if value is None:
+                    del os.environ[name]
+                else:
+                    os.environ[name] = value
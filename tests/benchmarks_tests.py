@@ -0,0 +1,54 @@
+import os
+import sys
+import json
+
+import spur
+import tempman
+from nose.tools import istest, assert_equal
+
+
+local = spur.LocalShell()
+
+_package_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+
+@istest
+def benchmark_results_are_written_as_json():
+    with tempman.create_temp_dir() as temp_dir:
+        output_path = os.path.join(temp_dir.path, "results.json")
+        _run_module("benchmarks.run", "--repeat", "2", "--filter", "console_run_all", "--output", output_path)
+        with open(output_path) as output_file:
+            report = json.load(output_file)
+
+    assert_equal(["console_run_all[commands=50]"], [result["name"] for result in report["results"]])
+    result = report["results"][0]
+    assert_equal("ok", result["status"])
+    assert_equal(2, len(result["times"]))
+    assert_equal(result["min"] / 50, result["per_operation"])
+
+
+@istest
+def comparison_fails_if_benchmark_is_slower_than_threshold():
+    with tempman.create_temp_dir() as temp_dir:
+        def _write_report(name, times):
+            path = os.path.join(temp_dir.path, name)
+            results = [
+                {"name": benchmark_name, "status": "ok", "min": min_time}
+                for benchmark_name, min_time in times
+            ]
+            with open(path, "w") as report_file:
+                json.dump({"results": results}, report_file)
+            return path
+
+        baseline = _write_report("baseline.json", [("a", 1.0), ("b", 1.0)])
+        current = _write_report("current.json", [("a", 1.1), ("b", 2.0)])
+        result = _run_module("benchmarks.compare", baseline, current, "--threshold", "1.5", allow_error=True)
+
+    assert_equal(1, result.return_code)
+    lines = result.output.decode("utf8").splitlines()
+    assert_equal("a: 1.0000s -> 1.1000s (1.10x)", lines[0])
+    assert_equal("b: 1.0000s -> 2.0000s (2.00x)  SLOWER", lines[1])
+
+
+def _run_module(module, *args, **kwargs):
+    return local.run([sys.executable, "-m", module] + list(args), cwd=_package_dir, **kwargs)
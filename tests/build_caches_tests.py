@@ -0,0 +1,152 @@
+import io
+import os
+import tempfile
+import shutil
+
+import spur
+from nose.tools import istest, assert_equal
+
+from toodlepip.caches import DirectoryCache
+from toodlepip.config import TravisConfig
+from toodlepip.consoles import Console
+from toodlepip.matrix import MatrixEntry
+from toodlepip.build_caches import BuildCache, ProjectCache, read_cache_config
+
+
+@istest
+def cache_directories_are_read_from_dict():
+    config = read_cache_config(TravisConfig({"cache": {"directories": ["a", "b"]}}))
+    assert_equal(["a", "b"], config.directories)
+
+
+@istest
+def cache_directories_are_read_from_list_of_names_and_dicts():
+    config = read_cache_config(TravisConfig({"cache": ["pip", {"directories": ["a"]}]}))
+    assert_equal(["a"], config.directories)
+
+
+@istest
+def cache_has_no_directories_if_cache_is_name():
+    config = read_cache_config(TravisConfig({"cache": "pip"}))
+    assert_equal([], config.directories)
+
+
+@istest
+class ProjectCacheTests(object):
+    def setup(self):
+        self._temp_dir = tempfile.mkdtemp()
+        cache_dir = os.path.join(self._temp_dir, "cache")
+        os.mkdir(cache_dir)
+        self._directory_cache = DirectoryCache(cache_dir)
+        self._build_cache = BuildCache(self._directory_cache)
+        self._stdout = io.BytesIO()
+        self._console = Console(spur.LocalShell(), self._stdout)
+        self._entry = MatrixEntry("2.7")
+
+    def teardown(self):
+        shutil.rmtree(self._temp_dir)
+
+    @istest
+    def saved_directories_are_restored(self):
+        project_cache = self._project_cache(["deps"])
+        first_dir = self._project_dir("first")
+        self._write(first_dir, "deps/nested/value", "cached")
+        self._write(first_dir, "other", "not cached")
+        project_cache.save(self._console, first_dir, self._entry, None)
+
+        second_dir = self._project_dir("second")
+        restored = project_cache.restore(self._console, second_dir, self._entry)
+
+        assert restored is not None
+        assert_equal("cached", self._read(second_dir, "deps/nested/value"))
+        assert not os.path.exists(os.path.join(second_dir, "other"))
+
+    @istest
+    def nothing_is_restored_if_nothing_was_saved(self):
+        project_cache = self._project_cache(["deps"])
+        project_dir = self._project_dir("project")
+        assert_equal(None, project_cache.restore(self._console, project_dir, self._entry))
+        project_cache.save(self._console, project_dir, self._entry, None)
+        assert_equal([], self._directory_cache.entries())
+
+    @istest
+    def unchanged_directories_are_not_saved_again(self):
+        project_cache = self._project_cache(["deps"])
+        project_dir = self._project_dir("project")
+        self._write(project_dir, "deps/value", "cached")
+        project_cache.save(self._console, project_dir, self._entry, None)
+
+        restored = project_cache.restore(self._console, project_dir, self._entry)
+        project_cache.save(self._console, project_dir, self._entry, restored)
+        assert b"Cached directories are unchanged" in self._stdout.getvalue()
+
+    @istest
+    def caches_are_separate_for_each_entry(self):
+        project_cache = self._project_cache(["deps"])
+        project_dir = self._project_dir("project")
+        self._write(project_dir, "deps/value", "cached")
+        project_cache.save(self._console, project_dir, self._entry, None)
+
+        other_dir = self._project_dir("other")
+        assert_equal(None, project_cache.restore(self._console, other_dir, MatrixEntry("3.4")))
+
+    @istest
+    def branches_without_cache_use_cache_of_master(self):
+        project_dir = self._project_dir("project")
+        self._write(project_dir, "deps/value", "master")
+        self._project_cache(["deps"], branch="master").save(self._console, project_dir, self._entry, None)
+
+        branch_dir = self._project_dir("branch")
+        branch_cache = self._project_cache(["deps"], branch="feature")
+        restored = branch_cache.restore(self._console, branch_dir, self._entry)
+        assert_equal("master", self._read(branch_dir, "deps/value"))
+
+        branch_cache.save(self._console, branch_dir, self._entry, restored)
+        assert_equal(2, len(self._directory_cache.entries()))
+
+    @istest
+    def directories_outside_of_project_are_skipped(self):
+        project_cache = self._project_cache(["$HOME/.cache/deps", "../deps", "$TRAVIS_BUILD_DIR/deps"])
+        project_dir = self._project_dir("project")
+        self._write(project_dir, "deps/value", "cached")
+        project_cache.save(self._console, project_dir, self._entry, None)
+
+        other_dir = self._project_dir("other")
+        project_cache.restore(self._console, other_dir, self._entry)
+        assert_equal("cached", self._read(other_dir, "deps/value"))
+        output = self._stdout.getvalue()
+        assert b"Not caching $HOME/.cache/deps" in output
+        assert b"Not caching ../deps" in output
+
+    @istest
+    def least_recently_used_caches_are_removed_when_over_max_size(self):
+        project_dir = self._project_dir("project")
+        self._write(project_dir, "deps/value", "cached")
+        self._project_cache(["deps"], branch="first").save(self._console, project_dir, self._entry, None)
+        size = self._directory_cache.entries()[0].size
+
+        self._build_cache = BuildCache(self._directory_cache, max_size=size)
+        self._project_cache(["deps"], branch="second").save(self._console, project_dir, self._entry, None)
+
+        entries = self._directory_cache.entries()
+        assert_equal(1, len(entries))
+        assert_equal("/project second 2.7", entries[0].description)
+
+    def _project_cache(self, directories, branch=None):
+        return ProjectCache(self._build_cache, "/project", branch, directories)
+
+    def _project_dir(self, name):
+        path = os.path.join(self._temp_dir, name)
+        os.mkdir(path)
+        return path
+
+    def _write(self, project_dir, path, contents):
+        full_path = os.path.join(project_dir, path)
+        if not os.path.isdir(os.path.dirname(full_path)):
+            os.makedirs(os.path.dirname(full_path))
+        with open(full_path, "w") as output_file:
+            output_file.write(contents)
+
+    def _read(self, project_dir, path):
+        with open(os.path.join(project_dir, path)) as input_file:
+            return input_file.read()
@@ -1,12 +1,24 @@
 import io
+import os
+import time
+import shutil
+import tempfile
 
 import spur
 from nose.tools import istest, assert_equal
+from nose.plugins.skip import SkipTest
 
-from toodlepip.build import Builder, StepRunner
+from toodlepip.build import Builder, BuildServices, StepRunner
+from toodlepip.caches import DirectoryCache
+from toodlepip.results import ResultCache
+from toodlepip.installs import InstallCache
+from toodlepip.build_caches import BuildCache
+from toodlepip.remote import RemoteHost
+from toodlepip.history import HistoryStore
 from toodlepip.config import TravisConfig
 from toodlepip.consoles import Console
 from toodlepip import consoles
+from toodlepip import isolation
 from toodlepip.platforms import DefaultBuilder
 from . import testing
 
@@ -36,9 +48,478 @@ class BuilderTests(object):
         assert_equal(1, result.return_code)
 
 
+    @istest
+    def time_taken_by_each_step_and_command_is_recorded(self):
+        result = self._build_empty(travis_yml={"script": "true"})
+        records = [(record.kind, record.name) for record in result.timings.records]
+        assert ("project", "copy") in records, records
+        assert ("runtime", "create") in records, records
+        assert ("step", "script") in records, records
+        assert ("command", "true") in records, records
+
+
+    @istest
+    def return_code_is_computed_from_every_entry_in_matrix(self):
+        result = self._build_matrix(
+            entries=["a", "b", "c"],
+            script='echo "entry $ENTRY"; test "$ENTRY" != b',
+        )
+        assert_equal(1, result.return_code)
+        assert b"entry c" in self._output, "Output was: {0}".format(self._output)
+
+
+    @istest
+    def remaining_entries_are_skipped_after_first_failure_if_fail_fast_is_set(self):
+        result = self._build_matrix(
+            entries=["a", "b", "c"],
+            script='echo "entry $ENTRY"; test "$ENTRY" != b',
+            fail_fast=True,
+        )
+        assert_equal(1, result.return_code)
+        assert b"entry b" in self._output, "Output was: {0}".format(self._output)
+        assert b"entry c" not in self._output, "Output was: {0}".format(self._output)
+
+
+    @istest
+    def in_flight_entries_are_cancelled_after_first_failure_if_fail_fast_is_set(self):
+        start = time.time()
+        result = self._build_matrix(
+            entries=["a", "b", "c"],
+            script='test "$ENTRY" != b && sleep 30',
+            after_failure='echo "cleanup $ENTRY"',
+            jobs=3,
+            fail_fast=True,
+        )
+        assert time.time() - start < 10
+        assert_equal(1, result.return_code)
+        for entry in [b"a", b"b", b"c"]:
+            assert b"cleanup " + entry in self._output, "Output was: {0}".format(self._output)
+
+
+    @istest
+    def env_rows_are_built_using_runtime_of_entry(self):
+        result = self._build_matrix(
+            entries=["a", "b"],
+            script='echo "entry $ENTRY $VALUE"',
+            env=["VALUE=1", "VALUE=2"],
+        )
+        assert_equal(0, result.return_code)
+        for line in [b"entry a 1", b"entry a 2", b"entry b 1", b"entry b 2"]:
+            assert line in self._output, "Output was: {0}".format(self._output)
+        runtimes_created = [
+            record for record in result.timings.records
+            if (record.kind, record.name) == ("runtime", "create")
+        ]
+        assert_equal(2, len(runtimes_created))
+
+
+    @istest
+    def failures_of_entries_that_are_allowed_to_fail_are_ignored(self):
+        result = self._build_matrix(
+            entries=["a", "b"],
+            script='test "$ENTRY" != b',
+            matrix={"allow_failures": [{"entries": "b"}]},
+        )
+        assert_equal(0, result.return_code)
+
+
+    @istest
+    def results_of_unchanged_passing_entries_are_replayed_from_result_cache(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            cache_dir = os.path.join(temp_dir, "results")
+            os.mkdir(cache_dir)
+            result_cache = ResultCache(DirectoryCache(cache_dir))
+            runs_path = os.path.join(temp_dir, "runs")
+            travis_yml = {
+                "language": "fake",
+                "entries": ["a", "b"],
+                "script": 'echo "entry $ENTRY" | tee -a {0}; test "$ENTRY" != b'.format(runs_path),
+            }
+            with testing.create_project(travis_yml) as project:
+                def _build():
+                    console = Console(spur.LocalShell(), self._stdout)
+                    builder = Builder({"fake": FakeBuilder}, console, services=BuildServices(result_cache=result_cache))
+                    return builder.build(project.path)
+                
+                _build()
+                result = _build()
+                with open(os.path.join(project.path, "changed"), "w") as changed_file:
+                    changed_file.write("changed")
+                _build()
+            
+            assert_equal(1, result.return_code)
+            with open(runs_path) as runs_file:
+                assert_equal(["entry a", "entry b", "entry b", "entry a", "entry b"], runs_file.read().splitlines())
+            assert_equal(3, self._output.count(b"entry a\n"))
+        finally:
+            shutil.rmtree(temp_dir)
+
+
+    @istest
+    def snapshots_of_installs_that_copy_project_are_only_restored_for_same_project_files(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            install_cache = InstallCache(DirectoryCache(temp_dir))
+            travis_yml = {
+                "language": "fake",
+                "entries": ["a"],
+                "install": 'echo "installing $ENTRY"',
+                "script": "true",
+            }
+            with testing.create_project(travis_yml) as project:
+                def _build():
+                    console = Console(spur.LocalShell(), self._stdout)
+                    builder = Builder({"fake": FakeBuilder}, console, services=BuildServices(install_cache=install_cache))
+                    return builder.build(project.path)
+                
+                with open(os.path.join(project.path, "installs-copy"), "w") as marker_file:
+                    marker_file.write("")
+                _build()
+                _build()
+                with open(os.path.join(project.path, "source.txt"), "w") as source_file:
+                    source_file.write("changed")
+                _build()
+            
+            assert_equal(2, self._output.count(b"\ninstalling a\n"))
+        finally:
+            shutil.rmtree(temp_dir)
+
+    @istest
+    def install_steps_are_skipped_if_snapshot_of_install_is_cached(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            install_cache = InstallCache(DirectoryCache(temp_dir))
+            travis_yml = {
+                "language": "fake",
+                "entries": ["a"],
+                "install": 'echo "installing $ENTRY"',
+                "script": 'echo "restored: $(cat restored 2>/dev/null)"',
+            }
+            with testing.create_project(travis_yml) as project:
+                def _build():
+                    console = Console(spur.LocalShell(), self._stdout)
+                    builder = Builder({"fake": FakeBuilder}, console, services=BuildServices(install_cache=install_cache))
+                    return builder.build(project.path)
+                
+                _build()
+                result = _build()
+                with open(os.path.join(project.path, "deps.txt"), "w") as deps_file:
+                    deps_file.write("dependency")
+                _build()
+            
+            assert_equal(0, result.return_code)
+            assert_equal(2, self._output.count(b"\ninstalling a\n"))
+            restored = [
+                line for line in self._output.split(b"\n")
+                if line.startswith(b"restored: ")
+            ]
+            assert_equal([b"restored: ", b"restored: a", b"restored: "], restored)
+        finally:
+            shutil.rmtree(temp_dir)
+
+
+    @istest
+    def cached_directories_are_restored_in_later_builds(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            build_cache = BuildCache(DirectoryCache(temp_dir))
+            travis_yml = {
+                "language": "fake",
+                "entries": ["a"],
+                "cache": {"directories": ["deps"]},
+                "script": 'mkdir -p deps; echo "build" >> deps/builds; echo "builds: $(wc -l < deps/builds)"',
+                "before_cache": "echo before cache",
+            }
+            with testing.create_project(travis_yml) as project:
+                def _build():
+                    console = Console(spur.LocalShell(), self._stdout)
+                    builder = Builder({"fake": FakeBuilder}, console, services=BuildServices(build_cache=build_cache))
+                    return builder.build(project.path)
+                
+                _build()
+                result = _build()
+            
+            assert_equal(0, result.return_code)
+            assert b"builds: 1\n" in self._output, "Output was: {0}".format(self._output)
+            assert b"builds: 2\n" in self._output, "Output was: {0}".format(self._output)
+            assert_equal(2, self._output.count(b"\nbefore cache\n"))
+        finally:
+            shutil.rmtree(temp_dir)
+
+
+    @istest
+    def only_entries_at_entry_indices_are_built(self):
+        result = self._build_matrix(
+            entries=["a", "b", "c"],
+            script='echo "entry $ENTRY"',
+            entry_indices=[0, 2],
+        )
+        assert_equal(0, result.return_code)
+        assert b"entry a" in self._output, "Output was: {0}".format(self._output)
+        assert b"entry b" not in self._output, "Output was: {0}".format(self._output)
+        assert b"entry c" in self._output, "Output was: {0}".format(self._output)
+
+
+    @istest
+    def entries_are_distributed_across_hosts(self):
+        hosts = [
+            RemoteHost("first", spur.LocalShell()),
+            RemoteHost("second", spur.LocalShell()),
+        ]
+        console = Console(spur.LocalShell(), self._stdout)
+        builder = Builder({None: DefaultBuilder}, console, hosts=hosts)
+        travis_yml = {
+            "env": ["A=1", "A=2", "A=3"],
+            "script": 'sleep 0.5; echo "A is $A"; test "$A" != 2',
+        }
+        with testing.create_project(travis_yml) as project:
+            result = builder.build(project.path)
+        
+        assert_equal(1, result.return_code)
+        for value in [b"1", b"2", b"3"]:
+            assert b"A is " + value + b"\n" in self._output, "Output was: {0}".format(self._output)
+        assert_equal(1, self._output.count(b"Uploading project to first"))
+        assert_equal(1, self._output.count(b"Uploading project to second"))
+
+
+    @istest
+    def entries_expected_to_take_longest_are_started_first(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            history = HistoryStore(temp_dir)
+            starts_path = os.path.join(temp_dir, "starts")
+            travis_yml = {
+                "language": "fake",
+                "entries": ["a", "b", "c"],
+                "script": 'echo "$ENTRY" >> {0}; case "$ENTRY" in a) sleep 0.1;; b) sleep 0.6;; c) sleep 1.2;; esac'.format(starts_path),
+            }
+            with testing.create_project(travis_yml) as project:
+                def _build():
+                    console = Console(spur.LocalShell(), self._stdout)
+                    builder = Builder({"fake": FakeBuilder}, console, jobs=2, services=BuildServices(history=history))
+                    return builder.build(project.path)
+                
+                _build()
+                assert b"Predicted" not in self._output
+                result = _build()
+            
+            assert_equal(0, result.return_code)
+            with open(starts_path) as starts_file:
+                starts = starts_file.read().splitlines()
+            assert_equal(["a", "b", "c"], sorted(starts[:3]))
+            assert_equal(["b", "c"], sorted(starts[3:5]))
+            assert_equal("a", starts[5])
+            assert b"Predicted " in self._output, "Output was: {0}".format(self._output)
+            assert b"  c: predicted " in self._output, "Output was: {0}".format(self._output)
+        finally:
+            shutil.rmtree(temp_dir)
+
+
+    @istest
+    def runtimes_are_checked_out_from_runtime_pool_if_available(self):
+        runtime_pool = FakeRuntimePool(available=["b"])
+        result = self._build_matrix(
+            entries=["a", "b"],
+            script='echo "entry $ENTRY $POOLED"',
+            services=BuildServices(runtime_pool=runtime_pool),
+        )
+        assert_equal(0, result.return_code)
+        assert b"entry a no" in self._output, "Output was: {0}".format(self._output)
+        assert b"entry b yes" in self._output, "Output was: {0}".format(self._output)
+        assert_equal(["b"], runtime_pool.closed)
+
+
+    @istest
+    def isolated_entries_have_private_tmp_directories(self):
+        if not isolation.is_supported():
+            raise SkipTest("Namespaces are not supported")
+        result = self._build_matrix(
+            entries=["a", "b"],
+            script='test ! -e /tmp/toodlepip-marker && touch /tmp/toodlepip-marker && echo "entry $ENTRY $ISOLATED"',
+            isolate=True,
+        )
+        assert_equal(0, result.return_code)
+        assert b"entry a yes" in self._output, "Output was: {0}".format(self._output)
+        assert b"entry b yes" in self._output, "Output was: {0}".format(self._output)
+        assert not os.path.exists("/tmp/toodlepip-marker")
+
+
+    @istest
+    def watch_rebuilds_project_on_each_change_and_reinstalls_if_install_files_change(self):
+        def _write(filename, contents):
+            def _change(project_path):
+                with open(os.path.join(project_path, filename), "w") as changed_file:
+                    changed_file.write(contents)
+            return _change
+        
+        travis_yml = {
+            "language": "fake",
+            "entries": ["a"],
+            "install": 'echo "installing $ENTRY"',
+            "script": 'echo "value $(cat value)"',
+        }
+        with testing.create_project(travis_yml) as project:
+            _write("value", "1")(project.path)
+            watcher = FakeWatcher(project.path, [
+                _write("value", "2"),
+                _write("value", "2"),
+                _write("deps.txt", "dependency"),
+            ])
+            console = Console(spur.LocalShell(), self._stdout)
+            builder = Builder({"fake": FakeBuilder}, console)
+            result = builder.watch(project.path, watcher)
+        
+        assert_equal(0, result.return_code)
+        assert_equal(2, self._output.count(b"\ninstalling a\n"))
+        values = [
+            line for line in self._output.split(b"\n")
+            if line.startswith(b"value ")
+        ]
+        assert_equal([b"value 1", b"value 2", b"value 2"], values)
+        assert b"No changes to build" in self._output, "Output was: {0}".format(self._output)
+        runtimes_created = [
+            record for record in result.timings.records
+            if (record.kind, record.name) == ("runtime", "create")
+        ]
+        assert_equal(1, len(runtimes_created))
+
+
+    @istest
+    def watch_starts_again_if_travis_yml_changes(self):
+        def _change_script(project_path):
+            with open(os.path.join(project_path, ".travis.yml"), "w") as travis_yml_file:
+                travis_yml_file.write("language: fake\nentries: [a]\nscript: echo changed\n")
+        
+        travis_yml = {"language": "fake", "entries": ["a"], "script": "echo original"}
+        with testing.create_project(travis_yml) as project:
+            watcher = FakeWatcher(project.path, [_change_script])
+            console = Console(spur.LocalShell(), self._stdout)
+            builder = Builder({"fake": FakeBuilder}, console)
+            result = builder.watch(project.path, watcher)
+        
+        assert_equal(0, result.return_code)
+        assert b"\noriginal\n" in self._output, "Output was: {0}".format(self._output)
+        assert b"\nchanged\n" in self._output, "Output was: {0}".format(self._output)
+
+
+    @istest
+    def output_of_entries_built_in_parallel_is_not_interleaved(self):
+        result = self._build_matrix(
+            entries=["a", "b", "c"],
+            script=['echo "start $ENTRY"', "sleep 0.2", 'echo "end $ENTRY"'],
+            jobs=3,
+        )
+        assert_equal(0, result.return_code)
+        lines = [
+            line for line in self._output.split(b"\n")
+            if line.startswith(b"start ") or line.startswith(b"end ")
+        ]
+        assert_equal(6, len(lines))
+        for index in range(0, len(lines), 2):
+            assert_equal(lines[index][len(b"start "):], lines[index + 1][len(b"end "):])
+
+
     def _build_empty(self, travis_yml):
         with testing.create_project(travis_yml) as project:
             return self._builder.build(project.path)
+    
+    def _build_matrix(self, entries, script, after_failure=None, env=None, matrix=None, **kwargs):
+        console = Console(spur.LocalShell(), self._stdout)
+        builder = Builder({"fake": FakeBuilder}, console, **kwargs)
+        travis_yml = {"language": "fake", "entries": entries, "script": script}
+        optional_config = [("after_failure", after_failure), ("env", env), ("matrix", matrix)]
+        for name, value in optional_config:
+            if value is not None:
+                travis_yml[name] = value
+        with testing.create_project(travis_yml) as project:
+            return builder.build(project.path)
+
+
+class FakeBuilder(object):
+    matrix_key = "entries"
+    install_files = ["deps.txt"]
+    
+    def __init__(self, console):
+        pass
+    
+    def matrix(self, project_config):
+        return project_config.get_list("entries")
+    
+    def create_runtime(self, project_dir, entry, runtime_dir=None, isolated=False):
+        return FakeRuntime(entry, runtime_dir)
+
+
+class FakeRuntime(object):
+    def __init__(self, entry, runtime_dir=None):
+        self._entry = entry
+        self._runtime_dir = runtime_dir
+        self._isolated = False
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *args):
+        if self._runtime_dir is not None:
+            self._runtime_dir.close()
+    
+    install_key = "fake"
+    
+    def installs_project_in_place(self, project_dir):
+        return not os.path.exists(os.path.join(project_dir, "installs-copy"))
+    
+    def snapshot_install(self, path, project_dir):
+        os.mkdir(path)
+        with open(os.path.join(path, "entry"), "w") as entry_file:
+            entry_file.write(self._entry)
+    
+    def restore_install(self, path, project_dir):
+        shutil.copy(os.path.join(path, "entry"), os.path.join(project_dir, "restored"))
+    
+    def isolate(self, namespace):
+        self._isolated = True
+    
+    def before_step(self, step):
+        pooled = "no" if self._runtime_dir is None else "yes"
+        isolated = "yes" if self._isolated else "no"
+        return "export ENTRY={0} POOLED={1} ISOLATED={2}".format(self._entry, pooled, isolated)
+    
+    def after_step(self, step):
+        return None
+
+
+class FakeWatcher(object):
+    # Makes each change to the project, and then reports it
+    def __init__(self, path, changes):
+        self._path = path
+        self._changes = changes
+    
+    def changes(self, cancelled):
+        for change in self._changes:
+            change(self._path)
+            yield
+
+
+class FakeRuntimePool(object):
+    def __init__(self, available):
+        self._available = available
+        self.closed = []
+    
+    def checkout(self, language, entry, runtime_key=None):
+        if entry in self._available:
+            return FakeRuntimeDir(self, entry)
+        else:
+            return None
+
+
+class FakeRuntimeDir(object):
+    def __init__(self, pool, entry):
+        self._pool = pool
+        self._entry = entry
+        self.path = None
+    
+    def close(self):
+        self._pool.closed.append(self._entry)
 
 
 @istest
@@ -74,17 +555,45 @@ class StepRunnerTests(object):
         
         assert_equal(["before_install", "install"], self._executed_steps())
 
+    @istest
+    def failure_is_reported_before_cleanup_steps_are_run(self):
+        project_config = TravisConfig({"script": ["exit 5"]})
+        failed_after = []
+        self._run_steps(project_config, on_failure=lambda: failed_after.append(self._executed_steps()))
+        
+        assert_equal(
+            [["before_install", "install", "before_script", "script"]],
+            failed_after,
+        )
+
     @istest
     def return_code_is_zero_even_if_after_success_fails(self):
         project_config = TravisConfig({"after_success": ["exit 5"]})
         result = self._run_steps(project_config)
         
         assert_equal(0, result.return_code)
+
+    @istest
+    def install_steps_are_skipped_if_install_is_false(self):
+        project_config = TravisConfig({})
+        installed = []
+        self._run_steps(project_config, install=False, on_installed=lambda: installed.append(True))
+        
+        assert_equal(["before_script", "script", "after_success", "after_script"], self._executed_steps())
+        assert_equal([], installed)
+
+    @istest
+    def on_installed_is_called_if_install_steps_are_successful(self):
+        installed = []
+        self._run_steps(TravisConfig({}), on_installed=lambda: installed.append(True))
+        self._run_steps(TravisConfig({"install": ["exit 5"]}), on_installed=lambda: installed.append(False))
+        
+        assert_equal([True], installed)
         
-    def _run_steps(self, project_config):
+    def _run_steps(self, project_config, install=True, **kwargs):
         self._commands_runner = FakeCommandsRunner()
-        runner = StepRunner(self._commands_runner)
-        return runner.run_steps(project_config)
+        runner = StepRunner(self._commands_runner, **kwargs)
+        return runner.run_steps(project_config, install=install)
         
     def _executed_steps(self):
         return [step.name for step in self._commands_runner.steps]
@@ -0,0 +1,128 @@
+import os
+import time
+import tempfile
+import shutil
+from datetime import timedelta
+
+from nose.tools import istest, assert_equal
+
+from toodlepip.caches import DirectoryCache
+
+
+@istest
+class DirectoryCacheTests(object):
+    def setup(self):
+        self._temp_dir = tempfile.mkdtemp()
+        self._cache = DirectoryCache(self._temp_dir)
+
+    def teardown(self):
+        shutil.rmtree(self._temp_dir)
+
+    @istest
+    def entry_is_created_on_first_get(self):
+        path = self._cache.get("a", _write_file("one"))
+        assert_equal("one", _read_file(path))
+
+    @istest
+    def entry_is_reused_on_subsequent_gets(self):
+        self._cache.get("a", _write_file("one"))
+        path = self._cache.get("a", _write_file("two"))
+        assert_equal("one", _read_file(path))
+
+    @istest
+    def entry_is_not_cached_if_create_fails(self):
+        def _fail(path):
+            os.mkdir(path)
+            raise ValueError()
+
+        try:
+            self._cache.get("a", _fail)
+            assert False, "Expected ValueError"
+        except ValueError:
+            pass
+
+        assert_equal([], self._cache.entries())
+        path = self._cache.get("a", _write_file("two"))
+        assert_equal("two", _read_file(path))
+
+    @istest
+    def replace_recreates_existing_entry(self):
+        self._cache.get("a", _write_file("one"))
+        path = self._cache.replace("a", _write_file("two"))
+        assert_equal("two", _read_file(path))
+        assert_equal("two", _read_file(self._cache.find("a")))
+
+    @istest
+    def entries_in_use_are_not_pruned(self):
+        with self._cache.use("a", _write_file("one")) as path:
+            _set_last_used(self._temp_dir, "a", time.time() - 2 * 24 * 60 * 60)
+            assert_equal([], self._cache.prune(max_age=timedelta(days=1)))
+            assert_equal("one", _read_file(path))
+        assert_equal(["a"], [entry.key for entry in self._cache.prune(max_age=timedelta(days=1))])
+
+    @istest
+    def least_recently_used_entries_are_removed_when_created_entries_exceed_max_size(self):
+        cache = DirectoryCache(self._temp_dir, max_size=4)
+        cache.get("a", _write_file("one"))
+        _set_last_used(self._temp_dir, "a", time.time() - 60)
+        cache.get("b", _write_file("two"))
+        assert_equal(["b"], [entry.key for entry in cache.entries()])
+        cache.replace("c", _write_file("three"))
+        assert_equal(["c"], [entry.key for entry in cache.entries()])
+
+    @istest
+    def find_returns_path_of_entry_if_present(self):
+        assert_equal(None, self._cache.find("a"))
+        path = self._cache.get("a", _write_file("one"))
+        assert_equal(path, self._cache.find("a"))
+
+    @istest
+    def entries_are_listed_with_description_and_size(self):
+        self._cache.get("a", _write_file("one"), description="First")
+        [entry] = self._cache.entries()
+        assert_equal("a", entry.key)
+        assert_equal("First", entry.description)
+        assert_equal(3, entry.size)
+
+    @istest
+    def prune_removes_entries_older_than_max_age(self):
+        self._cache.get("a", _write_file("one"))
+        self._cache.get("b", _write_file("two"))
+        _set_last_used(self._temp_dir, "a", time.time() - 2 * 24 * 60 * 60)
+
+        removed = self._cache.prune(max_age=timedelta(days=1))
+
+        assert_equal(["a"], [entry.key for entry in removed])
+        assert_equal(["b"], [entry.key for entry in self._cache.entries()])
+        assert not os.path.exists(os.path.join(self._temp_dir, "a"))
+
+    @istest
+    def prune_removes_least_recently_used_entries_until_under_max_size(self):
+        self._cache.get("a", _write_file("one"))
+        self._cache.get("b", _write_file("two"))
+        self._cache.get("c", _write_file("six"))
+        _set_last_used(self._temp_dir, "a", time.time() - 20)
+        _set_last_used(self._temp_dir, "b", time.time() - 30)
+
+        removed = self._cache.prune(max_size=4)
+
+        assert_equal(["b", "a"], [entry.key for entry in removed])
+        assert_equal(["c"], [entry.key for entry in self._cache.entries()])
+
+
+def _write_file(contents):
+    def _create(path):
+        os.mkdir(path)
+        with open(os.path.join(path, "contents"), "w") as contents_file:
+            contents_file.write(contents)
+
+    return _create
+
+
+def _read_file(path):
+    with open(os.path.join(path, "contents")) as contents_file:
+        return contents_file.read()
+
+
+def _set_last_used(cache_path, key, timestamp):
+    os.utime(os.path.join(cache_path, "{0}.json".format(key)), (timestamp, timestamp))
@@ -0,0 +1,57 @@
+import os
+import signal
+import subprocess
+
+from nose.tools import istest, assert_equal
+
+from toodlepip.cancellation import Cancellation
+
+
+@istest
+def callbacks_are_called_when_cancelled():
+    cancellation = Cancellation()
+    calls = []
+    cancellation.on_cancel(lambda: calls.append("cancelled"))
+    assert not cancellation.is_cancelled
+    cancellation.cancel()
+    cancellation.cancel()
+    assert cancellation.is_cancelled
+    assert_equal(["cancelled"], calls)
+
+
+@istest
+def callback_is_called_immediately_if_already_cancelled():
+    cancellation = Cancellation()
+    cancellation.cancel()
+    calls = []
+    cancellation.on_cancel(lambda: calls.append("cancelled"))
+    assert_equal(["cancelled"], calls)
+
+
+@istest
+def removed_callbacks_are_not_called():
+    cancellation = Cancellation()
+    calls = []
+    registration = cancellation.on_cancel(lambda: calls.append("cancelled"))
+    registration.remove()
+    cancellation.cancel()
+    assert_equal([], calls)
+
+
+@istest
+def tracked_process_groups_are_killed():
+    cancellation = Cancellation()
+    process = subprocess.Popen(["sleep", "10"], preexec_fn=os.setsid)
+    cancellation.track_process_group(process.pid)
+    cancellation.kill_process_groups()
+    assert_equal(-signal.SIGKILL, process.wait())
+
+
+@istest
+def process_groups_are_not_killed_once_no_longer_tracked():
+    cancellation = Cancellation()
+    process = subprocess.Popen(["sleep", "0.5"], preexec_fn=os.setsid)
+    registration = cancellation.track_process_group(process.pid)
+    registration.remove()
+    cancellation.kill_process_groups()
+    assert_equal(0, process.wait())
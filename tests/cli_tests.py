@@ -20,6 +20,22 @@ def return_code_is_same_as_return_code_of_failed_command():
     assert_equal(1, result.return_code)
 
 
+@istest
+def git_snapshot_cannot_be_used_when_syncing_project():
+    with testing.create_project({"script": "true"}) as project:
+        result = local.run(["toodlepip", "build", project.path, "--snapshot=git", "--workspace"], allow_error=True)
+    assert_equal(1, result.return_code)
+    assert b"--snapshot can't be used with --workdir" in result.stderr_output, result.stderr_output
+
+
+@istest
+def watch_cannot_be_used_with_jobs():
+    with testing.create_project({"script": "true"}) as project:
+        result = local.run(["toodlepip", "build", project.path, "--watch", "--jobs=2"], allow_error=True)
+    assert_equal(1, result.return_code)
+    assert b"can't be used with --watch" in result.stderr_output, result.stderr_output
+
+
 def _build_empty(travis_yml):
     with testing.create_project(travis_yml) as project:
         return local.run(["toodlepip", "build", project.path], allow_error=True)
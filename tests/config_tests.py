@@ -1,4 +1,5 @@
 import io
+import os
 
 from nose.tools import istest, assert_equal
 
@@ -60,3 +61,28 @@ def get_list_returns_list_if_key_is_present():
     project_config = config.read_travis_yml(yaml_file)
     assert_equal(["2.6", "2.7"], project_config.get_list("python"))
 
+
+
+@istest
+def get_list_returns_copy_of_list():
+    yaml_file = io.BytesIO(b'script:\n- greet')
+    project_config = config.read_travis_yml(yaml_file)
+    project_config.get_list("script").append("wave")
+    assert_equal(["greet"], project_config.get_list("script"))
+
+
+@istest
+def config_is_reused_if_travis_yml_is_unchanged():
+    with testing.create_project({"script": "greet"}) as project:
+        first_config = config.read(project.path)
+        second_config = config.read(project.path)
+        assert first_config is second_config
+
+
+@istest
+def config_is_read_again_if_travis_yml_is_changed():
+    with testing.create_project({"script": "greet"}) as project:
+        config.read(project.path)
+        with open(os.path.join(project.path, ".travis.yml"), "w") as yml_file:
+            yml_file.write("script: wave")
+        assert_equal(["wave"], config.read(project.path).script)
@@ -1,4 +1,6 @@
 import io
+import time
+import threading
 
 import spur
 from nose.tools import istest, assert_equal
@@ -48,6 +50,130 @@ def no_output_except_description_if_quiet_arg_is_set():
     assert_equal(b"\x1b[1mAction\n\x1b[0m", output.getvalue())
 
 
+@istest
+def session_writes_command_output_to_console():
+    console, output = _create_local_console()
+    with console.start_session() as session:
+        session.run(None, Command.shell("echo Go go go!; echo 'Stop!' 1>&2"))
+    assert_equal(b"$ echo Go go go!; echo 'Stop!' 1>&2\nGo go go!\nStop!\n", output.getvalue())
+
+
+@istest
+def session_writes_output_that_does_not_end_with_newline():
+    console, output = _create_local_console()
+    with console.start_session() as session:
+        session.run(None, Command.shell("printf Go"))
+    assert_equal(b"$ printf Go\nGo", output.getvalue())
+
+
+@istest
+def session_preserves_working_directory_and_variables_between_commands():
+    console, output = _create_local_console()
+    with console.start_session() as session:
+        result = session.run_all(None, map(Command.shell, ["cd /", "export GREETING=Hello", "echo $GREETING; pwd"]), quiet=True)
+        session.run(None, Command.shell("echo $GREETING; pwd"))
+    assert_equal(0, result.return_code)
+    assert output.getvalue().endswith(b"Hello\n/\n"), "Output was: {0}".format(output.getvalue())
+
+
+@istest
+def session_return_code_is_first_non_zero_return_code_of_commands():
+    console, output = _create_local_console()
+    with console.start_session() as session:
+        result = session.run_all("Action", map(Command.shell, ["true", "false", "exit 1"]))
+    assert_equal(1, result.return_code)
+
+
+@istest
+def session_is_restarted_if_command_exits_shell():
+    console, output = _create_local_console()
+    with console.start_session() as session:
+        exit_result = session.run(None, Command.shell("exit 3"))
+        session.run(None, Command.shell("echo Still here"))
+    assert_equal(3, exit_result.return_code)
+    assert output.getvalue().endswith(b"Still here\n"), "Output was: {0}".format(output.getvalue())
+
+
+@istest
+def session_returns_error_for_commands_with_syntax_errors():
+    console, output = _create_local_console()
+    with console.start_session() as session:
+        result = session.run(None, Command.shell("echo 'unterminated"))
+    assert result.return_code != 0
+
+
+@istest
+def session_runs_setup_once_before_first_command():
+    console, output = _create_local_console()
+    with console.start_session() as session:
+        setup = "export COUNT=$((COUNT + 1))"
+        session.run_all(None, [Command.shell("echo $COUNT")], setup=setup)
+        session.run_all(None, [Command.shell("echo $COUNT")], setup=setup)
+    assert_equal(b"$ echo $COUNT\n1\n$ echo $COUNT\n1\n", output.getvalue())
+
+
+@istest
+def session_prefixes_each_line_of_output_with_elapsed_time_and_label_if_timestamps_are_enabled():
+    output = io.BytesIO()
+    console = Console(spur.LocalShell(), output, timestamps=True)
+    with console.start_session() as session:
+        session.run(None, Command.shell("echo one; echo two"), label="script")
+    assert_equal(
+        b"$ echo one; echo two\n[00:00.0 script] one\n[00:00.0 script] two\n",
+        output.getvalue(),
+    )
+
+
+@istest
+def cancelling_session_kills_running_command_and_its_children():
+    console, output = _create_local_console()
+    _cancel_after(console, 0.2)
+    start = time.time()
+    with console.start_session() as session:
+        result = session.run(None, Command.shell("sh -c 'sleep 30'; echo done"))
+    assert time.time() - start < 5
+    assert result.cancelled
+    assert result.return_code != 0
+    assert not output.getvalue().endswith(b"\ndone\n"), "Output was: {0}".format(output.getvalue())
+
+
+@istest
+def session_skips_commands_once_cancelled():
+    console, output = _create_local_console()
+    console.cancellation.cancel()
+    with console.start_session() as session:
+        result = session.run(None, Command.shell("echo hello"))
+    assert result.cancelled
+    assert_equal(b"", output.getvalue())
+
+
+@istest
+def session_runs_cleanup_commands_once_cancelled():
+    console, output = _create_local_console()
+    console.cancellation.cancel()
+    with console.start_session() as session:
+        result = session.run(None, Command.shell("echo hello"), cleanup_timeout=5)
+    assert_equal(0, result.return_code)
+    assert_equal(b"$ echo hello\nhello\n", output.getvalue())
+
+
+@istest
+def cleanup_commands_are_killed_after_timeout_once_cancelled():
+    console, output = _create_local_console()
+    _cancel_after(console, 0)
+    start = time.time()
+    with console.start_session() as session:
+        result = session.run(None, Command.shell("sleep 30"), cleanup_timeout=0.2)
+    assert time.time() - start < 5
+    assert result.cancelled
+
+
+def _cancel_after(console, seconds):
+    timer = threading.Timer(seconds, console.cancellation.cancel)
+    timer.daemon = True
+    timer.start()
+
+
 def _create_local_console():
     output = io.BytesIO()
     shell = spur.LocalShell()
@@ -0,0 +1,230 @@
+import io
+import os
+import json
+import time
+import socket
+import threading
+import subprocess
+
+import spur
+import tempman
+from nose.tools import istest, assert_equal
+
+from toodlepip import daemon
+from toodlepip.consoles import Console
+from toodlepip.platforms import DefaultBuilder
+
+
+@istest
+def runtimes_are_prepared_in_background_after_first_checkout():
+    with _create_pool() as pool:
+        assert_equal(None, pool.checkout("fake", "a"))
+        _wait_until_ready(pool, "fake", "a", 2)
+        path = pool.checkout("fake", "a")
+        with open(os.path.join(path, "entry")) as entry_file:
+            assert_equal("a", entry_file.read())
+
+
+@istest
+def checked_out_runtimes_are_replaced():
+    with _create_pool() as pool:
+        pool.warm("fake", "a")
+        _wait_until_ready(pool, "fake", "a", 2)
+        first = pool.checkout("fake", "a")
+        second = pool.checkout("fake", "a")
+        assert first != second
+        _wait_until_ready(pool, "fake", "a", 2)
+
+
+@istest
+def discarded_runtimes_are_removed():
+    with _create_pool() as pool:
+        pool.warm("fake", "a")
+        _wait_until_ready(pool, "fake", "a", 1)
+        path = pool.checkout("fake", "a")
+        pool.discard(path)
+        _wait_until(lambda: not os.path.exists(path))
+
+
+@istest
+def closing_pool_leaves_runtimes_that_are_checked_out_by_running_builds():
+    with tempman.create_temp_dir() as temp_dir:
+        root = os.path.join(temp_dir.path, "pool")
+        os.mkdir(root)
+        pool = _create_runtime_pool(root)
+        try:
+            pool.warm("fake", "a")
+            _wait_until_ready(pool, "fake", "a", 2)
+            running_path = pool.checkout("fake", "a")
+            finished_path = pool.checkout("fake", "a", pid=_finished_pid())
+            _wait_until_ready(pool, "fake", "a", 2)
+        finally:
+            pool.close()
+        
+        name = os.path.basename(running_path)
+        assert_equal([name, name + ".checkout"], sorted(os.listdir(root)))
+        assert not os.path.exists(finished_path)
+
+
+@istest
+def runtimes_prepared_for_other_runtime_key_are_discarded():
+    with _create_pool() as pool:
+        pool.checkout("versioned", "a", runtime_key="1")
+        _wait_until_ready(pool, "versioned", "a", 2, runtime_key="1")
+        VersionedBuilder.versions["a"] = "2"
+        try:
+            old_paths = [pool.checkout("versioned", "a", runtime_key="1") for index in range(2)]
+            
+            assert_equal(None, pool.checkout("versioned", "a", runtime_key="2"))
+            _wait_until_ready(pool, "versioned", "a", 2, runtime_key="2")
+            path = pool.checkout("versioned", "a", runtime_key="2")
+            with open(os.path.join(path, "entry")) as entry_file:
+                assert_equal("a 2", entry_file.read())
+            assert_equal(0, pool.ready_count("versioned", "a", runtime_key="1"))
+            assert all(os.path.exists(old_path) for old_path in old_paths)
+        finally:
+            VersionedBuilder.versions["a"] = "1"
+
+
+@istest
+def runtimes_are_not_prepared_if_runtime_key_does_not_match():
+    with _create_pool() as pool:
+        pool.checkout("versioned", "b", runtime_key="0")
+        time.sleep(0.2)
+        assert_equal(0, pool.ready_count("versioned", "b", runtime_key="0"))
+
+
+@istest
+def runtimes_are_not_pooled_for_languages_that_cannot_prepare_runtimes():
+    with _create_pool() as pool:
+        pool.warm(None, None)
+        assert_equal(None, pool.checkout(None, None))
+        assert_equal(0, pool.ready_count(None, None))
+
+
+@istest
+def runtimes_are_checked_out_from_daemon_over_socket():
+    with tempman.create_temp_dir() as socket_dir:
+        with _create_pool() as pool:
+            pool.warm("fake", "a")
+            _wait_until_ready(pool, "fake", "a", 1)
+            socket_path = os.path.join(socket_dir.path, "daemon.sock")
+            server = daemon.create_server(pool, socket_path)
+            server_thread = threading.Thread(target=server.serve_forever)
+            server_thread.daemon = True
+            server_thread.start()
+            try:
+                client = daemon.connect(socket_path)
+                runtime_dir = client.checkout("fake", "a")
+                assert os.path.exists(os.path.join(runtime_dir.path, "entry"))
+                runtime_dir.close()
+                _wait_until(lambda: not os.path.exists(runtime_dir.path))
+            finally:
+                server.shutdown()
+                server.server_close()
+
+
+@istest
+def invalid_requests_are_answered_with_error():
+    with tempman.create_temp_dir() as socket_dir:
+        with _create_pool() as pool:
+            socket_path = os.path.join(socket_dir.path, "daemon.sock")
+            server = daemon.create_server(pool, socket_path)
+            server_thread = threading.Thread(target=server.serve_forever)
+            server_thread.daemon = True
+            server_thread.start()
+            try:
+                for request in [b"not json\n", b"[]\n", b'{"command": "checkout"}\n']:
+                    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                    try:
+                        client.connect(socket_path)
+                        client.sendall(request)
+                        response = json.loads(client.makefile("rb").readline().decode("utf8"))
+                    finally:
+                        client.close()
+                    assert "error" in response, response
+                assert daemon.connect(socket_path) is not None
+            finally:
+                server.shutdown()
+                server.server_close()
+
+
+@istest
+def runtime_is_removed_by_build_if_daemon_has_stopped():
+    with tempman.create_temp_dir() as temp_dir:
+        path = os.path.join(temp_dir.path, "runtime")
+        os.mkdir(path)
+        client = daemon.RuntimePoolClient(os.path.join(temp_dir.path, "daemon.sock"))
+        client.discard(path)
+        assert not os.path.exists(path)
+
+
+@istest
+def connect_returns_none_if_daemon_is_not_running():
+    with tempman.create_temp_dir() as temp_dir:
+        assert_equal(None, daemon.connect(os.path.join(temp_dir.path, "daemon.sock")))
+
+
+class FakeBuilder(object):
+    def __init__(self, console):
+        pass
+
+    def prepare_runtime(self, entry, path):
+        with open(os.path.join(path, "entry"), "w") as entry_file:
+            entry_file.write(entry)
+
+
+class VersionedBuilder(object):
+    versions = {"a": "1", "b": "1"}
+
+    def __init__(self, console):
+        pass
+
+    def runtime_key(self, entry):
+        return self.versions[entry]
+
+    def prepare_runtime(self, entry, path):
+        with open(os.path.join(path, "entry"), "w") as entry_file:
+            entry_file.write("{0} {1}".format(entry, self.versions[entry]))
+
+
+def _create_pool():
+    return _Pool()
+
+
+class _Pool(object):
+    def __init__(self):
+        self._temp_dir = tempman.create_temp_dir()
+        root = os.path.join(self._temp_dir.path, "pool")
+        os.mkdir(root)
+        self._pool = _create_runtime_pool(root)
+
+    def __enter__(self):
+        return self._pool
+
+    def __exit__(self, *args):
+        self._pool.close()
+        self._temp_dir.close()
+
+
+def _create_runtime_pool(root):
+    console = Console(spur.LocalShell(), io.BytesIO())
+    builders = {None: DefaultBuilder, "fake": FakeBuilder, "versioned": VersionedBuilder}
+    return daemon.RuntimePool(builders, console, root, size=2)
+
+
+def _finished_pid():
+    process = subprocess.Popen(["true"])
+    process.wait()
+    return process.pid
+
+
+def _wait_until_ready(pool, language, entry, count, runtime_key=None):
+    _wait_until(lambda: pool.ready_count(language, entry, runtime_key=runtime_key) >= count)
+
+
+def _wait_until(condition):
+    timeout = time.time() + 5
+    while not condition():
+        assert time.time() < timeout, "Timed out"
+        time.sleep(0.01)
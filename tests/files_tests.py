@@ -4,7 +4,7 @@ import shutil
 import errno
 
 import spur
-from nose.tools import istest, assert_equal
+from nose.tools import istest, assert_equal, assert_raises
 
 from toodlepip import files
 
@@ -44,6 +44,38 @@ class FilesCopyTest(object):
         assert_equal(["a/b/c"], self._list_destination_files())
     
     
+    @istest
+    def file_contents_and_permissions_are_copied(self):
+        self._create_files(["a"])
+        source_path = os.path.join(self._source_dir, "a")
+        with open(source_path, "w") as source_file:
+            source_file.write("Hello")
+        os.chmod(source_path, 0o755)
+        
+        files.copy(self._source_dir, self._destination_dir)
+        
+        destination_path = os.path.join(self._destination_dir, "a")
+        with open(destination_path) as destination_file:
+            assert_equal("Hello", destination_file.read())
+        assert os.access(destination_path, os.X_OK)
+    
+    
+    @istest
+    def symlinks_are_copied_as_symlinks(self):
+        self._create_files(["a/b"])
+        os.symlink("a", os.path.join(self._source_dir, "c"))
+        files.copy(self._source_dir, self._destination_dir)
+        assert_equal("a", os.readlink(os.path.join(self._destination_dir, "c")))
+    
+    
+    @istest
+    def large_trees_are_copied(self):
+        filenames = ["{0}/{1}".format(index % 10, index) for index in range(500)]
+        self._create_files(filenames)
+        files.copy(self._source_dir, self._destination_dir)
+        assert_equal(sorted(filenames), sorted(self._list_destination_files()))
+    
+    
     @istest
     def files_ignored_by_git_are_ignored_by_copy(self):
         self._create_git_repo(
@@ -54,13 +86,254 @@ class FilesCopyTest(object):
         files.copy(self._source_dir, self._destination_dir)
         assert_equal([".gitignore", "b/a"], self._list_destination_files())
 
+    @istest
+    def directories_ignored_by_git_are_ignored_by_copy(self):
+        self._create_git_repo(
+            filenames=["a", "node_modules/b/c", "node_modules/d"],
+            gitignore="node_modules"
+        )
+        os.mkdir(self._destination_dir)
+        files.copy(self._source_dir, self._destination_dir)
+        assert_equal([".gitignore", "a"], sorted(self._list_destination_files()))
+        assert not os.path.exists(os.path.join(self._destination_dir, "node_modules"))
+    
+    
+    @istest
+    def copy_tree_copies_files_ignored_by_git_and_keeps_modification_times(self):
+        self._create_git_repo(filenames=["a", "lib/b"], gitignore="/lib")
+        os.utime(os.path.join(self._source_dir, "lib/b"), (1, 1))
+        files.copy_tree(self._source_dir, self._destination_dir)
+        destination_files = self._list_destination_files()
+        assert "lib/b" in destination_files, destination_files
+        assert os.path.exists(os.path.join(self._destination_dir, ".git/HEAD"))
+        assert_equal(1, os.stat(os.path.join(self._destination_dir, "lib/b")).st_mtime)
+
+    @istest
+    def copy_reports_number_of_files_and_time_taken_by_each_phase(self):
+        self._create_files(["a", "b/c"])
+        result = files.copy(self._source_dir, self._destination_dir)
+        assert_equal(2, result.file_count)
+        assert_equal(["filter", "walk", "copy"], [phase for phase, seconds in result.timings])
+
+    @istest
+    def git_snapshot_contains_committed_files_and_uncommitted_changes_to_tracked_files(self):
+        self._create_git_repo(filenames=["a", "b", "c/d"], gitignore="")
+        _git(self._source_dir, "add", ".")
+        _git(self._source_dir, "commit", "-m", "Initial commit")
+        with open(os.path.join(self._source_dir, "a"), "w") as changed_file:
+            changed_file.write("Changed")
+        os.remove(os.path.join(self._source_dir, "b"))
+        self._create_file("untracked")
+        
+        files.snapshot_git(self._source_dir, self._destination_dir)
+        
+        assert_equal([".gitignore", "a", "c/d"], sorted(self._list_destination_files()))
+        with open(os.path.join(self._destination_dir, "a")) as changed_file:
+            assert_equal("Changed", changed_file.read())
+    
+    
+    @istest
+    def git_snapshot_fails_if_git_archive_fails(self):
+        self._create_git_repo(filenames=["a"], gitignore="")
+        self._write_file("a", "Committed")
+        _git(self._source_dir, "add", ".")
+        _git(self._source_dir, "commit", "-m", "Initial commit")
+        blob = local.run(["git", "rev-parse", "HEAD:a"], cwd=self._source_dir).output.decode("ascii").strip()
+        os.remove(os.path.join(self._source_dir, ".git/objects", blob[:2], blob[2:]))
+        
+        assert_raises(files.SnapshotError, lambda: files.snapshot_git(self._source_dir, self._destination_dir))
+    
+    
+    @istest
+    def git_snapshot_copies_files_if_any_are_left_out_of_git_archive(self):
+        self._create_git_repo(filenames=["a", "b"], gitignore="")
+        self._write_file(".gitattributes", "b export-ignore\n")
+        _git(self._source_dir, "add", ".")
+        _git(self._source_dir, "commit", "-m", "Initial commit")
+        
+        files.snapshot_git(self._source_dir, self._destination_dir)
+        
+        assert_equal([".gitattributes", ".gitignore", "a", "b"], sorted(self._list_destination_files()))
+    
+    
+    @istest
+    def git_snapshot_copies_files_if_repository_has_no_commits(self):
+        self._create_git_repo(filenames=["a"], gitignore="")
+        files.snapshot_git(self._source_dir, self._destination_dir)
+        assert_equal([".gitignore", "a"], sorted(self._list_destination_files()))
+
+    @istest
+    def sync_copies_all_files_on_first_sync(self):
+        self._create_files(["a", "b/c"])
+        result = self._sync()
+        assert_equal(2, result.file_count)
+        assert_equal(["a", "b/c"], sorted(self._list_destination_files()))
+    
+    
+    @istest
+    def sync_only_copies_changed_files_on_subsequent_syncs(self):
+        self._create_files(["a", "b/c"])
+        self._sync()
+        self._write_file("a", "Changed")
+        
+        result = self._sync()
+        
+        assert_equal(1, result.file_count)
+        with open(os.path.join(self._destination_dir, "a")) as destination_file:
+            assert_equal("Changed", destination_file.read())
+    
+    
+    @istest
+    def sync_does_not_copy_files_that_are_touched_but_unchanged(self):
+        self._create_files(["a"])
+        self._sync()
+        path = os.path.join(self._source_dir, "a")
+        os.utime(path, (1, 1))
+        
+        result = self._sync()
+        
+        assert_equal(0, result.file_count)
+    
+    
+    @istest
+    def sync_copies_files_changed_in_destination(self):
+        self._create_files(["a"])
+        self._sync()
+        with open(os.path.join(self._destination_dir, "a"), "w") as destination_file:
+            destination_file.write("Changed")
+        
+        result = self._sync()
+        
+        assert_equal(1, result.file_count)
+        with open(os.path.join(self._destination_dir, "a")) as destination_file:
+            assert_equal("", destination_file.read())
+    
+    
+    @istest
+    def sync_removes_files_deleted_from_source(self):
+        self._create_files(["a", "b/c"])
+        self._sync()
+        shutil.rmtree(os.path.join(self._source_dir, "b"))
+        
+        self._sync()
+        
+        assert_equal(["a"], self._list_destination_files())
+        assert not os.path.exists(os.path.join(self._destination_dir, "b"))
+    
+    
+    @istest
+    def sync_removes_files_that_are_not_in_source(self):
+        self._create_files(["a"])
+        self._sync()
+        _mkdir_p(os.path.join(self._destination_dir, "build"))
+        for filename in ["b", "build/c"]:
+            open(os.path.join(self._destination_dir, filename), "w").close()
+        
+        self._sync()
+        
+        assert_equal(["a"], self._list_destination_files())
+        assert not os.path.exists(os.path.join(self._destination_dir, "build"))
+    
+    
+    @istest
+    def sync_keeps_files_that_are_not_in_source_if_keep_extra_files_is_set(self):
+        self._create_files(["a"])
+        self._sync()
+        open(os.path.join(self._destination_dir, "b"), "w").close()
+        
+        files.sync(self._source_dir, self._destination_dir, os.path.join(self._temp_dir, "index.json"), keep_extra_files=True)
+        
+        assert_equal(["a", "b"], sorted(self._list_destination_files()))
+    
+    
+    @istest
+    def sync_replaces_files_that_become_directories_and_directories_that_become_files(self):
+        self._create_files(["a", "b/c"])
+        self._sync()
+        os.remove(os.path.join(self._source_dir, "a"))
+        shutil.rmtree(os.path.join(self._source_dir, "b"))
+        self._create_file("a/d")
+        self._write_file("b", "File")
+        
+        self._sync()
+        
+        assert_equal(["a/d", "b"], sorted(self._list_destination_files()))
+        with open(os.path.join(self._destination_dir, "b")) as destination_file:
+            assert_equal("File", destination_file.read())
+    
+    
+    @istest
+    def sync_reports_copied_and_removed_files(self):
+        self._create_files(["a", "b", "c"])
+        self._sync()
+        self._write_file("a", "Changed")
+        os.remove(os.path.join(self._source_dir, "b"))
+        
+        result = self._sync()
+        
+        assert_equal(["a", "b"], result.filenames)
+
+    @istest
+    def tree_hash_only_includes_files_matching_patterns_if_given(self):
+        self._create_files(["setup.py", "requirements-dev.txt", "src/a.py"])
+        original_hash = files.tree_hash(self._source_dir, patterns=["setup.py", "requirements*.txt"])
+        self._write_file("src/a.py", "Changed")
+        assert_equal(original_hash, files.tree_hash(self._source_dir, patterns=["setup.py", "requirements*.txt"]))
+        self._write_file("requirements-dev.txt", "Changed")
+        assert original_hash != files.tree_hash(self._source_dir, patterns=["setup.py", "requirements*.txt"])
+
+    @istest
+    def tree_hash_changes_when_file_contents_change(self):
+        self._create_files(["a"])
+        original_hash = files.tree_hash(self._source_dir)
+        assert_equal(original_hash, files.tree_hash(self._source_dir))
+        self._write_file("a", "Changed")
+        assert original_hash != files.tree_hash(self._source_dir)
+    
+    
+    @istest
+    def tree_hash_changes_when_file_becomes_executable(self):
+        self._create_files(["a"])
+        original_hash = files.tree_hash(self._source_dir)
+        os.chmod(os.path.join(self._source_dir, "a"), 0o755)
+        assert original_hash != files.tree_hash(self._source_dir)
+    
+    
+    @istest
+    def git_tree_hash_only_includes_files_tracked_by_git(self):
+        self._create_git_repo(filenames=["a"], gitignore="")
+        _git(self._source_dir, "add", ".")
+        _git(self._source_dir, "commit", "-m", "Initial commit")
+        original_hash = files.git_tree_hash(self._source_dir)
+        self._create_file("untracked")
+        assert_equal(original_hash, files.git_tree_hash(self._source_dir))
+        self._write_file("a", "Changed")
+        assert original_hash != files.git_tree_hash(self._source_dir)
+    
+    
+    @istest
+    def tree_hash_does_not_change_when_ignored_files_change(self):
+        self._create_git_repo(filenames=["a", "b"], gitignore="/b")
+        original_hash = files.tree_hash(self._source_dir)
+        self._write_file("b", "Changed")
+        assert_equal(original_hash, files.tree_hash(self._source_dir))
+
+    def _sync(self):
+        return files.sync(self._source_dir, self._destination_dir, os.path.join(self._temp_dir, "index.json"))
+
     def _create_files(self, filenames):
         os.mkdir(self._source_dir)
         for filename in filenames:
-            path = os.path.join(self._source_dir, filename)
-            _mkdir_p(os.path.dirname(path))
-            with open(path, "w") as target:
-                target.write("")
+            self._create_file(filename)
+    
+    def _create_file(self, filename):
+        path = os.path.join(self._source_dir, filename)
+        _mkdir_p(os.path.dirname(path))
+        self._write_file(filename, "")
+    
+    def _write_file(self, filename, contents):
+        with open(os.path.join(self._source_dir, filename), "w") as target:
+            target.write(contents)
     
     def _create_git_repo(self, filenames, gitignore):
         self._create_files(filenames)
@@ -72,6 +345,13 @@ class FilesCopyTest(object):
         return list(files.all_filenames(self._destination_dir))
 
 
+def _git(cwd, *args):
+    local.run(
+        ["git", "-c", "user.name=Toodlepip", "-c", "user.email=toodlepip@example.com"] + list(args),
+        cwd=cwd,
+    )
+
+
 def _mkdir_p(path):
     try:
         os.makedirs(path)
@@ -0,0 +1,106 @@
+import shutil
+import tempfile
+
+from nose.tools import istest, assert_equal
+
+from toodlepip.history import BuildHistory, HistoryStore, describe_predictions, longest_first, predict_total
+from toodlepip.matrix import MatrixEntry, RuntimeGroup
+from toodlepip.timing import Timing
+
+
+@istest
+class BuildHistoryTests(object):
+    def setup(self):
+        self._temp_dir = tempfile.mkdtemp()
+        self._history = HistoryStore(self._temp_dir).for_project("/project")
+
+    def teardown(self):
+        shutil.rmtree(self._temp_dir)
+
+    @istest
+    def there_are_no_estimates_without_history(self):
+        estimates = self._history.estimates()
+        assert not estimates.known
+        assert_equal(None, estimates.entry(MatrixEntry("2.7")))
+
+    @istest
+    def entry_is_estimated_from_median_of_recent_durations(self):
+        for seconds in [1.0, 10.0, 2.0]:
+            self._history.record([_timing("entry", "build", "2.7", seconds)])
+        assert_equal(2.0, self._history.estimates().entry(MatrixEntry("2.7")))
+
+    @istest
+    def only_recent_durations_are_kept(self):
+        for seconds in [100.0, 100.0, 100.0, 1.0, 1.0, 1.0, 1.0, 1.0]:
+            self._history.record([_timing("entry", "build", "2.7", seconds)])
+        assert_equal(1.0, self._history.estimates().entry(MatrixEntry("2.7")))
+
+    @istest
+    def entries_without_history_are_estimated_from_entries_with_same_runtime(self):
+        self._history.record([
+            _timing("entry", "build", "2.7 A=1", 4.0),
+            _timing("entry", "build", "2.7 A=2", 6.0),
+            _timing("entry", "build", "pypy A=1", 20.0),
+        ])
+        estimates = self._history.estimates()
+        assert_equal(5.0, estimates.entry(MatrixEntry("2.7", "A=3")))
+        assert_equal(10.0, estimates.entry(MatrixEntry("3.4", "A=1")))
+
+    @istest
+    def group_is_estimated_from_runtime_creation_and_entries(self):
+        self._history.record([
+            _timing("runtime", "create", "2.7", 3.0),
+            _timing("entry", "build", "2.7 A=1", 4.0),
+            _timing("entry", "build", "2.7 A=2", 6.0),
+        ])
+        group = RuntimeGroup("2.7", [MatrixEntry("2.7", "A=1"), MatrixEntry("2.7", "A=2")])
+        assert_equal(13.0, self._history.estimates().group(group))
+
+    @istest
+    def history_is_kept_for_each_project(self):
+        self._history.record([_timing("entry", "build", "2.7", 1.0)])
+        other_history = HistoryStore(self._temp_dir).for_project("/other-project")
+        assert not other_history.estimates().known
+
+
+@istest
+def values_are_ordered_longest_first_keeping_order_of_equal_estimates():
+    estimates = {"a": 1.0, "b": 5.0, "c": None, "d": 5.0}
+    assert_equal(["b", "d", "a", "c"], longest_first(["a", "b", "c", "d"], estimates.get))
+
+
+@istest
+def total_is_predicted_by_starting_longest_work_first_on_free_worker():
+    assert_equal(6.0, predict_total([1.0, 2.0, 3.0], 1))
+    assert_equal(3.0, predict_total([1.0, 2.0, 3.0], 2))
+    assert_equal(5.0, predict_total([5.0, 1.0, 1.0, 1.0], 3))
+
+
+@istest
+def predictions_name_step_that_slowed_down_most():
+    temp_dir = tempfile.mkdtemp()
+    try:
+        history = BuildHistory("{0}/history.json".format(temp_dir))
+        history.record([
+            _timing("entry", "build", "2.7", 5.0),
+            _timing("step", "install", "2.7", 1.0),
+            _timing("step", "script", "2.7", 4.0),
+        ])
+        records = [
+            _timing("entry", "build", "2.7", 12.0),
+            _timing("step", "install", "2.7", 2.0),
+            _timing("step", "script", "2.7", 10.0),
+        ]
+        description = describe_predictions(history.estimates(), [MatrixEntry("2.7")], records, 5.0, 12.5)
+    finally:
+        shutil.rmtree(temp_dir)
+
+    assert_equal(
+        "Predicted 5.0s, took 12.5s\n"
+        "  2.7: predicted 5.0s, took 12.0s (script took 10.0s, usually 4.0s)\n",
+        description,
+    )
+
+
+def _timing(kind, name, entry, wall):
+    return Timing(kind=kind, name=name, entry=entry, start=0, wall=wall, cpu=None)
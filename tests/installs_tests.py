@@ -0,0 +1,63 @@
+import os
+import tempfile
+import shutil
+
+from nose.tools import istest, assert_equal
+
+from toodlepip.caches import DirectoryCache
+from toodlepip.config import TravisConfig
+from toodlepip.matrix import MatrixEntry
+from toodlepip.installs import InstallCache
+
+
+@istest
+class InstallCacheTests(object):
+    def setup(self):
+        self._temp_dir = tempfile.mkdtemp()
+        self._project_dir = os.path.join(self._temp_dir, "project")
+        cache_dir = os.path.join(self._temp_dir, "cache")
+        os.mkdir(self._project_dir)
+        os.mkdir(cache_dir)
+        self._cache = InstallCache(DirectoryCache(cache_dir))
+        self._write("setup.py", "setup()")
+        self._write("module.py", "")
+
+    def teardown(self):
+        shutil.rmtree(self._temp_dir)
+
+    @istest
+    def snapshots_are_found_by_key(self):
+        key = self._key()
+        assert_equal(None, self._cache.find(key))
+        self._cache.store(key, os.mkdir)
+        assert os.path.isdir(self._cache.find(key))
+
+    @istest
+    def key_depends_on_install_files_but_not_other_files(self):
+        original_key = self._key()
+        self._write("module.py", "changed")
+        assert_equal(original_key, self._key())
+        self._write("setup.py", "changed")
+        assert original_key != self._key()
+
+    @istest
+    def key_depends_on_install_commands_entry_and_runtime(self):
+        keys = set([
+            self._key(),
+            self._key(travis_yml={"install": ["pip install -e ."]}),
+            self._key(travis_yml={"before_install": ["pip install tox"]}),
+            self._key(entry=MatrixEntry("2.6")),
+            self._key(entry=MatrixEntry("2.7", env="A=1")),
+            self._key(runtime_key="other-virtualenv"),
+        ])
+        assert_equal(6, len(keys))
+
+    def _key(self, travis_yml=None, entry=None, runtime_key="virtualenv"):
+        project_config = TravisConfig(travis_yml or {})
+        if entry is None:
+            entry = MatrixEntry("2.7")
+        return self._cache.key(self._project_dir, project_config, entry, runtime_key, ["setup.py"])
+
+    def _write(self, filename, contents):
+        with open(os.path.join(self._project_dir, filename), "w") as project_file:
+            project_file.write(contents)
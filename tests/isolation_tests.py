@@ -0,0 +1,60 @@
+import os
+
+import spur
+import tempman
+from nose.tools import istest, assert_equal
+from nose.plugins.skip import SkipTest
+
+from toodlepip import isolation
+
+
+local = spur.LocalShell()
+
+
+@istest
+def commands_in_namespace_have_private_tmp_directory():
+    with _create_namespace() as namespace:
+        with tempman.create_temp_dir() as temp_dir:
+            command = namespace.shell_command(["ls", "-A", "/tmp"], cwd=temp_dir.path)
+            result = local.run(command)
+            tmp_entries = result.output.decode("utf8").split()
+            assert_equal([os.path.relpath(temp_dir.path, "/tmp")], tmp_entries)
+
+
+@istest
+def working_directory_is_kept_if_under_tmp():
+    with _create_namespace() as namespace:
+        with tempman.create_temp_dir() as temp_dir:
+            command = namespace.shell_command(["sh", "-c", "pwd; echo hello > file"], cwd=temp_dir.path)
+            result = local.run(command)
+            assert_equal(temp_dir.path, result.output.decode("utf8").strip())
+            with open(os.path.join(temp_dir.path, "file")) as output_file:
+                assert_equal("hello\n", output_file.read())
+
+
+@istest
+def command_is_first_process_in_namespace():
+    with _create_namespace() as namespace:
+        result = local.run(namespace.shell_command(["sh", "-c", "echo $$"]))
+        assert_equal(b"1", result.output.strip())
+
+
+@istest
+def changes_to_overlays_are_not_written_to_host():
+    if not isolation.supports_overlays():
+        raise SkipTest("Overlays are not supported")
+    with _create_namespace() as namespace:
+        with tempman.create_temp_dir() as temp_dir:
+            with open(os.path.join(temp_dir.path, "original"), "w") as original_file:
+                original_file.write("original")
+            namespace.overlay(temp_dir.path)
+            script = "cat original; echo; rm original; echo new > new; ls"
+            result = local.run(namespace.shell_command(["sh", "-c", script], cwd=temp_dir.path))
+            assert_equal(["original", "new"], result.output.decode("utf8").split())
+            assert_equal(["original"], os.listdir(temp_dir.path))
+
+
+def _create_namespace():
+    if not isolation.is_supported():
+        raise SkipTest("Namespaces are not supported")
+    return isolation.create_namespace()
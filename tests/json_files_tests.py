@@ -0,0 +1,36 @@
+import os
+import threading
+
+import tempman
+from nose.tools import istest, assert_equal, assert_not_equal
+
+from toodlepip.json_files import JsonFile, project_file_path
+
+
+@istest
+def files_of_different_projects_have_different_paths():
+    assert_equal(project_file_path("/data", "/project"), project_file_path("/data", "/project/"))
+    assert_not_equal(project_file_path("/data", "/project"), project_file_path("/data", "/other-project"))
+
+
+@istest
+def updates_from_separate_writers_are_not_lost():
+    with tempman.create_temp_dir() as temp_dir:
+        path = os.path.join(temp_dir.path, "file.json")
+        
+        def _increment(value):
+            value["count"] = value.get("count", 0) + 1
+            return value
+        
+        def _update():
+            json_file = JsonFile(path)
+            for index in range(20):
+                json_file.update(_increment)
+        
+        threads = [threading.Thread(target=_update) for index in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        assert_equal({"count": 80}, JsonFile(path).read())
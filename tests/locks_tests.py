@@ -0,0 +1,32 @@
+import os
+import time
+import threading
+
+import tempman
+from nose.tools import istest, assert_equal
+
+from toodlepip.locks import FileLock
+
+
+@istest
+def lock_waits_until_released_by_other_holder():
+    with tempman.create_temp_dir() as temp_dir:
+        path = os.path.join(temp_dir.path, "lock")
+        events = []
+        first_lock = FileLock(path)
+        first_lock.acquire()
+        
+        def _acquire_second():
+            second_lock = FileLock(path)
+            second_lock.acquire(on_wait=lambda: events.append("waiting"))
+            events.append("acquired")
+            second_lock.release()
+        
+        thread = threading.Thread(target=_acquire_second)
+        thread.start()
+        time.sleep(0.2)
+        events.append("released")
+        first_lock.release()
+        thread.join()
+        
+        assert_equal(["waiting", "released", "acquired"], events)
@@ -0,0 +1,83 @@
+from nose.tools import istest, assert_equal
+
+from toodlepip import matrix
+from toodlepip.config import TravisConfig
+
+
+@istest
+def each_runtime_is_an_entry_if_there_is_no_env():
+    entries = _expand({}, ["2.6", "2.7"])
+    assert_equal([("2.6", None), ("2.7", None)], _describe(entries))
+
+
+@istest
+def runtimes_are_combined_with_each_env_row():
+    entries = _expand({"env": ["A=1", "A=2"]}, ["2.6", "2.7"])
+    assert_equal(
+        [("2.6", "A=1"), ("2.6", "A=2"), ("2.7", "A=1"), ("2.7", "A=2")],
+        _describe(entries),
+    )
+
+
+@istest
+def global_env_is_exported_for_every_row():
+    entries = _expand({"env": {"global": ["G=1", {"secure": "..."}], "matrix": ["A=1"]}}, ["2.7"])
+    assert_equal([("2.7", "A=1")], _describe(entries))
+    assert_equal(("G=1", "A=1"), entries[0].exports)
+
+
+@istest
+def excluded_entries_are_removed():
+    entries = _expand(
+        {"env": ["A=1", "A=2"], "matrix": {"exclude": [{"python": 2.6, "env": "A=2"}]}},
+        ["2.6", "2.7"],
+    )
+    assert_equal([("2.6", "A=1"), ("2.7", "A=1"), ("2.7", "A=2")], _describe(entries))
+
+
+@istest
+def included_entries_are_added_using_first_runtime_by_default():
+    entries = _expand(
+        {"matrix": {"include": [{"python": "3.4", "env": "A=1"}, {"env": ["B=1", "C=1"]}]}},
+        ["2.7"],
+    )
+    assert_equal([("2.7", None), ("3.4", "A=1"), ("2.7", "B=1 C=1")], _describe(entries))
+
+
+@istest
+def duplicate_entries_are_removed():
+    entries = _expand(
+        {"env": ["A=1", "A=1"], "matrix": {"include": [{"python": "2.7", "env": "A=1"}]}},
+        ["2.7", 2.7],
+    )
+    assert_equal([("2.7", "A=1")], _describe(entries))
+
+
+@istest
+def entries_matching_allow_failures_are_allowed_to_fail():
+    entries = _expand(
+        {"env": ["A=1", "A=2"], "matrix": {"allow_failures": [{"env": "A=2"}, {"os": "osx"}]}},
+        ["2.7"],
+    )
+    assert_equal([False, True], [entry.allow_failure for entry in entries])
+
+
+@istest
+def entries_are_grouped_by_runtime_in_order_of_first_appearance():
+    entries = _expand(
+        {"env": ["A=1", "A=2"], "matrix": {"include": [{"python": "2.6", "env": "A=3"}]}},
+        ["2.7", "2.6"],
+    )
+    groups = matrix.group_by_runtime(entries)
+    assert_equal(
+        [("2.7", ["A=1", "A=2"]), ("2.6", ["A=1", "A=2", "A=3"])],
+        [(group.runtime, [entry.env for entry in group.entries]) for group in groups],
+    )
+
+
+def _expand(travis_yml, runtimes):
+    return matrix.expand(TravisConfig(travis_yml), "python", runtimes)
+
+
+def _describe(entries):
+    return [(str(entry.runtime), entry.env) for entry in entries]
@@ -0,0 +1,74 @@
+import io
+import threading
+
+from nose.tools import istest, assert_equal
+
+from toodlepip.output import OutputPipeline
+
+
+@istest
+def output_is_written_to_stdout():
+    stdout = io.BytesIO()
+    with OutputPipeline(stdout) as output:
+        output.write(b"one\n")
+        output.write(b"two\n")
+    assert_equal(b"one\ntwo\n", stdout.getvalue())
+
+
+@istest
+def all_output_is_written_to_log_file():
+    stdout = io.BytesIO()
+    log_file = io.BytesIO()
+    with OutputPipeline(stdout, log_file=log_file) as output:
+        output.write(b"one\n")
+    assert_equal(b"one\n", log_file.getvalue())
+
+
+@istest
+def oldest_lines_are_skipped_if_stdout_cannot_keep_up():
+    stdout = BlockedOutput()
+    log_file = io.BytesIO()
+    with OutputPipeline(stdout, log_file=log_file, max_buffered=8) as output:
+        output.write(b"first\n")
+        stdout.written.wait()
+        for index in range(4):
+            output.write("line {0}\n".format(index).encode("ascii"))
+        stdout.unblock.set()
+
+    assert_equal(b"first\n[toodlepip: skipped 21 bytes of output]\nline 3\n", stdout.getvalue())
+    assert_equal(b"first\nline 0\nline 1\nline 2\nline 3\n", log_file.getvalue())
+
+
+@istest
+def writes_larger_than_buffer_are_not_skipped_if_stdout_keeps_up():
+    stdout = io.BytesIO()
+    log_file = io.BytesIO()
+    output_bytes = b"".join("line {0}\n".format(index).encode("ascii") for index in range(10000))
+    with OutputPipeline(stdout, log_file=log_file, max_buffered=1024) as output:
+        output.write(output_bytes)
+    assert_equal(output_bytes, stdout.getvalue())
+
+
+@istest
+def output_is_not_skipped_without_log_file():
+    stdout = BlockedOutput()
+    with OutputPipeline(stdout, max_buffered=8) as output:
+        output.write(b"first\n")
+        stdout.written.wait()
+        threading.Timer(0.2, stdout.unblock.set).start()
+        for index in range(4):
+            output.write("line {0}\n".format(index).encode("ascii"))
+
+    assert_equal(b"first\nline 0\nline 1\nline 2\nline 3\n", stdout.getvalue())
+
+
+class BlockedOutput(io.BytesIO):
+    def __init__(self):
+        super(BlockedOutput, self).__init__()
+        self.written = threading.Event()
+        self.unblock = threading.Event()
+
+    def write(self, output):
+        super(BlockedOutput, self).write(output)
+        self.written.set()
+        self.unblock.wait()
@@ -0,0 +1,93 @@
+import os
+import tempfile
+import shutil
+
+from nose.tools import istest, assert_equal
+
+from toodlepip.platforms.interpreters import InterpreterRegistry
+
+
+@istest
+class InterpreterRegistryTests(object):
+    def setup(self):
+        self._temp_dir = tempfile.mkdtemp()
+        self._bin_dir = os.path.join(self._temp_dir, "bin")
+        os.mkdir(self._bin_dir)
+        self._probe_log = os.path.join(self._temp_dir, "probes")
+        self._registry_path = os.path.join(self._temp_dir, "interpreters.json")
+
+    def teardown(self):
+        shutil.rmtree(self._temp_dir)
+
+    @istest
+    def interpreters_on_search_path_are_found_with_their_version(self):
+        self._create_interpreter("python9.9", version="9.9.1")
+        interpreter = self._registry().find("python9.9")
+        assert_equal(os.path.join(self._bin_dir, "python9.9"), interpreter.path)
+        assert_equal("9.9.1", interpreter.version)
+        assert_equal("cpython-99", interpreter.abi)
+
+    @istest
+    def none_is_returned_if_interpreter_is_not_on_search_path(self):
+        self._create_interpreter("python9.9", version="9.9.1")
+        assert_equal(None, self._registry().find("python9.8"))
+
+    @istest
+    def interpreters_that_fail_to_run_are_ignored(self):
+        self._create_file("python9.9", "#!/bin/sh\nexit 1\n")
+        assert_equal(None, self._registry().find("python9.9"))
+
+    @istest
+    def interpreters_are_only_probed_once(self):
+        self._create_interpreter("python9.9", version="9.9.1")
+        self._registry().find("python9.9")
+        self._registry().find("python9.9")
+        assert_equal(1, self._probe_count())
+
+    @istest
+    def interpreters_are_probed_again_if_binary_changes(self):
+        path = self._create_interpreter("python9.9", version="9.9.1")
+        self._registry().find("python9.9")
+        self._create_interpreter("python9.9", version="9.9.2")
+        os.utime(path, (1, 1))
+
+        interpreter = self._registry().find("python9.9")
+
+        assert_equal("9.9.2", interpreter.version)
+        assert_equal(2, self._probe_count())
+
+    @istest
+    def interpreters_are_found_again_if_binary_is_removed(self):
+        other_bin_dir = os.path.join(self._temp_dir, "other-bin")
+        os.mkdir(other_bin_dir)
+        search_path = lambda: os.pathsep.join([self._bin_dir, other_bin_dir])
+        path = self._create_interpreter("python9.9", version="9.9.1")
+        InterpreterRegistry(self._registry_path, search_path=search_path).find("python9.9")
+        os.remove(path)
+        os.rename(self._create_interpreter("python9.9", version="9.9.2"), os.path.join(other_bin_dir, "python9.9"))
+
+        interpreter = InterpreterRegistry(self._registry_path, search_path=search_path).find("python9.9")
+
+        assert_equal(os.path.join(other_bin_dir, "python9.9"), interpreter.path)
+        assert_equal("9.9.2", interpreter.version)
+
+    def _registry(self):
+        return InterpreterRegistry(self._registry_path, search_path=lambda: self._bin_dir)
+
+    def _create_interpreter(self, name, version):
+        return self._create_file(name, (
+            "#!/bin/sh\n"
+            "echo >> {0}\n"
+            "echo '{{\"implementation\": \"CPython\", \"version\": \"{1}\", \"abi\": \"cpython-99\"}}'\n"
+        ).format(self._probe_log, version))
+
+    def _create_file(self, name, contents):
+        path = os.path.join(self._bin_dir, name)
+        with open(path, "w") as script_file:
+            script_file.write(contents)
+        os.chmod(path, 0o755)
+        return path
+
+    def _probe_count(self):
+        with open(self._probe_log) as probe_log:
+            return len(probe_log.read().splitlines())
@@ -1,9 +1,15 @@
 import io
+import os
+import json
+import shutil
+import tempfile
 
 import spur
-from nose.tools import istest
+from nose.tools import istest, assert_equal
 
-from toodlepip.build import create_builder
+from toodlepip.build import create_builder, Step
+from toodlepip.platforms.python import PythonRuntime, _PipDirs
+from toodlepip.platforms import python
 from .. import testing
 
 
@@ -35,3 +41,200 @@ class PythonBuilderTests(object):
     def _assert_stdout_contains(self, expected):
         output = self._stdout.getvalue()
         assert expected in output, "Output was: {0}".format(output)
+
+
+@istest
+def python_runtime_activates_virtualenv_and_points_pip_at_shared_caches():
+    runtime = PythonRuntime(None, "/tmp/virtualenv", _PipDirs(cache_dir="/tmp/cache", wheel_dir="/tmp/wheels"))
+    setup = runtime.before_step(Step("install", []))
+    assert setup.startswith(". /tmp/virtualenv/bin/activate;"), setup
+    assert "export PIP_CACHE_DIR=/tmp/cache" in setup, setup
+    assert "export PIP_FIND_LINKS=/tmp/wheels" in setup, setup
+
+
+@istest
+def python_runtime_builds_wheels_after_install_step_only():
+    runtime = PythonRuntime(None, "/tmp/virtualenv", _PipDirs(cache_dir="/tmp/cache", wheel_dir="/tmp/wheels"))
+    assert runtime.after_step(Step("install", [])) is not None
+    assert runtime.after_step(Step("script", [])) is None
+
+
+@istest
+def wheels_are_not_built_for_project():
+    runtime = PythonRuntime(None, "/tmp/virtualenv", _PipDirs(cache_dir="/tmp/cache", wheel_dir="/tmp/wheels"), project_dir="/tmp/project")
+    command = runtime.after_step(Step("install", []))
+    assert command.actual.endswith(" /tmp/wheels /tmp/project"), command.actual
+
+
+@istest
+def test_runner_is_found_for_nose_and_pytest_commands():
+    project_dir = tempfile.mkdtemp()
+    try:
+        os.mkdir(os.path.join(project_dir, "tests"))
+        for command in ["nosetests tests", "_virtualenv/bin/nosetests", "python -m pytest -x", "py.test"]:
+            assert python.find_test_runner(command, project_dir) is not None, command
+    finally:
+        shutil.rmtree(project_dir)
+
+
+@istest
+def test_runner_is_not_found_for_other_commands_or_shell_syntax():
+    for command in ["make test", "nosetests tests && coverage report", "nosetests $TESTS", "cd tests; pytest"]:
+        assert_equal(None, python.find_test_runner(command, "/project"))
+
+
+@istest
+def test_paths_in_command_are_replaced_by_files_in_shard():
+    project_dir = tempfile.mkdtemp()
+    try:
+        os.mkdir(os.path.join(project_dir, "tests"))
+        test_runner = python.find_test_runner("pytest tests -x", project_dir)
+        assert_equal(
+            "pytest -x --junitxml=/tmp/report.xml tests/a_test.py tests/b_test.py",
+            test_runner.shard_command(["tests/a_test.py", "tests/b_test.py"], "/tmp/report.xml"),
+        )
+    finally:
+        shutil.rmtree(project_dir)
+
+
+@istest
+def values_of_options_are_kept_in_shards():
+    project_dir = tempfile.mkdtemp()
+    try:
+        os.mkdir(os.path.join(project_dir, "tests"))
+        open(os.path.join(project_dir, "setup.cfg"), "w").close()
+        test_runner = python.find_test_runner("pytest -c setup.cfg --rootdir . tests", project_dir)
+        assert_equal(
+            "pytest -c setup.cfg --rootdir . --junitxml=/tmp/report.xml tests/a_test.py",
+            test_runner.shard_command(["tests/a_test.py"], "/tmp/report.xml"),
+        )
+    finally:
+        shutil.rmtree(project_dir)
+
+
+@istest
+def commands_with_paths_after_unknown_options_or_writing_output_files_are_not_sharded():
+    project_dir = tempfile.mkdtemp()
+    try:
+        os.mkdir(os.path.join(project_dir, "tests"))
+        os.mkdir(os.path.join(project_dir, "toodlepip"))
+        for command in [
+            "pytest --cov toodlepip tests",
+            "pytest --unknown-option toodlepip tests",
+            "nosetests --with-coverage tests",
+            "nosetests -w tests",
+            "nosetests tests.build_tests",
+        ]:
+            assert_equal(None, python.find_test_runner(command, project_dir))
+    finally:
+        shutil.rmtree(project_dir)
+
+
+@istest
+def nose_tests_that_cant_be_found_in_files_are_not_sharded():
+    project_dir = tempfile.mkdtemp()
+    try:
+        os.mkdir(os.path.join(project_dir, "tests"))
+        for filename in ["test_a.py", "test_b.py"]:
+            open(os.path.join(project_dir, "tests", filename), "w").close()
+        report_path = os.path.join(project_dir, "collected.xml")
+        with open(report_path, "w") as report_file:
+            report_file.write(
+                '<testsuite>'
+                '<testcase classname="test_a" name="test" time="0"/>'
+                '<testcase classname="test_b" name="test" time="0"/>'
+                '</testsuite>'
+            )
+        test_runner = python.find_test_runner("nosetests tests", project_dir)
+        assert_equal(None, test_runner.read_collected(report_path, project_dir))
+    finally:
+        shutil.rmtree(project_dir)
+
+
+@istest
+class PythonRuntimeSnapshotTests(object):
+    def setup(self):
+        self._temp_dir = tempfile.mkdtemp()
+        self._project_dir = self._path("project")
+        self._site_packages_dir = self._path("virtualenv/lib/python2.7/site-packages")
+        os.makedirs(self._project_dir)
+        os.makedirs(self._path("virtualenv/bin"))
+        os.makedirs(self._site_packages_dir)
+        self._write("virtualenv/bin/activate", 'VIRTUAL_ENV="{0}"'.format(self._path("virtualenv")))
+        self._runtime = self._create_runtime(self._path("virtualenv"))
+
+    def teardown(self):
+        shutil.rmtree(self._temp_dir)
+
+    @istest
+    def paths_to_virtualenv_and_project_are_updated_when_snapshot_is_restored(self):
+        self._write("virtualenv/lib/python2.7/site-packages/project.egg-link", self._project_dir)
+        self._runtime.snapshot_install(self._path("snapshot"), self._project_dir)
+        
+        os.makedirs(self._path("other/virtualenv"))
+        other_runtime = self._create_runtime(self._path("other/virtualenv"))
+        other_runtime.restore_install(self._path("snapshot"), self._path("other/project"))
+        
+        assert_equal(
+            'VIRTUAL_ENV="{0}"'.format(self._path("other/virtualenv")),
+            self._read("other/virtualenv/bin/activate"),
+        )
+        assert_equal(
+            self._path("other/project"),
+            self._read("other/virtualenv/lib/python2.7/site-packages/project.egg-link"),
+        )
+
+    @istest
+    def metadata_written_into_project_is_restored_with_snapshot(self):
+        os.makedirs(self._path("project/src/project.egg-info"))
+        self._write("project/src/project.egg-info/entry_points.txt", "[console_scripts]")
+        self._runtime.snapshot_install(self._path("snapshot"), self._project_dir)
+        
+        os.makedirs(self._path("other/virtualenv"))
+        os.makedirs(self._path("other/project/src"))
+        other_runtime = self._create_runtime(self._path("other/virtualenv"))
+        other_runtime.restore_install(self._path("snapshot"), self._path("other/project"))
+        
+        assert_equal("[console_scripts]", self._read("other/project/src/project.egg-info/entry_points.txt"))
+
+    @istest
+    def project_is_installed_in_place_if_installed_in_development_mode(self):
+        self._write_direct_url({"url": "file://{0}".format(self._project_dir), "dir_info": {"editable": True}})
+        assert self._runtime.installs_project_in_place(self._project_dir)
+        self._write_direct_url({"url": "file://{0}".format(self._project_dir), "dir_info": {}})
+        assert not self._runtime.installs_project_in_place(self._project_dir)
+
+    @istest
+    def project_is_installed_in_place_if_linked_by_setup_py_develop(self):
+        self._write("virtualenv/lib/python2.7/site-packages/project.egg-link", self._project_dir + "/src\n.")
+        self._write("virtualenv/lib/python2.7/site-packages/easy-install.pth", self._project_dir + "/src\n")
+        assert self._runtime.installs_project_in_place(self._project_dir)
+
+    @istest
+    def project_is_not_installed_in_place_without_link_to_project(self):
+        # As when installed by setup.py install, or pip before 20.1
+        os.makedirs(os.path.join(self._site_packages_dir, "project-1.0-py2.7.egg-info"))
+        self._write("virtualenv/lib/python2.7/site-packages/easy-install.pth", "./other-1.0-py2.7.egg\n")
+        assert not self._runtime.installs_project_in_place(self._project_dir)
+
+    def _create_runtime(self, virtualenv_dir):
+        pip_dirs = _PipDirs(cache_dir="/tmp/cache", wheel_dir="/tmp/wheels")
+        return PythonRuntime(None, virtualenv_dir, pip_dirs, install_key="virtualenv")
+
+    def _write_direct_url(self, direct_url):
+        dist_info_dir = os.path.join(self._site_packages_dir, "project-1.0.dist-info")
+        if not os.path.isdir(dist_info_dir):
+            os.mkdir(dist_info_dir)
+        with open(os.path.join(dist_info_dir, "direct_url.json"), "w") as direct_url_file:
+            json.dump(direct_url, direct_url_file)
+
+    def _path(self, path):
+        return os.path.join(self._temp_dir, path)
+
+    def _write(self, path, contents):
+        with open(self._path(path), "w") as target:
+            target.write(contents)
+
+    def _read(self, path):
+        with open(self._path(path)) as source:
+            return source.read()
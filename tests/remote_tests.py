@@ -0,0 +1,65 @@
+import io
+import os
+import time
+import threading
+
+import spur
+from nose.tools import istest, assert_equal
+
+from toodlepip.consoles import Console
+from toodlepip.remote import RemoteHost, create_archive, parse_host
+from . import testing
+
+
+@istest
+def host_is_hostname_with_optional_user_and_port():
+    assert_equal((None, "build-box", 22), parse_host("build-box"))
+    assert_equal(("bob", "build-box", 22), parse_host("bob@build-box"))
+    assert_equal(("bob", "build-box", 2222), parse_host("bob@build-box:2222"))
+
+
+@istest
+def entry_is_built_on_host_using_uploaded_project():
+    travis_yml = {"env": ["A=1", "A=2"], "script": 'echo "A is $A"; cat message'}
+    stdout = io.BytesIO()
+    console = Console(spur.LocalShell(), stdout)
+    host = RemoteHost("loopback", spur.LocalShell())
+    with testing.create_project(travis_yml) as project:
+        with open(os.path.join(project.path, "message"), "w") as message_file:
+            message_file.write("Hello from the project\n")
+        with create_archive(console, project.path) as archive_path:
+            remote_dir = host.upload(console, archive_path)
+            try:
+                result = host.build(console, remote_dir, 1, label="A=2")
+            finally:
+                host.remove(remote_dir)
+
+    assert_equal(0, result.return_code)
+    output = stdout.getvalue()
+    assert b"Building A=2 on loopback" in output, "Output was: {0}".format(output)
+    assert b"A is 2\n" in output, "Output was: {0}".format(output)
+    assert b"A is 1\n" not in output, "Output was: {0}".format(output)
+    assert b"Hello from the project\n" in output, "Output was: {0}".format(output)
+    assert not os.path.exists(remote_dir)
+
+
+@istest
+def remote_build_is_interrupted_when_build_is_cancelled():
+    travis_yml = {"script": "sleep 10", "after_script": "echo cleaning up"}
+    stdout = io.BytesIO()
+    console = Console(spur.LocalShell(), stdout)
+    host = RemoteHost("loopback", spur.LocalShell())
+    with testing.create_project(travis_yml) as project:
+        with create_archive(console, project.path) as archive_path:
+            remote_dir = host.upload(console, archive_path)
+            try:
+                timer = threading.Timer(1, console.cancellation.cancel)
+                timer.start()
+                start = time.time()
+                result = host.build(console, remote_dir, 0)
+            finally:
+                host.remove(remote_dir)
+
+    assert time.time() - start < 8
+    assert result.cancelled
+    assert b"cleaning up\n" in stdout.getvalue(), "Output was: {0}".format(stdout.getvalue())
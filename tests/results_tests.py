@@ -0,0 +1,55 @@
+import tempfile
+import shutil
+
+from nose.tools import istest, assert_equal
+
+from toodlepip.caches import DirectoryCache
+from toodlepip.config import TravisConfig
+from toodlepip.matrix import MatrixEntry
+from toodlepip.results import ResultCache
+
+
+@istest
+class ResultCacheTests(object):
+    def setup(self):
+        self._temp_dir = tempfile.mkdtemp()
+        self._cache = ResultCache(DirectoryCache(self._temp_dir))
+
+    def teardown(self):
+        shutil.rmtree(self._temp_dir)
+
+    @istest
+    def stored_results_are_found_by_key(self):
+        key = self._key("tree", MatrixEntry("2.7"))
+        assert_equal(None, self._cache.find(key))
+        self._cache.store(key, 0, b"Output")
+        result = self._cache.find(key)
+        assert_equal(0, result.return_code)
+        assert_equal(b"Output", result.output)
+
+    @istest
+    def failed_results_are_not_stored(self):
+        key = self._key("tree", MatrixEntry("2.7"))
+        self._cache.store(key, 1, b"Output")
+        assert_equal(None, self._cache.find(key))
+
+    @istest
+    def key_depends_on_tree_and_entry(self):
+        keys = set([
+            self._key("tree", MatrixEntry("2.7")),
+            self._key("other-tree", MatrixEntry("2.7")),
+            self._key("tree", MatrixEntry("2.6")),
+            self._key("tree", MatrixEntry("2.7", env="A=1")),
+            self._key("tree", MatrixEntry("2.7"), runtime_key="/usr/bin/python2.7 2.7.18"),
+        ])
+        assert_equal(5, len(keys))
+
+    @istest
+    def key_does_not_depend_on_type_of_runtime(self):
+        assert_equal(
+            self._key("tree", MatrixEntry("2.7")),
+            self._key("tree", MatrixEntry(2.7)),
+        )
+
+    def _key(self, tree_hash, entry, runtime_key=None):
+        return self._cache.key(tree_hash, TravisConfig({}, content_hash="config"), entry, runtime_key=runtime_key)
@@ -0,0 +1,184 @@
+import io
+import os
+import shutil
+import tempfile
+
+import spur
+from nose.tools import istest, assert_equal
+
+from toodlepip.build import CommandsRunner, Step
+from toodlepip.consoles import Console
+from toodlepip.platforms import python
+from toodlepip import sharding
+from toodlepip.sharding import DurationHistory, module_file, read_junit_durations, split_into_shards
+
+
+@istest
+def longest_files_are_spread_across_shards():
+    durations = {"a.py": 5.0, "b.py": 4.0, "c.py": 3.0, "d.py": 2.0}
+    shards = split_into_shards(["a.py", "b.py", "c.py", "d.py"], durations, 2)
+    assert_equal([["a.py", "d.py"], ["b.py", "c.py"]], shards)
+
+
+@istest
+def files_without_durations_are_assumed_to_take_mean_duration():
+    durations = {"a.py": 4.0, "b.py": 2.0}
+    shards = split_into_shards(["a.py", "b.py", "c.py"], durations, 2)
+    assert_equal([["a.py"], ["b.py", "c.py"]], shards)
+
+
+@istest
+def there_are_no_more_shards_than_files():
+    assert_equal([["a.py"]], split_into_shards(["a.py"], {}, 4))
+    assert_equal([], split_into_shards([], {}, 4))
+
+
+@istest
+class JunitTests(object):
+    def setup(self):
+        self._project_dir = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self._project_dir, "tests"))
+        for filename in ["a_tests.py", "b_tests.py"]:
+            open(os.path.join(self._project_dir, "tests", filename), "w").close()
+
+    def teardown(self):
+        shutil.rmtree(self._project_dir)
+
+    @istest
+    def module_file_is_found_from_dotted_name(self):
+        assert_equal("tests/a_tests.py", module_file("tests.a_tests.ATests", self._project_dir))
+        assert_equal("tests/a_tests.py", module_file("tests.a_tests", self._project_dir))
+        assert_equal(None, module_file("tests.c_tests", self._project_dir))
+
+    @istest
+    def durations_of_test_cases_are_totalled_for_each_file(self):
+        report_path = os.path.join(self._project_dir, "report.xml")
+        with open(report_path, "w") as report_file:
+            report_file.write(
+                '<testsuite>'
+                '<testcase classname="tests.a_tests" name="one" time="1.5"/>'
+                '<testcase classname="tests.a_tests.ATests" name="two" time="0.5"/>'
+                '<testcase classname="tests.b_tests" name="three" time="3"/>'
+                '</testsuite>'
+            )
+        assert_equal(
+            {"tests/a_tests.py": 2.0, "tests/b_tests.py": 3.0},
+            read_junit_durations(report_path, self._project_dir),
+        )
+
+
+@istest
+def duration_history_is_updated_with_latest_durations():
+    temp_dir = tempfile.mkdtemp()
+    try:
+        history = DurationHistory(os.path.join(temp_dir, "history.json"))
+        assert_equal({}, history.durations())
+        history.update({"a.py": 1.0, "b.py": 2.0})
+        history.update({"b.py": 3.0})
+        assert_equal({"a.py": 1.0, "b.py": 3.0}, history.durations())
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+@istest
+class TestSharderTests(object):
+    def setup(self):
+        self._temp_dir = tempfile.mkdtemp()
+        self._project_dir = os.path.join(self._temp_dir, "project")
+        os.makedirs(os.path.join(self._project_dir, "tests"))
+        self._history = DurationHistory(os.path.join(self._temp_dir, "history.json"))
+        self._stdout = io.BytesIO()
+
+    def teardown(self):
+        shutil.rmtree(self._temp_dir)
+
+    @istest
+    def tests_are_run_in_shards_and_durations_are_recorded(self):
+        self._write_test("test_a.py", "assert True")
+        self._write_test("test_b.py", "assert True")
+        self._write_test("test_c.py", "assert True")
+
+        result = self._run_script("pytest tests -q -p no:cacheprovider")
+
+        assert_equal(0, result.return_code)
+        output = self._stdout.getvalue()
+        assert b"(in 2 shards)" in output, "Output was: {0}".format(output)
+        assert b"Shard 1 of 2:" in output, "Output was: {0}".format(output)
+        assert b"Shard 2 of 2:" in output, "Output was: {0}".format(output)
+        assert_equal(
+            ["tests/test_a.py", "tests/test_b.py", "tests/test_c.py"],
+            sorted(self._history.durations()),
+        )
+
+    @istest
+    def sharded_command_fails_if_any_shard_fails(self):
+        self._write_test("test_a.py", "assert True")
+        self._write_test("test_b.py", "assert False")
+
+        result = self._run_script("pytest tests -q -p no:cacheprovider")
+
+        assert result.return_code != 0
+        assert b"(in 2 shards)" in self._stdout.getvalue()
+
+    @istest
+    def other_commands_are_run_without_sharding(self):
+        result = self._run_script("echo hello")
+
+        assert_equal(0, result.return_code)
+        output = self._stdout.getvalue()
+        assert b"hello\n" in output, "Output was: {0}".format(output)
+        assert b"shards" not in output, "Output was: {0}".format(output)
+
+    @istest
+    def command_is_run_without_sharding_if_any_test_cant_be_found_in_file(self):
+        self._write_test("test_a.py", "assert True")
+        self._write_test("test_b.py", "assert True")
+
+        result = self._run_script("echo running all tests", FakePythonRuntime(UnresolvedTestRunner()))
+
+        assert_equal(0, result.return_code)
+        output = self._stdout.getvalue()
+        assert b"running all tests\n" in output, "Output was: {0}".format(output)
+        assert b"shards" not in output, "Output was: {0}".format(output)
+
+    def _run_script(self, command, runtime=None):
+        if runtime is None:
+            runtime = FakePythonRuntime()
+        console = Console(spur.LocalShell(), self._stdout)
+        with console.start_session(cwd=self._project_dir) as session:
+            commands_runner = CommandsRunner(
+                session,
+                runtime,
+                test_sharder=sharding.TestSharder(2, self._history),
+                project_dir=self._project_dir,
+            )
+            return commands_runner.run_commands(Step("script", [command]))
+
+    def _write_test(self, filename, assertion):
+        with open(os.path.join(self._project_dir, "tests", filename), "w") as test_file:
+            test_file.write("def test():\n    {0}\n".format(assertion))
+
+
+class FakePythonRuntime(object):
+    def __init__(self, test_runner=None):
+        self._test_runner = test_runner
+
+    def before_step(self, step):
+        return None
+
+    def after_step(self, step):
+        return None
+
+    def test_runner(self, command, project_dir):
+        if self._test_runner is None:
+            return python.find_test_runner(command, project_dir)
+        else:
+            return self._test_runner
+
+
+class UnresolvedTestRunner(object):
+    def collect_command(self, output_path):
+        return "touch {0}".format(output_path)
+
+    def read_collected(self, output_path, project_dir):
+        return None
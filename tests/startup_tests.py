@@ -0,0 +1,52 @@
+import os
+import sys
+
+import spur
+from nose.tools import istest
+from nose.plugins.skip import SkipTest
+
+
+local = spur.LocalShell()
+
+_heavy_modules = ["spur", "yaml", "mayo", "tempman", "xdg"]
+
+_help_script = """
+import toodlepip
+try:
+    toodlepip.run(["toodlepip", "--help"])
+except SystemExit:
+    pass
+"""
+
+
+@istest
+def printing_help_does_not_import_third_party_libraries():
+    import_times = _import_times(_help_script)
+    imported = [
+        name for name in import_times
+        if name.split(".")[0] in _heavy_modules
+    ]
+    assert not imported, "Imported {0} (toodlepip.cli took {1}us)".format(
+        ", ".join(imported),
+        import_times.get("toodlepip.cli"),
+    )
+
+
+def _import_times(script):
+    # Returns the cumulative import time in microseconds of each module
+    # imported by the script, as reported by -X importtime
+    if sys.version_info < (3, 7):
+        raise SkipTest("-X importtime requires Python 3.7")
+
+    package_dir = os.path.join(os.path.dirname(__file__), "..")
+    result = local.run(
+        [sys.executable, "-X", "importtime", "-c", script],
+        cwd=os.path.abspath(package_dir),
+    )
+    import_times = {}
+    for line in result.stderr_output.decode("utf8").splitlines():
+        if line.startswith("import time:") and "|" in line:
+            self_time, cumulative_time, name = line[len("import time:"):].split("|")
+            if cumulative_time.strip().isdigit():
+                import_times[name.strip()] = int(cumulative_time)
+    return import_times
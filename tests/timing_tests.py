@@ -0,0 +1,60 @@
+import os
+import json
+import time
+import tempfile
+import shutil
+
+from nose.tools import istest, assert_equal
+
+from toodlepip.timing import Timings
+
+
+@istest
+def record_captures_wall_clock_time():
+    timings = Timings()
+    with timings.record("step", "script", entry="2.7"):
+        time.sleep(0.05)
+    [record] = timings.records
+    assert_equal(("step", "script", "2.7"), (record.kind, record.name, record.entry))
+    assert record.wall >= 0.05, record.wall
+
+
+@istest
+def cpu_time_is_none_if_cpu_time_function_returns_none():
+    timings = Timings()
+    with timings.record("step", "script", cpu_time=lambda: None):
+        pass
+    [record] = timings.records
+    assert_equal(None, record.cpu)
+
+
+@istest
+def summary_lists_slowest_records_first():
+    timings = Timings()
+    timings.add("step", "install", wall=1.0, cpu=0.5)
+    timings.add("step", "script", entry="2.7", wall=2.0)
+    assert_equal(
+        "wall   cpu    entry  kind  name\n"
+        "2.00s  -      2.7    step  script\n"
+        "1.00s  0.50s  -      step  install\n",
+        timings.summary(),
+    )
+
+
+@istest
+def report_is_written_as_json():
+    timings = Timings()
+    timings.add("step", "script", wall=2.0, cpu=1.0)
+    temp_dir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(temp_dir, "report.json")
+        timings.write_report(path)
+        with open(path) as report_file:
+            report = json.load(report_file)
+    finally:
+        shutil.rmtree(temp_dir)
+
+    [record] = report["records"]
+    assert_equal("script", record["name"])
+    assert_equal(2.0, record["wall"])
+    assert_equal(1.0, record["cpu"])
@@ -0,0 +1,96 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import spur
+from nose.tools import istest, assert_equal
+
+from toodlepip import watch
+
+
+@istest
+class WatcherTests(object):
+    def setup(self):
+        self._temp_dir = tempfile.mkdtemp()
+
+    def teardown(self):
+        shutil.rmtree(self._temp_dir)
+
+    @istest
+    def inotify_watcher_reports_changes_to_files(self):
+        with watch.InotifyWatcher(self._temp_dir, debounce=0.05) as watcher:
+            assert_equal(1, self._count_changes(watcher, lambda: self._write("a")))
+
+    @istest
+    def inotify_watcher_reports_changes_in_directories_created_after_watch_started(self):
+        with watch.InotifyWatcher(self._temp_dir, debounce=0.05) as watcher:
+            self._count_changes(watcher, lambda: os.mkdir(os.path.join(self._temp_dir, "b")))
+            assert_equal(1, self._count_changes(watcher, lambda: self._write("b/c")))
+
+    @istest
+    def inotify_watcher_ignores_changes_to_git_directory(self):
+        self._create_git_repo(gitignore="")
+        with watch.InotifyWatcher(self._temp_dir, debounce=0.05) as watcher:
+            assert_equal(0, self._count_changes(watcher, lambda: self._write(".git/index")))
+
+    @istest
+    def inotify_watcher_ignores_changes_to_files_ignored_by_git(self):
+        self._create_git_repo(gitignore="/node_modules\n/build\n")
+        os.mkdir(os.path.join(self._temp_dir, "node_modules"))
+        self._write("node_modules/installed")
+        with watch.InotifyWatcher(self._temp_dir, debounce=0.05) as watcher:
+            assert_equal(0, self._count_changes(watcher, lambda: self._write("node_modules/a")))
+            self._count_changes(watcher, lambda: os.mkdir(os.path.join(self._temp_dir, "build")))
+            assert_equal(0, self._count_changes(watcher, lambda: self._write("build/a")))
+            assert_equal(1, self._count_changes(watcher, lambda: self._write("a")))
+
+    @istest
+    def polling_watcher_ignores_changes_to_files_ignored_by_git(self):
+        self._create_git_repo(gitignore="/node_modules\n")
+        os.mkdir(os.path.join(self._temp_dir, "node_modules"))
+        self._write("node_modules/installed")
+        with watch.PollingWatcher(self._temp_dir, debounce=0.05, interval=0.05) as watcher:
+            assert_equal(0, self._count_changes(watcher, lambda: self._write("node_modules/a")))
+
+    @istest
+    def changes_in_quick_succession_are_reported_once(self):
+        def _change():
+            for index in range(5):
+                self._write("a")
+                time.sleep(0.01)
+
+        with watch.InotifyWatcher(self._temp_dir, debounce=0.1) as watcher:
+            assert_equal(1, self._count_changes(watcher, _change))
+
+    @istest
+    def polling_watcher_reports_changes_to_files(self):
+        with watch.PollingWatcher(self._temp_dir, debounce=0.05, interval=0.05) as watcher:
+            assert_equal(1, self._count_changes(watcher, lambda: self._write("a")))
+
+    def _create_git_repo(self, gitignore):
+        spur.LocalShell().run(["git", "init"], cwd=self._temp_dir)
+        self._write(".gitignore", gitignore)
+
+    def _write(self, filename, contents="changed"):
+        with open(os.path.join(self._temp_dir, filename), "w") as changed_file:
+            changed_file.write(contents)
+
+    def _count_changes(self, watcher, change):
+        # Counts the changes reported until half a second after the change
+        deadline = []
+
+        def _change():
+            change()
+            deadline.append(time.time() + 0.5)
+
+        def _cancelled():
+            return bool(deadline) and time.time() > deadline[0]
+
+        timer = threading.Timer(0.1, _change)
+        timer.start()
+        try:
+            return len(list(watcher.changes(cancelled=_cancelled)))
+        finally:
+            timer.cancel()
@@ -1,3 +1,7 @@
-from .cli import run
+def run(argv):
+    # cli is imported here so that importing toodlepip is cheap
+    from .cli import run
+    return run(argv)
+
 
 __all__ = ["run"]
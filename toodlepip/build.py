@@ -1,66 +1,754 @@
-from . import config, files
-from .consoles import Console, Command
-from .platforms import builders
-from .temp import create_temp_dir
+import io
+import os
+import time
+import fnmatch
+import threading
 
+try:
+    import queue
+except ImportError:
+    import Queue as queue
 
-def create_builder(shell, stdout):
-    return Builder(builders, Console(shell, stdout))
+from .consoles import Console, Command, Result, cancelled_result
+from .cancellation import CancelledError
+from .parallel import map_in_parallel
+from . import history, matrix
+
+
+# The names of functions in files, which is imported when the project is
+# first copied
+_snapshotters = {
+    "copy": "copy",
+    "git": "snapshot_git",
+}
+
+# The functions that hash the files copied by each snapshotter
+_snapshot_hashers = {
+    "copy": "tree_hash",
+    "git": "git_tree_hash",
+}
+
+
+def create_builder(shell, stdout, timestamps=False, **kwargs):
+    from .platforms import builders
+    return Builder(builders, Console(shell, stdout, timestamps=timestamps), **kwargs)
+
+
+class BuildServices(object):
+    # The caches, the daemon's runtime pool and the build history that
+    # builds use, if any. Each is optional.
+    def __init__(self, runtime_pool=None, result_cache=None, install_cache=None, build_cache=None, history=None):
+        self.runtime_pool = runtime_pool
+        self.result_cache = result_cache
+        self.install_cache = install_cache
+        self.build_cache = build_cache
+        self.history = history
 
 
 class Builder(object):
-    def __init__(self, builders, console):
+    def __init__(self, builders, console, jobs=1, fail_fast=False, snapshot="copy", workdir=None, cleanup_timeout=60, isolate=False, isolate_network=False, hosts=None, entry_indices=None, test_shards=None, services=None):
+        if services is None:
+            services = BuildServices()
         self._console = console
         self._builders = builders
+        self._jobs = jobs
+        self._fail_fast = fail_fast
+        self._snapshot = _snapshotters[snapshot]
+        self._snapshot_hash = _snapshot_hashers[snapshot]
+        self._workdir = workdir
+        self._cleanup_timeout = cleanup_timeout
+        self._runtime_pool = services.runtime_pool
+        self._result_cache = services.result_cache
+        self._install_cache = services.install_cache
+        self._build_cache = services.build_cache
+        self._isolate = isolate
+        self._isolate_network = isolate_network
+        self._hosts = hosts
+        self._entry_indices = entry_indices
+        self._test_shards = test_shards
+        self._history = services.history
+    
+    def cancel(self):
+        self._console.cancellation.cancel()
+    
+    def kill(self):
+        self._console.cancellation.kill_process_groups()
     
     def build(self, path):
-        with create_temp_dir() as temp_dir:
-            project_dir = temp_dir.path
-            self._console.run_all(
+        from . import config
+        
+        start = time.time()
+        first_record = len(self._console.timings.records)
+        project_config = config.read(path)
+        language_builder = self._language_builder(project_config, self._console)
+        entries = matrix.expand(
+            project_config,
+            language_builder.matrix_key,
+            language_builder.matrix(project_config),
+        )
+        # Entries are identified by their index in the full matrix when
+        # they're built on other hosts
+        indices = dict((entry, index) for index, entry in enumerate(entries))
+        entries = self._selected_entries(entries)
+        
+        results = []
+        if self._result_cache is None:
+            cache_keys = None
+        else:
+            cache_keys = self._result_cache_keys(path, project_config, entries)
+            entries_to_build = []
+            for entry in entries:
+                cached_result = self._result_cache.find(cache_keys[entry])
+                if cached_result is None:
+                    entries_to_build.append(entry)
+                else:
+                    self._replay_result(entry, cached_result)
+                    results.append((entry, Result(cached_result.return_code)))
+            entries = entries_to_build
+        
+        # Entries that share a runtime are built one after another using the
+        # same runtime
+        groups = matrix.group_by_runtime(entries)
+        build_history = self._build_history(path)
+        estimates = None if build_history is None else build_history.estimates()
+        
+        if not groups:
+            group_results = []
+        elif self._hosts:
+            group_results = self._build_on_hosts(path, groups, indices, cache_keys, estimates)
+        else:
+            project_cache = self._project_cache(path, project_config)
+            test_sharder = self._test_sharder(path)
+            if self._jobs == 1:
+                group_results = self._build_sequentially(path, project_config, groups, cache_keys, project_cache, test_sharder)
+            else:
+                # The groups that are expected to take longest are started
+                # first, so that they don't hold up the end of the build
+                if estimates is not None:
+                    groups = history.longest_first(groups, estimates.group)
+                group_results = self._build_in_parallel(path, project_config, groups, cache_keys, project_cache, test_sharder)
+        
+        for group, results_for_group in zip(groups, group_results):
+            if results_for_group is not None:
+                results += zip(group.entries, results_for_group)
+        
+        if groups and build_history is not None and not self._console.cancellation.is_cancelled:
+            records = self._console.timings.records[first_record:]
+            if estimates.known:
+                self._describe_predictions(estimates, groups, records, time.time() - start)
+            build_history.record(records)
+        
+        return self._build_result(results)
+    
+    def _build_history(self, path):
+        if self._history is None:
+            return None
+        else:
+            return self._history.for_project(path)
+    
+    def _describe_predictions(self, estimates, groups, records, total):
+        if self._hosts:
+            workers = len(self._hosts)
+            work = [estimates.entry(entry) for group in groups for entry in group.entries]
+        else:
+            workers = self._jobs
+            work = [estimates.group(group) for group in groups]
+        predicted_total = history.predict_total(work, workers)
+        entries = [entry for group in groups for entry in group.entries]
+        self._console.write(b"\n")
+        self._console.write(history.describe_predictions(estimates, entries, records, predicted_total, total).encode("utf8"))
+    
+    def _build_result(self, results):
+        timings = self._console.timings
+        # Entries that failed because they were cancelled are reported only
+        # if no entry failed by itself
+        failures = [
+            result
+            for entry, result in results
+            if result.return_code != 0 and not entry.allow_failure
+        ]
+        failures.sort(key=lambda result: result.cancelled)
+        if failures:
+            return BuildResult(failures[0].return_code, timings=timings)
+        elif self._console.cancellation.is_cancelled:
+            return BuildResult(cancelled_result().return_code, timings=timings)
+        else:
+            return BuildResult(0, timings=timings)
+    
+    def watch(self, path, watcher):
+        # Builds the project, and then builds it again each time the
+        # watcher sees a change. The workspace and runtimes are kept
+        # between builds, and only changed files are synced. The
+        # before_install and install steps are run again only if a file
+        # matching the language's install_files has changed, or if they
+        # failed last time. Changing .travis.yml starts again from scratch.
+        changes = watcher.changes(cancelled=lambda: self._console.cancellation.is_cancelled)
+        
+        if self._workdir is None:
+            from .temp import create_temp_dir
+            temp_dir = create_temp_dir()
+            workdir = temp_dir.path
+            workspace_lock = None
+        else:
+            temp_dir = None
+            workdir = self._workdir
+            workspace_lock = self._lock_workspace(self._console, workdir, "project")
+        
+        try:
+            while True:
+                result, restart = self._watch_config(path, workdir, changes)
+                if not restart:
+                    return result
+        finally:
+            if workspace_lock is not None:
+                workspace_lock.release()
+            if temp_dir is not None:
+                temp_dir.close()
+    
+    def _watch_config(self, path, workdir, changes):
+        from . import config
+        
+        project_config = config.read(path)
+        language_builder = self._language_builder(project_config, self._console)
+        entries = matrix.expand(
+            project_config,
+            language_builder.matrix_key,
+            language_builder.matrix(project_config),
+        )
+        groups = matrix.group_by_runtime(self._selected_entries(entries))
+        project_cache = self._project_cache(path, project_config)
+        test_sharder = self._test_sharder(path)
+        project_dir = os.path.join(workdir, "project")
+        runtimes = []
+        installed = set()
+        
+        try:
+            self._sync(self._console, path, workdir, "project", keep_extra_files=True)
+            result = self._watch_build(language_builder, project_dir, project_config, project_cache, test_sharder, groups, runtimes, installed)
+            for change in changes:
+                copy_result = self._sync(self._console, path, workdir, "project", keep_extra_files=True)
+                if not copy_result.filenames:
+                    self._console.write(b"No changes to build\n")
+                    continue
+                if ".travis.yml" in copy_result.filenames:
+                    return result, True
+                if _matches_any(copy_result.filenames, language_builder.install_files):
+                    installed.clear()
+                result = self._watch_build(language_builder, project_dir, project_config, project_cache, test_sharder, groups, runtimes, installed)
+            return result, False
+        finally:
+            for runtime in runtimes:
+                runtime.__exit__(None, None, None)
+    
+    def _watch_build(self, language_builder, project_dir, project_config, project_cache, test_sharder, groups, runtimes, installed):
+        console = self._console
+        results = []
+        for index, group in enumerate(groups):
+            try:
+                if index == len(runtimes):
+                    with console.timings.record("runtime", "create", entry=_entry_label(group.runtime)):
+                        runtime = self._create_runtime(language_builder, project_config.language, project_dir, group.runtime)
+                    runtimes.append(runtime.__enter__())
+                for entry in group.entries:
+                    result = self._build_entry(
+                        console,
+                        project_dir,
+                        project_config,
+                        runtimes[index],
+                        entry,
+                        None,
+                        project_cache,
+                        test_sharder,
+                        install=entry not in installed,
+                        on_installed=lambda entry=entry: installed.add(entry),
+                    )
+                    results.append((entry, result))
+            except CancelledError:
+                results += [(entry, cancelled_result()) for entry in group.entries]
+        
+        result = self._build_result(results)
+        if not console.cancellation.is_cancelled:
+            status = "passed" if result.return_code == 0 else "failed"
+            console.write("\nBuild {0}. Watching for changes...\n".format(status).encode("utf8"))
+        return result
+    
+    def _selected_entries(self, entries):
+        if self._entry_indices is None:
+            return entries
+        else:
+            return [
+                entry for index, entry in enumerate(entries)
+                if index in self._entry_indices
+            ]
+    
+    def _result_cache_keys(self, path, project_config, entries):
+        from . import files
+        
+        # Language builders can identify the runtime used by each entry,
+        # such as the path and version of the interpreter, so that results
+        # aren't replayed once the runtime changes
+        language_builder = self._language_builder(project_config, self._console)
+        runtime_key = getattr(language_builder, "runtime_key", lambda entry: None)
+        with self._console.timings.record("project", "hash"):
+            tree_hash = getattr(files, self._snapshot_hash)(path)
+        return dict(
+            (entry, self._result_cache.key(tree_hash, project_config, entry, runtime_key=runtime_key(entry.runtime)))
+            for entry in entries
+        )
+    
+    def _replay_result(self, entry, cached_result):
+        if entry.label is None:
+            description = "Replaying cached result"
+        else:
+            description = "Replaying cached result for {0}".format(entry.label)
+        self._console.run_all(description, [], quiet=True)
+        self._console.write(cached_result.output)
+    
+    def _build_sequentially(self, path, project_config, groups, cache_keys, project_cache, test_sharder):
+        with self._copy_project(self._console, path, "project") as project_dir:
+            def _build(indexed_group):
+                index, group = indexed_group
+                return self._build_group(self._console, project_dir, project_config, group, cache_keys, project_cache, test_sharder)
+            
+            return self._build_all(_build, groups, jobs=1)
+    
+    def _build_in_parallel(self, path, project_config, groups, cache_keys, project_cache, test_sharder):
+        output_lock = threading.Lock()
+        
+        def _build(indexed_group):
+            # Each group gets its own copy of the project, and its output is
+            # buffered so that concurrent groups don't interleave
+            index, group = indexed_group
+            output = io.BytesIO()
+            console = self._console.with_stdout(output)
+            try:
+                workspace_name = "entry-{0}".format(index)
+                with self._copy_project(console, path, workspace_name, entry=group.runtime) as project_dir:
+                    return self._build_group(console, project_dir, project_config, group, cache_keys, project_cache, test_sharder)
+            finally:
+                with output_lock:
+                    self._console.write(output.getvalue())
+        
+        return self._build_all(_build, groups, jobs=self._jobs)
+    
+    def _build_on_hosts(self, path, groups, indices, cache_keys, estimates):
+        # Each entry is built by toodlepip on one of the hosts, so entries
+        # that share a runtime can still be built at the same time. The
+        # project is copied and archived once, and uploaded to each host
+        # the first time that it builds an entry.
+        from . import remote
+        
+        entries = [entry for group in groups for entry in group.entries]
+        if estimates is not None:
+            entries = history.longest_first(entries, estimates.entry)
+        available_hosts = queue.Queue()
+        for host in self._hosts:
+            available_hosts.put(host)
+        uploads = {}
+        output_lock = threading.Lock()
+        
+        def _build(entry):
+            output = io.BytesIO()
+            console = self._console.with_stdout(output)
+            host = available_hosts.get()
+            try:
+                if host not in uploads:
+                    uploads[host] = host.upload(console, archive_path)
+                result = self._build_entry_on_host(console, host, uploads[host], entry, indices[entry], cache_keys)
+            finally:
+                available_hosts.put(host)
+                with output_lock:
+                    self._console.write(output.getvalue())
+            if result.return_code != 0 and not result.cancelled:
+                self._failed()
+            return result
+        
+        def _cancelled():
+            return self._console.cancellation.is_cancelled
+        
+        with self._copy_project(self._console, path, "project") as project_dir:
+            with remote.create_archive(self._console, project_dir) as archive_path:
+                try:
+                    entry_results = map_in_parallel(_build, entries, jobs=len(self._hosts), cancelled=_cancelled)
+                finally:
+                    for host, remote_dir in uploads.items():
+                        host.remove(remote_dir)
+        
+        # Entries that weren't started because the build was cancelled have
+        # no result
+        results_by_entry = dict(
+            (entry, cancelled_result() if result is None else result)
+            for entry, result in zip(entries, entry_results)
+        )
+        return [
+            [results_by_entry[entry] for entry in group.entries]
+            for group in groups
+        ]
+    
+    def _build_entry_on_host(self, console, host, remote_dir, entry, index, cache_keys):
+        cache_key = None if cache_keys is None else cache_keys[entry]
+        if cache_key is not None:
+            output = io.BytesIO()
+            console = console.tee(output)
+        
+        with console.timings.record("entry", "build", entry=entry.label):
+            result = host.build(console, remote_dir, index, label=entry.label)
+        
+        if cache_key is not None and not result.cancelled:
+            self._result_cache.store(cache_key, result.return_code, output.getvalue(), description=entry.label)
+        return result
+    
+    def _build_all(self, build_group, groups, jobs):
+        cancellation = self._console.cancellation
+        
+        def _build(indexed_group):
+            try:
+                return build_group(indexed_group)
+            except CancelledError:
+                index, group = indexed_group
+                return [cancelled_result() for entry in group.entries]
+        
+        def _cancelled():
+            return cancellation.is_cancelled
+        
+        return map_in_parallel(_build, list(enumerate(groups)), jobs=jobs, cancelled=_cancelled)
+    
+    def _failed(self):
+        if self._fail_fast:
+            self.cancel()
+    
+    def _copy_project(self, console, path, workspace_name, entry=None):
+        if self._workdir is not None:
+            return self._sync_project(console, path, workspace_name, entry)
+        
+        from . import files
+        from .temp import create_temp_dir
+        
+        snapshot = getattr(files, self._snapshot)
+        temp_dir = create_temp_dir()
+        try:
+            self._snapshot_project(
+                console,
                 "Copying project",
-                [],
-                quiet=True,
+                lambda: snapshot(path, temp_dir.path),
+                entry,
             )
-            files.copy(path, project_dir)
+        except Exception:
+            temp_dir.close()
+            raise
+        return _ProjectDir(temp_dir)
+    
+    def _sync_project(self, console, path, workspace_name, entry):
+        workspace_lock = self._lock_workspace(console, self._workdir, workspace_name)
+        try:
+            self._sync(console, path, self._workdir, workspace_name, entry)
+        except Exception:
+            workspace_lock.release()
+            raise
+        return _Workspace(os.path.join(self._workdir, workspace_name), workspace_lock)
+    
+    def _lock_workspace(self, console, workdir, workspace_name):
+        # Builds using the same workspace wait for each other, rather than
+        # syncing and building over each other's files
+        from .locks import FileLock
         
-            project_config = config.read(path)
-            
-            language_builder = self._builders[project_config.language](self._console)
-            
-            for entry in language_builder.matrix(project_config):
-                result = self._build_entry(language_builder, project_dir, project_config, entry)
-                if result.return_code != 0:
-                    return BuildResult(result.return_code)
+        workspace_lock = FileLock(os.path.join(workdir, "{0}.lock".format(workspace_name)))
+        workspace_lock.acquire(on_wait=lambda: console.write(
+            "Waiting for another build using {0}\n".format(os.path.join(workdir, workspace_name)).encode("utf8")
+        ))
+        return workspace_lock
+    
+    def _sync(self, console, path, workdir, workspace_name, entry=None, keep_extra_files=False):
+        from . import files
+        
+        project_dir = os.path.join(workdir, workspace_name)
+        index_path = os.path.join(workdir, "{0}.index.json".format(workspace_name))
+        return self._snapshot_project(
+            console,
+            "Syncing project to {0}".format(project_dir),
+            lambda: files.sync(path, project_dir, index_path, keep_extra_files=keep_extra_files),
+            entry,
+        )
+    
+    def _snapshot_project(self, console, description, snapshot, entry):
+        console.run_all(description, [], quiet=True)
+        with console.timings.record("project", "copy", entry=_entry_label(entry)):
+            copy_result = snapshot()
+        for phase, seconds in copy_result.timings:
+            console.timings.add("copy phase", phase, entry=_entry_label(entry), wall=seconds)
+        console.write(_describe_copy(copy_result).encode("utf8"))
+        return copy_result
+    
+    def _language_builder(self, project_config, console):
+        return self._builders[project_config.language](console)
             
-            return BuildResult(0)
+    def _build_group(self, console, project_dir, project_config, group, cache_keys, project_cache, test_sharder):
+        language_builder = self._language_builder(project_config, console)
+        with console.timings.record("runtime", "create", entry=_entry_label(group.runtime)):
+            runtime = self._create_runtime(language_builder, project_config.language, project_dir, group.runtime)
+        with runtime:
+            results = []
+            for entry in group.entries:
+                with console.timings.record("entry", "build", entry=entry.label):
+                    results.append(self._build_entry(
+                        console,
+                        project_dir,
+                        project_config,
+                        runtime,
+                        entry,
+                        None if cache_keys is None else cache_keys[entry],
+                        project_cache,
+                        test_sharder,
+                    ))
+            return results
+    
+    def _build_entry(self, console, project_dir, project_config, runtime, entry, cache_key, project_cache, test_sharder, install=True, on_installed=None):
+        if cache_key is not None:
+            output = io.BytesIO()
+            console = console.tee(output)
+        
+        if entry.env is not None:
+            console.write("Using env {0}\n".format(entry.env).encode("utf8"))
+        if install:
+            install, on_installed = self._use_install_cache(console, project_dir, project_config, runtime, entry, on_installed)
+        
+        # Cached directories are restored before the first step, and saved
+        # after before_cache
+        if project_cache is not None:
+            restored = project_cache.restore(console, project_dir, entry)
+        
+        with self._create_namespace(runtime) as namespace:
+            with console.start_session(cwd=project_dir, entry=entry.label, namespace=namespace) as session:
+                commands_runner = CommandsRunner(
+                    session,
+                    runtime,
+                    env=entry.exports,
+                    cleanup_timeout=self._cleanup_timeout,
+                    test_sharder=test_sharder,
+                    project_dir=project_dir,
+                )
+                on_failure = None if entry.allow_failure else self._failed
+                step_runner = StepRunner(commands_runner, on_failure=on_failure, on_installed=on_installed)
+                result = step_runner.run_steps(project_config, install=install)
+                if project_cache is not None and not result.cancelled:
+                    commands_runner.run_commands(Step("before_cache", project_config.get_list("before_cache", [])))
+        
+        if project_cache is not None and not result.cancelled:
+            project_cache.save(console, project_dir, entry, restored)
+        
+        if cache_key is not None and not result.cancelled:
+            self._result_cache.store(cache_key, result.return_code, output.getvalue(), description=entry.label)
+        return result
+    
+    def _project_cache(self, path, project_config):
+        if self._build_cache is None:
+            return None
+        else:
+            return self._build_cache.for_project(path, project_config)
+    
+    def _test_sharder(self, path):
+        if self._test_shards is None:
+            return None
+        else:
+            from . import sharding
+            return sharding.create_test_sharder(path, self._test_shards)
+    
+    def _use_install_cache(self, console, project_dir, project_config, runtime, entry, on_installed):
+        # Restores the runtime from a snapshot taken after the install steps
+        # if there is one, in which case the install steps are skipped.
+        # Otherwise, a snapshot is taken once the install steps succeed.
+        # Runtimes that can be snapshotted have an install_key. If the
+        # runtime may contain a copy of the project, its snapshot is also
+        # keyed by the project's files.
+        if self._install_cache is None or getattr(runtime, "install_key", None) is None:
+            return True, on_installed
+        
+        from . import files
+        
+        install_files = self._builders[project_config.language].install_files
+        install_key = self._install_cache.key(project_dir, project_config, entry, runtime.install_key, install_files)
+        
+        def _restore(snapshot_path):
+            console.run_all("Restoring installed dependencies", [], quiet=True)
+            with console.timings.record("runtime", "restore", entry=entry.label):
+                runtime.restore_install(snapshot_path, project_dir)
+        
+        restored = self._install_cache.restore(install_key, _restore)
+        if not restored:
+            project_key = self._install_cache.project_key(install_key, files.tree_hash(project_dir))
+            restored = self._install_cache.restore(project_key, _restore)
+        if not restored:
+            def _snapshot():
+                self._snapshot_install(console, project_dir, runtime, entry, install_key, project_key)
             
-    def _build_entry(self, language_builder, project_dir, project_config, entry):
-        with language_builder.create_runtime(project_dir, entry) as runtime:
-            step_runner = StepRunner(CommandsRunner(self._console, runtime, project_dir))
-            return step_runner.run_steps(project_config)
+            return True, _chain(on_installed, _snapshot)
+        else:
+            if on_installed is not None:
+                on_installed()
+            return False, on_installed
+    
+    def _snapshot_install(self, console, project_dir, runtime, entry, install_key, project_key):
+        if not runtime.installs_project_in_place(project_dir):
+            install_key = project_key
+        with console.timings.record("runtime", "snapshot", entry=entry.label):
+            self._install_cache.store(
+                install_key,
+                lambda path: runtime.snapshot_install(path, project_dir),
+                description=entry.label,
+            )
+    
+    def _create_runtime(self, language_builder, language, project_dir, entry):
+        if self._isolate:
+            # Each entry gets its own overlay of the runtime, so there's no
+            # need to prepare a copy of it
+            return language_builder.create_runtime(project_dir, entry, isolated=True)
+        if self._runtime_pool is not None:
+            # Runtimes prepared for an older version of the entry's
+            # runtime, such as before its interpreter was upgraded, aren't
+            # used
+            runtime_key = getattr(language_builder, "runtime_key", lambda entry: None)(entry)
+            runtime_dir = self._runtime_pool.checkout(language, entry, runtime_key)
+            if runtime_dir is not None:
+                return language_builder.create_runtime(project_dir, entry, runtime_dir=runtime_dir)
+        return language_builder.create_runtime(project_dir, entry)
+
+
+    def _create_namespace(self, runtime):
+        # Each entry is run in its own namespace, so that processes and
+        # files in /tmp left behind by one entry don't affect the others
+        if not self._isolate:
+            return _NoNamespace()
+        
+        from . import isolation
+        namespace = isolation.create_namespace(network=self._isolate_network)
+        try:
+            runtime.isolate(namespace)
+        except Exception:
+            namespace.close()
+            raise
+        return namespace
+
+
+def _entry_label(entry):
+    if entry is None:
+        return None
+    else:
+        return str(entry)
+
+
+def _chain(first, second):
+    if first is None:
+        return second
+    
+    def _call():
+        first()
+        second()
+    
+    return _call
+
+
+def _matches_any(filenames, patterns):
+    return any(
+        fnmatch.fnmatch(filename, pattern)
+        for filename in filenames
+        for pattern in patterns
+    )
+
+
+def _describe_copy(copy_result):
+    timings = ", ".join(
+        "{0}: {1:.2f}s".format(phase, seconds)
+        for phase, seconds in copy_result.timings
+    )
+    return "Copied {0} files ({1})\n".format(copy_result.file_count, timings)
+
+
+class _Workspace(object):
+    def __init__(self, path, lock):
+        self._path = path
+        self._lock = lock
+    
+    def __enter__(self):
+        return self._path
+    
+    def __exit__(self, *args):
+        self._lock.release()
+
+
+class _NoNamespace(object):
+    def __enter__(self):
+        return None
+    
+    def __exit__(self, *args):
+        return
+
+
+class _Unsharded(object):
+    def __init__(self, commands):
+        self._commands = commands
+    
+    def __enter__(self):
+        return self._commands
+    
+    def __exit__(self, *args):
+        return
+
+
+class _ProjectDir(object):
+    def __init__(self, temp_dir):
+        self._temp_dir = temp_dir
+    
+    def __enter__(self):
+        return self._temp_dir.path
+    
+    def __exit__(self, *args):
+        self._temp_dir.close()
             
             
 class StepRunner(object):
-    def __init__(self, commands_runner):
+    def __init__(self, commands_runner, on_failure=None, on_installed=None):
         self._commands_runner = commands_runner
+        self._on_failure = on_failure
+        self._on_installed = on_installed
     
-    def run_steps(self, project_config):
-        for step_name in ["before_install", "install", "before_script"]:
-            result = self._run_step(project_config, step_name)
+    def run_steps(self, project_config, install=True):
+        if install:
+            result = self._run_steps(project_config, ["before_install", "install"])
             if result.return_code != 0:
                 return result
-                
+            if self._on_installed is not None:
+                self._on_installed()
+        
+        result = self._run_steps(project_config, ["before_script"])
+        if result.return_code != 0:
+            return result
+        
         result = self._run_step(project_config, "script")
         if result.return_code == 0:
             after_step = "after_success"
         else:
             after_step = "after_failure"
+            # Notify before running the cleanup steps, so that other entries
+            # can be cancelled as soon as possible
+            self._failed()
             
         self._run_step(project_config, after_step)
         self._run_step(project_config, "after_script")
         
         return result
         
+    def _run_steps(self, project_config, step_names):
+        for step_name in step_names:
+            result = self._run_step(project_config, step_name)
+            if result.return_code != 0:
+                self._failed()
+                return result
+        return Result(0)
+    
+    def _failed(self):
+        if self._on_failure is not None:
+            self._on_failure()
+    
     def _run_step(self, project_config, step_name):
         step = self._step(project_config, step_name)
         return self._commands_runner.run_commands(step)
@@ -70,29 +758,62 @@ class StepRunner(object):
         return Step(name, commands)
 
 
+_cleanup_steps = ["after_success", "after_failure", "after_script"]
+
+
 class CommandsRunner(object):
-    def __init__(self, console, runtime, project_dir):
-        self._console = console
+    def __init__(self, session, runtime, env=(), cleanup_timeout=None, test_sharder=None, project_dir=None):
+        self._session = session
         self._runtime = runtime
+        self._env = env
+        self._cleanup_timeout = cleanup_timeout
+        self._test_sharder = test_sharder
         self._project_dir = project_dir
     
     def run_commands(self, step):
-        def _runtime_run_all(description, commands):
-            commands = map(_runtime_command, commands)
-            return self._console.run_all(
-                description,
+        # Cleanup steps still run once the build has been cancelled, but
+        # only for as long as the cleanup timeout
+        if step.name in _cleanup_steps:
+            cleanup_timeout = self._cleanup_timeout
+        else:
+            cleanup_timeout = None
+        
+        setup = self._setup(step)
+        commands = [Command.shell(command) for command in step.commands]
+        with self._shard_tests(step, commands, setup) as commands:
+            result = self._session.run_all(
+                "Running {0} commands".format(step.name),
                 commands,
-                cwd=self._project_dir
+                setup=setup,
+                label=step.name,
+                cleanup_timeout=cleanup_timeout,
             )
-        
-        def _runtime_command(command):
-            before_command = self._runtime.before_step(step)
-            if before_command:
-                return Command.hidden_prefix(command, prefix=before_command)
-            else:
-                return Command.shell(command)
-        
-        return _runtime_run_all("Running {0} commands".format(step.name), step.commands)
+        if result.return_code == 0:
+            after_command = self._runtime.after_step(step)
+            if after_command is not None:
+                self._session.run(None, after_command, quiet=True, setup=setup)
+        return result
+    
+    def _shard_tests(self, step, commands, setup):
+        # Tests run by the script step are split into shards that run at the
+        # same time, if the runtime can find the test runner of a command
+        if step.name != "script" or self._test_sharder is None or not hasattr(self._runtime, "test_runner"):
+            return _Unsharded(commands)
+        else:
+            return self._test_sharder.shard(self._session, self._runtime, self._project_dir, commands, setup)
+    
+    def _setup(self, step):
+        # Env vars are exported before the runtime's setup, as on Travis
+        setup = []
+        if self._env:
+            setup.append("export {0}".format(" ".join(self._env)))
+        runtime_setup = self._runtime.before_step(step)
+        if runtime_setup is not None:
+            setup.append(runtime_setup)
+        if setup:
+            return "; ".join(setup)
+        else:
+            return None
         
 
             
@@ -103,5 +824,6 @@ class Step(object):
 
 
 class BuildResult(object):
-    def __init__(self, return_code):
+    def __init__(self, return_code, timings=None):
         self.return_code = return_code
+        self.timings = timings
@@ -0,0 +1,254 @@
+import os
+import json
+import stat
+import hashlib
+import tarfile
+
+from . import caches
+from .strings import is_string
+
+
+# Branches whose caches are used by branches that don't have their own
+# yet, as Travis falls back to the default branch
+_fallback_branches = ["master", "main"]
+
+_archive_name = "directories.tar.gz"
+_metadata_name = "directories.json"
+
+
+def create_build_cache(max_size=None):
+    return BuildCache(caches.create_cache("directories"), max_size=max_size)
+
+
+def read_cache_config(project_config):
+    # Travis allows cache to be a single name (such as cache: pip), a list
+    # of names and dicts, or a dict. pip's cache is always shared between
+    # Python builds, so cache: pip needs no handling here. Caches for other
+    # tools, such as bundler, aren't supported.
+    value = project_config.get("cache")
+    if isinstance(value, dict):
+        values = [value]
+    elif isinstance(value, list):
+        values = value
+    else:
+        values = []
+
+    directories = []
+    for value in values:
+        if isinstance(value, dict):
+            directories += [
+                directory for directory in (value.get("directories") or [])
+                if is_string(directory)
+            ]
+    return CacheConfig(directories=directories)
+
+
+class CacheConfig(object):
+    def __init__(self, directories):
+        self.directories = directories
+
+
+class BuildCache(object):
+    # The directories listed in cache.directories of .travis.yml, stored as
+    # a compressed archive for each project, branch and entry. The least
+    # recently used archives are removed once their total size is more
+    # than max_size.
+
+    def __init__(self, cache, max_size=None):
+        self._cache = cache
+        self._max_size = max_size
+
+    def for_project(self, path, project_config):
+        cache_config = read_cache_config(project_config)
+        if not cache_config.directories:
+            return None
+        return ProjectCache(self, os.path.abspath(path), _current_branch(path), cache_config.directories)
+
+    def key(self, project_path, branch, entry):
+        return caches.hash_key(project_path, branch, _entry_label(entry))
+
+    def find(self, key):
+        path = self._cache.find(key)
+        if path is None:
+            return None
+        try:
+            with open(os.path.join(path, _metadata_name)) as metadata_file:
+                content_hash = json.load(metadata_file)["hash"]
+        except (IOError, OSError, ValueError, KeyError):
+            return None
+        return _Archive(os.path.join(path, _archive_name), content_hash)
+
+    def store(self, key, project_dir, directories, content_hash, description=None):
+        def _write(path):
+            os.mkdir(path)
+            archive = tarfile.open(os.path.join(path, _archive_name), "w:gz")
+            try:
+                for directory in directories:
+                    if os.path.isdir(os.path.join(project_dir, directory)):
+                        archive.add(os.path.join(project_dir, directory), arcname=directory)
+            finally:
+                archive.close()
+            with open(os.path.join(path, _metadata_name), "w") as metadata_file:
+                json.dump({"hash": content_hash}, metadata_file)
+
+        self._cache.replace(key, _write, description=description)
+        if self._max_size is not None:
+            self._cache.prune(max_size=self._max_size)
+
+
+class ProjectCache(object):
+    def __init__(self, build_cache, project_path, branch, directories):
+        self._build_cache = build_cache
+        self._project_path = project_path
+        self._branch = branch
+        self._directories, self._skipped_directories = _partition_directories(directories)
+
+    def restore(self, console, project_dir, entry):
+        # Returns what was restored, which is passed to save so that the
+        # archive is only saved again if the directories have changed
+        for directory in self._skipped_directories:
+            console.write("Not caching {0}: only directories in the project can be cached\n".format(directory).encode("utf8"))
+
+        for branch in self._branches():
+            key = self._build_cache.key(self._project_path, branch, entry)
+            archive = self._build_cache.find(key)
+            if archive is not None:
+                console.run_all("Restoring cached directories", [], quiet=True)
+                with console.timings.record("cache", "restore", entry=_entry_label(entry)):
+                    archive.extract(project_dir)
+                return _Restored(key, archive.content_hash)
+        return None
+
+    def save(self, console, project_dir, entry, restored):
+        key = self._build_cache.key(self._project_path, self._branch, entry)
+        content_hash = _directories_hash(project_dir, self._directories)
+        if content_hash is None:
+            return
+        if restored is not None and restored.key == key and restored.content_hash == content_hash:
+            console.write(b"Cached directories are unchanged\n")
+            return
+
+        console.run_all("Saving cached directories", [], quiet=True)
+        with console.timings.record("cache", "save", entry=_entry_label(entry)):
+            self._build_cache.store(
+                key,
+                project_dir,
+                self._directories,
+                content_hash,
+                description=" ".join(part for part in [self._project_path, self._branch, _entry_label(entry)] if part),
+            )
+
+    def _branches(self):
+        branches = [self._branch]
+        for branch in _fallback_branches:
+            if branch not in branches:
+                branches.append(branch)
+        return branches
+
+
+class _Archive(object):
+    def __init__(self, path, content_hash):
+        self._path = path
+        self.content_hash = content_hash
+
+    def extract(self, destination):
+        archive = tarfile.open(self._path, "r:gz")
+        try:
+            if hasattr(tarfile, "data_filter"):
+                archive.extractall(destination, filter="data")
+            else:
+                archive.extractall(destination)
+        finally:
+            archive.close()
+
+
+class _Restored(object):
+    def __init__(self, key, content_hash):
+        self.key = key
+        self.content_hash = content_hash
+
+
+def _partition_directories(directories):
+    # Only directories in the project are cached, since restoring
+    # directories elsewhere, such as $HOME/.cache, would overwrite the
+    # user's own files. Directories may be given relative to the project,
+    # or to $TRAVIS_BUILD_DIR.
+    included = []
+    skipped = []
+    for directory in directories:
+        relative_path = directory
+        for prefix in ["$TRAVIS_BUILD_DIR/", "${TRAVIS_BUILD_DIR}/"]:
+            if relative_path.startswith(prefix):
+                relative_path = relative_path[len(prefix):]
+        relative_path = os.path.normpath(relative_path)
+        is_outside_project = (
+            os.path.isabs(relative_path) or
+            relative_path.startswith("$") or
+            relative_path.startswith("~") or
+            relative_path == "." or
+            relative_path.split(os.sep)[0] == ".."
+        )
+        if is_outside_project:
+            skipped.append(directory)
+        else:
+            included.append(relative_path)
+    return included, skipped
+
+
+def _directories_hash(project_dir, directories):
+    # Returns None if none of the directories exist
+    result = hashlib.sha1()
+    found = False
+    for directory in sorted(directories):
+        directory_path = os.path.join(project_dir, directory)
+        if not os.path.isdir(directory_path):
+            continue
+        found = True
+        for root, dirs, filenames in os.walk(directory_path):
+            dirs.sort()
+            for name in sorted(dirs + filenames):
+                path = os.path.join(root, name)
+                relative_path = os.path.relpath(path, project_dir)
+                result.update(_file_hash(path, relative_path).encode("utf8"))
+    if found:
+        return result.hexdigest()
+    else:
+        return None
+
+
+def _file_hash(path, relative_path):
+    mode = os.lstat(path).st_mode
+    if stat.S_ISLNK(mode):
+        contents = "link:{0}".format(os.readlink(path))
+    elif stat.S_ISREG(mode):
+        contents = hashlib.sha1()
+        with open(path, "rb") as content_file:
+            for chunk in iter(lambda: content_file.read(64 * 1024), b""):
+                contents.update(chunk)
+        contents = contents.hexdigest()
+    else:
+        contents = ""
+    return "{0}\0{1:o}\0{2}\0".format(relative_path, stat.S_IMODE(mode), contents)
+
+
+def _current_branch(path):
+    import spur
+
+    result = spur.LocalShell().run(
+        ["git", "rev-parse", "--abbrev-ref", "HEAD"],
+        cwd=path,
+        allow_error=True,
+    )
+    branch = result.output.decode("utf8").strip()
+    if result.return_code != 0 or branch == "HEAD":
+        return None
+    else:
+        return branch
+
+
+def _entry_label(entry):
+    if entry is None:
+        return None
+    else:
+        return entry.label
+
@@ -0,0 +1,243 @@
+import os
+import time
+import json
+import errno
+import shutil
+import hashlib
+import fcntl
+import contextlib
+
+import xdg.BaseDirectory
+
+
+_cache_names = ["virtualenvs", "results", "installs", "directories"]
+
+
+def create_cache(name, max_age=None, max_size=None):
+    path = xdg.BaseDirectory.save_data_path("toodlepip/caches/{0}".format(name))
+    return DirectoryCache(path, max_age=max_age, max_size=max_size)
+
+
+def all_caches():
+    return [(name, create_cache(name)) for name in _cache_names]
+
+
+def hash_key(*parts):
+    serialised = json.dumps(parts, sort_keys=True).encode("utf8")
+    return hashlib.sha1(serialised).hexdigest()
+
+
+class DirectoryCache(object):
+    # Entries are created under an exclusive lock, and used under a shared
+    # lock, such as while they're copied, so that they're never removed
+    # while in use. Entries in use are skipped when pruning. Once an entry
+    # has been created, the least recently used entries are removed until
+    # the cache is no larger than max_size.
+
+    def __init__(self, path, max_age=None, max_size=None):
+        self._path = path
+        self._max_age = max_age
+        self._max_size = max_size
+
+    def get(self, key, create, description=None):
+        if self._max_age is not None:
+            self.prune(max_age=self._max_age)
+
+        entry_path = self._entry_path(key)
+        metadata_path = self._metadata_path(key)
+        with self._lock(key):
+            if os.path.exists(metadata_path):
+                os.utime(metadata_path, None)
+                created = False
+            else:
+                self._create(key, create, description)
+                created = True
+        if created:
+            self._prune_to_max_size(key)
+        return entry_path
+
+    @contextlib.contextmanager
+    def use(self, key, create, description=None):
+        while True:
+            entry_path = self.get(key, create, description=description)
+            with self._lock(key, shared=True):
+                # The entry may have been removed before the shared lock
+                # was acquired
+                if os.path.exists(self._metadata_path(key)):
+                    yield entry_path
+                    return
+
+    @contextlib.contextmanager
+    def use_found(self, key):
+        metadata_path = self._metadata_path(key)
+        with self._lock(key, shared=True):
+            if os.path.exists(metadata_path):
+                os.utime(metadata_path, None)
+                yield self._entry_path(key)
+            else:
+                yield None
+
+    def replace(self, key, create, description=None):
+        # Removing and creating under the same lock means other builds
+        # never see the entry missing, nor create their own in between
+        with self._lock(key):
+            _remove(self._metadata_path(key))
+            self._create(key, create, description)
+        self._prune_to_max_size(key)
+        return self._entry_path(key)
+
+    def find(self, key):
+        metadata_path = self._metadata_path(key)
+        with self._lock(key):
+            if os.path.exists(metadata_path):
+                os.utime(metadata_path, None)
+                return self._entry_path(key)
+            else:
+                return None
+
+    def entries(self):
+        result = []
+        for filename in os.listdir(self._path):
+            if filename.endswith(".json"):
+                key = filename[:-len(".json")]
+                entry = self._read_entry(key)
+                if entry is not None:
+                    result.append(entry)
+        result.sort(key=lambda entry: entry.last_used, reverse=True)
+        return result
+
+    def prune(self, max_age=None, max_size=None, keep=None):
+        # Entries in use, and the entry with the key keep, aren't removed
+        removed = []
+        now = time.time()
+        entries = self.entries()
+        if max_age is not None:
+            for entry in list(entries):
+                if now - entry.last_used > _total_seconds(max_age) and self._remove_unused(entry.key, keep):
+                    removed.append(entry)
+                    entries.remove(entry)
+
+        if max_size is not None:
+            total_size = sum(entry.size for entry in entries)
+            for entry in reversed(entries):
+                if total_size <= max_size:
+                    break
+                if self._remove_unused(entry.key, keep):
+                    total_size -= entry.size
+                    removed.append(entry)
+
+        return removed
+
+    def remove(self, key):
+        with self._lock(key):
+            _remove(self._metadata_path(key))
+            _remove(self._entry_path(key))
+
+    def _remove_unused(self, key, keep):
+        if key == keep:
+            return False
+        with self._lock(key, blocking=False) as locked:
+            if locked:
+                _remove(self._metadata_path(key))
+                _remove(self._entry_path(key))
+            return locked
+
+    def _prune_to_max_size(self, key):
+        if self._max_size is not None:
+            self.prune(max_size=self._max_size, keep=key)
+
+    def _create(self, key, create, description):
+        entry_path = self._entry_path(key)
+        _remove(entry_path)
+        try:
+            create(entry_path)
+        except Exception:
+            _remove(entry_path)
+            raise
+        with open(self._metadata_path(key), "w") as metadata_file:
+            json.dump({"description": description, "created": time.time()}, metadata_file)
+
+    def _read_entry(self, key):
+        metadata_path = self._metadata_path(key)
+        try:
+            with open(metadata_path) as metadata_file:
+                metadata = json.load(metadata_file)
+            last_used = os.path.getmtime(metadata_path)
+        except (IOError, OSError, ValueError):
+            return None
+        return CacheEntry(
+            key=key,
+            path=self._entry_path(key),
+            description=metadata.get("description"),
+            last_used=last_used,
+        )
+
+    def _entry_path(self, key):
+        return os.path.join(self._path, key)
+
+    def _metadata_path(self, key):
+        return os.path.join(self._path, "{0}.json".format(key))
+
+    @contextlib.contextmanager
+    def _lock(self, key, shared=False, blocking=True):
+        # Yields whether the lock was acquired, which is always the case
+        # when blocking
+        operation = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+        if not blocking:
+            operation |= fcntl.LOCK_NB
+        with open(os.path.join(self._path, "{0}.lock".format(key)), "w") as lock_file:
+            try:
+                fcntl.flock(lock_file, operation)
+            except (IOError, OSError) as error:
+                if error.errno not in (errno.EAGAIN, errno.EACCES):
+                    raise
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class CacheEntry(object):
+    def __init__(self, key, path, description, last_used):
+        self.key = key
+        self.path = path
+        self.description = description
+        self.last_used = last_used
+        self._size = None
+
+    @property
+    def size(self):
+        if self._size is None:
+            self._size = _disk_usage(self.path)
+        return self._size
+
+
+def _disk_usage(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+
+    total = 0
+    for root, dirs, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                total += os.lstat(os.path.join(root, filename)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def _remove(path):
+    try:
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+    except OSError as error:
+        if error.errno != errno.ENOENT:
+            raise
+
+
+def _total_seconds(delta):
+    return delta.days * 24 * 60 * 60 + delta.seconds
@@ -0,0 +1,73 @@
+import os
+import signal
+import threading
+
+
+class CancelledError(Exception):
+    pass
+
+
+class Cancellation(object):
+    def __init__(self):
+        self._cancelled = False
+        self._callbacks = []
+        self._process_groups = set()
+        self._lock = threading.Lock()
+
+    @property
+    def is_cancelled(self):
+        return self._cancelled
+
+    def cancel(self):
+        with self._lock:
+            if self._cancelled:
+                return
+            self._cancelled = True
+            callbacks = list(self._callbacks)
+            self._callbacks = []
+
+        for callback in callbacks:
+            callback()
+
+    def on_cancel(self, callback):
+        with self._lock:
+            if not self._cancelled:
+                self._callbacks.append(callback)
+                return _Registration(lambda: self._remove(callback))
+
+        callback()
+        return _Registration(lambda: self._remove(callback))
+
+    def track_process_group(self, process_group):
+        # Commands are run in their own process groups, so they don't receive
+        # signals sent to toodlepip, and are killed by kill_process_groups
+        # if toodlepip is stopped before they finish
+        with self._lock:
+            self._process_groups.add(process_group)
+        return _Registration(lambda: self._untrack_process_group(process_group))
+
+    def kill_process_groups(self):
+        with self._lock:
+            process_groups = list(self._process_groups)
+        for process_group in process_groups:
+            try:
+                os.killpg(process_group, signal.SIGKILL)
+            except OSError:
+                pass
+
+    def _remove(self, callback):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def _untrack_process_group(self, process_group):
+        with self._lock:
+            self._process_groups.discard(process_group)
+
+
+class _Registration(object):
+    def __init__(self, remove):
+        self._remove = remove
+
+    def remove(self):
+        self._remove()
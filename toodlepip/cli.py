@@ -1,10 +1,14 @@
 import argparse
+import contextlib
 import sys
 import os
+import time
+import signal
+import shlex
 
-import spur
-
-from .build import create_builder
+# Modules that import third-party libraries are imported when a command is
+# executed, rather than here, so that parsing arguments (and printing help)
+# stays fast
 
 
 def run(argv):
@@ -15,6 +19,9 @@ def run(argv):
 def _parse_args(argv):
     commands = [
         BuildCommand(),
+        CacheCommand(),
+        DaemonCommand(),
+        InterpretersCommand(),
     ]
     
     parser = argparse.ArgumentParser()
@@ -33,8 +40,363 @@ class BuildCommand(object):
     
     def create_parser(self, subparser):
         subparser.add_argument("path")
+        subparser.add_argument("--jobs", "-j", type=int, default=1)
+        subparser.add_argument(
+            "--fail-fast",
+            action="store_true",
+            help="cancel the build as soon as any entry fails",
+        )
+        subparser.add_argument(
+            "--cleanup-timeout",
+            type=float,
+            default=60,
+            help="when the build is cancelled, kill commands in after_* steps that run for longer than CLEANUP_TIMEOUT seconds",
+        )
+        subparser.add_argument(
+            "--entry",
+            type=int,
+            action="append",
+            dest="entries",
+            metavar="INDEX",
+            help="only build the entry at INDEX in the build matrix, counting from 0. Can be given more than once",
+        )
+        subparser.add_argument(
+            "--hosts",
+            help="build entries on HOSTS, a comma-separated list of [user@]host[:port], over SSH. toodlepip must be installed on each host. A host can be listed more than once to build several entries on it at a time",
+        )
+        subparser.add_argument(
+            "--remote-toodlepip",
+            default="toodlepip",
+            help="the command used to run toodlepip on each of the hosts",
+        )
+        subparser.add_argument(
+            "--test-shards",
+            type=int,
+            metavar="N",
+            help="split the tests run by nosetests or pytest in the script step of Python projects into N shards that run at the same time, balanced using how long each test file took in previous builds",
+        )
+        subparser.add_argument(
+            "--snapshot",
+            choices=["copy", "git"],
+            default="copy",
+            help="how to copy the project: 'git' copies the committed tree plus uncommitted changes to tracked files",
+        )
+        subparser.add_argument(
+            "--workdir",
+            help="build in DIR, syncing only changed files from the project on each build, and removing files that aren't in the project",
+        )
+        subparser.add_argument(
+            "--workspace",
+            action="store_true",
+            help="build in a persistent per-project directory, syncing only changed files on each build, and removing files that aren't in the project",
+        )
+        subparser.add_argument(
+            "--timestamps",
+            action="store_true",
+            help="prefix each line of command output with the elapsed time and step name",
+        )
+        subparser.add_argument(
+            "--log-file",
+            help="write the full output to LOG_FILE, and skip output to the terminal if it can't keep up rather than waiting for it",
+        )
+        subparser.add_argument(
+            "--timings",
+            action="store_true",
+            help="print how long copying, runtime creation, each step and each command took",
+        )
+        subparser.add_argument(
+            "--report",
+            help="write timings to REPORT as JSON (implies --timings)",
+        )
+        subparser.add_argument(
+            "--cache-results",
+            action="store_true",
+            help="replay the recorded output of each entry that passed when its project files, .travis.yml, entry and interpreter are unchanged since it was last built",
+        )
+        subparser.add_argument(
+            "--cache-installs",
+            action="store_true",
+            help="snapshot each runtime after the install steps, and restore the snapshot instead of running before_install and install when their commands and the files they read, such as setup.py and requirements*.txt, are unchanged. Changes made outside the runtime, such as exported variables, aren't restored",
+        )
+        subparser.add_argument(
+            "--no-directory-cache",
+            action="store_true",
+            help="don't restore or save the directories listed under cache.directories in .travis.yml",
+        )
+        subparser.add_argument(
+            "--directory-cache-size",
+            type=int,
+            default=1024,
+            metavar="MB",
+            help="remove the least recently used cached directories once they take up more than MB megabytes (default: 1024)",
+        )
+        subparser.add_argument(
+            "--no-daemon",
+            action="store_true",
+            help="don't use runtimes prepared by a running toodlepip daemon",
+        )
+        subparser.add_argument(
+            "--watch",
+            action="store_true",
+            help="build again whenever the project changes, keeping the workspace and runtimes between builds. Install steps are run again only if files such as setup.py or requirements*.txt change, so projects installed without -e may need a reinstall to pick up changes",
+        )
+        subparser.add_argument(
+            "--isolate",
+            action="store_true",
+            help="run each entry in its own Linux namespaces, with a private /tmp and process tree, and a copy-on-write overlay of its runtime",
+        )
+        subparser.add_argument(
+            "--isolate-network",
+            action="store_true",
+            help="also give each entry its own network with only a loopback interface (implies --isolate)",
+        )
+    
+    def execute(self, args):
+        import spur
+        from .build import BuildServices, create_builder
+        from .consoles import Result
+        from .temp import workspace_dir
+        from .output import OutputPipeline
+        from . import build_caches, daemon, history, installs, isolation, remote, results, watch
+        
+        isolate = args.isolate or args.isolate_network
+        if isolate and args.hosts is None and not isolation.is_supported():
+            sys.stderr.write("--isolate requires unshare and unprivileged user namespaces\n")
+            return Result(1)
+        
+        if args.hosts is None:
+            hosts = None
+        elif not remote.is_supported():
+            sys.stderr.write("--hosts requires spur with SSH support, which can be installed with pip install spur\n")
+            return Result(1)
+        elif args.watch:
+            sys.stderr.write("--hosts can't be used with --watch\n")
+            return Result(1)
+        else:
+            hosts = remote.create_hosts(
+                [name.strip() for name in args.hosts.split(",") if name.strip()],
+                command=shlex.split(args.remote_toodlepip),
+                build_args=_remote_build_args(args),
+            )
+        
+        if args.watch and (args.jobs != 1 or args.cache_results):
+            sys.stderr.write("--jobs and --cache-results can't be used with --watch, which builds each entry in turn in the same workspace\n")
+            return Result(1)
+        
+        if args.snapshot != "copy" and (args.workdir is not None or args.workspace or args.watch):
+            sys.stderr.write("--snapshot can't be used with --workdir, --workspace or --watch, which sync the project's files\n")
+            return Result(1)
+        
+        workdir = args.workdir
+        if workdir is None and args.workspace:
+            workdir = workspace_dir(args.path)
+        
+        if args.no_daemon:
+            runtime_pool = None
+        else:
+            runtime_pool = daemon.connect(daemon.default_socket_path())
+        
+        if args.cache_results:
+            result_cache = results.create_result_cache()
+        else:
+            result_cache = None
+        
+        if args.cache_installs:
+            install_cache = installs.create_install_cache()
+        else:
+            install_cache = None
+        
+        if args.no_directory_cache:
+            build_cache = None
+        else:
+            build_cache = build_caches.create_build_cache(max_size=args.directory_cache_size * 1024 * 1024)
+        
+        log_file = None if args.log_file is None else open(args.log_file, "wb")
+        try:
+            with os.fdopen(sys.stdout.fileno(), "wb") as binary_stdout:
+                with OutputPipeline(binary_stdout, log_file=log_file) as output:
+                    builder = create_builder(
+                        spur.LocalShell(),
+                        output,
+                        jobs=args.jobs,
+                        fail_fast=args.fail_fast,
+                        snapshot=args.snapshot,
+                        workdir=workdir,
+                        timestamps=args.timestamps,
+                        cleanup_timeout=args.cleanup_timeout,
+                        isolate=isolate,
+                        isolate_network=args.isolate_network,
+                        hosts=hosts,
+                        entry_indices=args.entries,
+                        test_shards=args.test_shards,
+                        services=BuildServices(
+                            runtime_pool=runtime_pool,
+                            result_cache=result_cache,
+                            install_cache=install_cache,
+                            build_cache=build_cache,
+                            history=history.create_history_store(),
+                        ),
+                    )
+                    with _cancel_on_interrupt(builder):
+                        if args.watch:
+                            with watch.create_watcher(args.path) as watcher:
+                                result = builder.watch(args.path, watcher)
+                        else:
+                            result = builder.build(args.path)
+                    if args.timings or args.report is not None:
+                        output.write(b"\nTimings (slowest first):\n")
+                        output.write(result.timings.summary().encode("utf8"))
+                    if args.report is not None:
+                        result.timings.write_report(args.report)
+                    return result
+        finally:
+            if log_file is not None:
+                log_file.close()
+
+
+def _remote_build_args(args):
+    # The options that affect how each entry is built on the hosts. Results
+    # are cached locally, rather than on the hosts.
+    build_args = ["--cleanup-timeout={0}".format(args.cleanup_timeout)]
+    flags = [
+        ("--timestamps", args.timestamps),
+        ("--cache-installs", args.cache_installs),
+        ("--no-directory-cache", args.no_directory_cache),
+        ("--isolate", args.isolate),
+        ("--isolate-network", args.isolate_network),
+    ]
+    for flag, enabled in flags:
+        if enabled:
+            build_args.append(flag)
+    build_args.append("--directory-cache-size={0}".format(args.directory_cache_size))
+    if args.test_shards is not None:
+        build_args.append("--test-shards={0}".format(args.test_shards))
+    return build_args
+
+
+@contextlib.contextmanager
+def _cancel_on_interrupt(builder):
+    # The first interrupt cancels the build, still allowing cleanup steps to
+    # run. A second interrupt stops toodlepip immediately, killing any
+    # commands that are still running.
+    interrupts = []
+    
+    def _handle(signal_number, frame):
+        if interrupts:
+            builder.kill()
+            raise KeyboardInterrupt()
+        interrupts.append(signal_number)
+        builder.cancel()
+    
+    previous_handler = signal.signal(signal.SIGINT, _handle)
+    try:
+        yield
+    finally:
+        signal.signal(signal.SIGINT, previous_handler)
+
+
+class CacheCommand(object):
+    name = "cache"
+    
+    def create_parser(self, subparser):
+        subparser.add_argument("action", nargs="?", choices=["list", "prune"], default="list")
+        subparser.add_argument("--max-age-days", type=int)
+        subparser.add_argument("--max-size-mb", type=int)
     
     def execute(self, args):
+        from .consoles import Result
+        from . import caches
+        
+        for name, cache in caches.all_caches():
+            if args.action == "prune":
+                self._prune(name, cache, args)
+            else:
+                self._list(name, cache)
+        
+        return Result(0)
+    
+    def _list(self, name, cache):
+        for entry in cache.entries():
+            sys.stdout.write("{0}: {1} {2:.1f}MB, last used {3} ({4})\n".format(
+                name,
+                entry.key[:12],
+                entry.size / (1024.0 * 1024.0),
+                time.strftime("%Y-%m-%d %H:%M", time.localtime(entry.last_used)),
+                entry.description,
+            ))
+    
+    def _prune(self, name, cache, args):
+        from datetime import timedelta
+        
+        max_age = None if args.max_age_days is None else timedelta(days=args.max_age_days)
+        max_size = None if args.max_size_mb is None else args.max_size_mb * 1024 * 1024
+        for entry in cache.prune(max_age=max_age, max_size=max_size):
+            sys.stdout.write("{0}: removed {1} ({2})\n".format(name, entry.key[:12], entry.description))
+
+
+class DaemonCommand(object):
+    name = "daemon"
+    
+    def create_parser(self, subparser):
+        subparser.add_argument(
+            "paths",
+            nargs="*",
+            metavar="path",
+            help="prepare runtimes for each entry in the build matrix of the project at PATH",
+        )
+        subparser.add_argument(
+            "--size",
+            type=int,
+            default=2,
+            help="the number of prepared runtimes to keep for each entry",
+        )
+        subparser.add_argument("--socket", help="listen on SOCKET instead of the default socket")
+    
+    def execute(self, args):
+        import spur
+        from .consoles import Console, Result
+        from .platforms import builders
+        from . import config, daemon
+        
+        socket_path = daemon.default_socket_path() if args.socket is None else args.socket
+        signal.signal(signal.SIGTERM, lambda signal_number, frame: sys.exit(0))
+        
         with os.fdopen(sys.stdout.fileno(), "wb") as binary_stdout:
-            builder = create_builder(spur.LocalShell(), binary_stdout)
-            return builder.build(args.path)
+            console = Console(spur.LocalShell(), binary_stdout)
+            pool = daemon.RuntimePool(builders, console, daemon.create_pool_dir(), size=args.size)
+            try:
+                for path in args.paths:
+                    project_config = config.read(path)
+                    language_builder = builders[project_config.language](console)
+                    for entry in language_builder.matrix(project_config):
+                        pool.warm(project_config.language, entry)
+                console.write("Listening on {0}\n".format(socket_path).encode("utf8"))
+                daemon.serve(pool, socket_path)
+            except KeyboardInterrupt:
+                pass
+            finally:
+                pool.close()
+        
+        return Result(0)
+
+
+class InterpretersCommand(object):
+    name = "interpreters"
+    
+    def create_parser(self, subparser):
+        subparser.add_argument("--refresh", action="store_true")
+    
+    def execute(self, args):
+        from .consoles import Result
+        from .platforms import interpreters
+        
+        registry = interpreters.create_registry()
+        for interpreter in registry.interpreters(refresh=args.refresh):
+            sys.stdout.write("{0}: {1} {2} ({3}) {4}\n".format(
+                interpreter.name,
+                interpreter.implementation,
+                interpreter.version,
+                interpreter.abi,
+                interpreter.path,
+            ))
+        return Result(0)
@@ -1,27 +1,62 @@
 import os
-import sys
+import hashlib
+import threading
 
 import yaml
 
+from .strings import is_string
+
+
+# The C loader is much faster, but is only available if PyYAML was built
+# against LibYAML
+_Loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+# Parsed configs by path
+_configs = {}
+_configs_lock = threading.Lock()
+
 
 def read(path):
-    with open(os.path.join(path, ".travis.yml")) as yml_file:
-        return read_travis_yml(yml_file)
+    yml_path = os.path.abspath(os.path.join(path, ".travis.yml"))
+    with open(yml_path, "rb") as yml_file:
+        contents = yml_file.read()
+    content_hash = hashlib.sha1(contents).hexdigest()
+
+    with _configs_lock:
+        cached = _configs.get(yml_path)
+    if cached is not None and cached.content_hash == content_hash:
+        return cached
+
+    project_config = TravisConfig(yaml.load(contents, Loader=_Loader), content_hash=content_hash)
+    with _configs_lock:
+        _configs[yml_path] = project_config
+    return project_config
 
 
 def read_travis_yml(yml_file):
-    config = yaml.load(yml_file)
+    config = yaml.load(yml_file, Loader=_Loader)
     return TravisConfig(config)
 
 
 class TravisConfig(object):
-    def __init__(self, yaml):
+    # Configs are shared between builds, so lists are normalised once into
+    # tuples, and callers are given copies
+
+    def __init__(self, yaml, content_hash=None):
+        if yaml is None:
+            yaml = {}
         self._yaml = yaml
-        
+        self.content_hash = content_hash
+        self._lists = dict(
+            (name, _normalise_list(value))
+            for name, value in yaml.items()
+            if is_string(value) or isinstance(value, list)
+        )
+
     @property
     def language(self):
         return self._yaml.get("language")
-        
+
     @property
     def script(self):
         return self.get_list("script")
@@ -29,19 +64,20 @@ class TravisConfig(object):
     @property
     def install(self):
         return self.get_list("install")
-        
+
+    def get(self, name, default=None):
+        return self._yaml.get(name, default)
+
     def get_list(self, name, default=None):
-        value = self._yaml.get(name, default)
-        if _is_string(value):
-            return [value]
+        if name in self._lists:
+            return list(self._lists[name])
         else:
-            return value
+            return self._yaml.get(name, default)
 
 
-def _is_string(value):
-    if sys.version_info[0] <= 2:
-        string_cls = basestring
+def _normalise_list(value):
+    if is_string(value):
+        return (value, )
     else:
-        string_cls = str
-        
-    return isinstance(value, string_cls)
+        return tuple(value)
+
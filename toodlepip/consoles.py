@@ -1,19 +1,66 @@
+import os
+import signal
 import pipes
+import uuid
+import threading
+import subprocess
+import time
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+import spur
+
+from .timing import Timings
+from .cancellation import Cancellation, CancelledError
+
+
+# Commands that are still running after being sent SIGTERM are killed
+_kill_grace_period = 5
 
 
 class Console(object):
-    def __init__(self, shell, stdout):
+    def __init__(self, shell, stdout, timestamps=False, start_time=None, timings=None, cancellation=None):
         self._shell = shell
         self._stdout = stdout
+        self._timestamps = timestamps
+        self._start_time = time.time() if start_time is None else start_time
+        self.timings = Timings() if timings is None else timings
+        self.cancellation = Cancellation() if cancellation is None else cancellation
+    
+    def with_stdout(self, stdout):
+        return Console(
+            self._shell,
+            stdout,
+            timestamps=self._timestamps,
+            start_time=self._start_time,
+            timings=self.timings,
+            cancellation=self.cancellation,
+        )
+    
+    def tee(self, output):
+        return self.with_stdout(_Tee([self._stdout, output]))
+    
+    def write(self, output):
+        self._stdout.write(output)
+        self._stdout.flush()
         
     def run(self, description, command, **kwargs):
         return self.run_all(description, [command], **kwargs)
         
     def run_all(self, description, commands, quiet=False, cwd=None, allow_error=True):
-        self._write_description(description)
+        self.write_description(description)
         for command in commands:
+            if self.cancellation.is_cancelled:
+                if allow_error:
+                    return cancelled_result()
+                else:
+                    raise CancelledError()
+            
             if not quiet:
-                self._write_command(command)
+                self.write_command(command)
             
             process_stdout = None if quiet else self._stdout
             result = self._shell.run(
@@ -29,7 +76,10 @@ class Console(object):
             
         return Result(0)
     
-    def _write_description(self, description):
+    def start_session(self, cwd=None, entry=None, namespace=None):
+        return ShellSession(self, cwd=cwd, entry=entry, namespace=namespace)
+    
+    def write_description(self, description):
         if description:
             # TODO: detect terminal
             self._stdout.write(b'\033[1m')
@@ -38,10 +88,364 @@ class Console(object):
             self._stdout.write(b'\033[0m')
             self._stdout.flush()
     
-    def _write_command(self, command):
+    def command_stdout(self, label):
+        if self._timestamps:
+            return _LineTagger(self._stdout, lambda: self._tag(label))
+        else:
+            return self._stdout
+    
+    def _tag(self, label):
+        elapsed = time.time() - self._start_time
+        minutes, seconds = divmod(elapsed, 60)
+        tag = "[{0:02d}:{1:04.1f}{2}] ".format(
+            int(minutes),
+            seconds,
+            "" if label is None else " {0}".format(label),
+        )
+        return tag.encode("utf8")
+    
+    def write_command(self, command):
         self._stdout.write(b"$ ")
         self._stdout.write(command.display.encode("utf8"))
         self._stdout.write(b"\n")
+    
+    def spawn(self, command, stdout, cwd=None):
+        return _spawn(self._shell, command, stdout=stdout, cwd=cwd, cancellation=self.cancellation)
+
+
+class ShellSession(object):
+    # Runs commands in a single long-lived shell so that state such as the
+    # working directory and exported variables carries over between
+    # commands, as on Travis. The exit status of each command is written
+    # to the shell's output after a marker that is unique to the session.
+    #
+    # When the build is cancelled, the shell's process group is killed,
+    # stopping the running command and anything it started. Commands in
+    # cleanup steps are run with a cleanup_timeout: they still run after
+    # cancellation, but are killed if they take longer than the timeout.
+    #
+    # If a namespace is given, the shell is run inside it.
+    
+    def __init__(self, console, cwd, entry, namespace=None):
+        self._console = console
+        self._cwd = cwd
+        self._entry = entry
+        self._namespace = namespace
+        self._marker = "__toodlepip_status_{0}__".format(uuid.uuid4().hex)
+        self._process = None
+        self._output = None
+        self._setup = None
+        self._killed = False
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *args):
+        self.close()
+    
+    def run(self, description, command, **kwargs):
+        return self.run_all(description, [command], **kwargs)
+    
+    def run_all(self, description, commands, quiet=False, setup=None, label=None, cleanup_timeout=None):
+        self._console.write_description(description)
+        if label is None:
+            return self._run_all(commands, quiet, setup, label, cleanup_timeout)
+        else:
+            if self._process is None:
+                self._start()
+            with self._console.timings.record("step", label, entry=self._entry, cpu_time=self._cpu_time):
+                return self._run_all(commands, quiet, setup, label, cleanup_timeout)
+    
+    def _run_all(self, commands, quiet, setup, label, cleanup_timeout):
+        for command in commands:
+            if cleanup_timeout is None and self._console.cancellation.is_cancelled:
+                return cancelled_result()
+            
+            if setup is not None and setup != self._setup:
+                result = self._run_command(setup, None, cleanup_timeout)
+                if result.return_code != 0:
+                    return result
+                self._setup = setup
+            
+            if quiet:
+                stdout = None
+            else:
+                self._console.write_command(command)
+                stdout = self._console.command_stdout(label)
+            
+            if self._process is None:
+                self._start()
+            with self._console.timings.record("command", command.display, entry=self._entry, cpu_time=self._cpu_time):
+                result = self._run_command(command.actual, stdout, cleanup_timeout)
+            if result.return_code != 0:
+                return result
+        
+        return Result(0)
+    
+    def close(self):
+        if self._process is not None:
+            process = self._process
+            self._process = None
+            if process.is_running():
+                try:
+                    process.stdin_write(b"exit 0\n")
+                except (IOError, OSError):
+                    pass
+            process.wait_for_result()
+    
+    def _cpu_time(self):
+        if self._process is None:
+            return None
+        else:
+            return getattr(self._process, "cpu_time", lambda: None)()
+    
+    def _run_command(self, command, stdout, cleanup_timeout):
+        if self._process is None:
+            self._start()
+        
+        self._output.stdout = stdout
+        script = "eval {0} </dev/null\nprintf '%s %d\\n' {1} \"$?\"\n".format(
+            pipes.quote(command),
+            pipes.quote(self._marker),
+        )
+        
+        try:
+            self._process.stdin_write(script.encode("utf8"))
+        except (IOError, OSError):
+            # The shell has been killed, which is detected while waiting
+            pass
+        
+        self._killed = False
+        if cleanup_timeout is None:
+            deadline = None
+            registration = self._console.cancellation.on_cancel(self._kill)
+        else:
+            deadline = threading.Timer(cleanup_timeout, self._kill)
+            deadline.daemon = True
+            registration = self._console.cancellation.on_cancel(deadline.start)
+        try:
+            return_code = self._wait_for_status()
+        finally:
+            registration.remove()
+            if deadline is not None:
+                deadline.cancel()
+        
+        if self._killed and return_code != 0:
+            return cancelled_result(return_code)
+        else:
+            return Result(return_code)
+    
+    def _kill(self):
+        self._killed = True
+        process = self._process
+        if process is not None:
+            _kill_process(process)
+    
+    def _start(self):
+        self._output = _StatusMarkerParser(self._marker.encode("ascii"))
+        if self._namespace is None:
+            command = ["sh"]
+        else:
+            command = self._namespace.shell_command(["sh"], cwd=self._cwd)
+        self._process = self._console.spawn(command, stdout=self._output, cwd=self._cwd)
+        self._process.stdin_write(b"exec 2>&1\n")
+        self._setup = None
+    
+    def _wait_for_status(self):
+        while True:
+            try:
+                return self._output.statuses.get(timeout=0.1)
+            except queue.Empty:
+                if not self._process.is_running():
+                    return self._wait_for_exit()
+    
+    def _wait_for_exit(self):
+        # The command exited the shell (for instance, by running exit), so
+        # the next command will be run in a fresh shell
+        process = self._process
+        self._process = None
+        result = process.wait_for_result()
+        self._output.finish()
+        try:
+            return self._output.statuses.get_nowait()
+        except queue.Empty:
+            return result.return_code
+
+
+def _spawn(shell, command, stdout, cwd, cancellation):
+    if isinstance(shell, spur.LocalShell):
+        return _LocalProcess(command, stdout=stdout, cwd=cwd, cancellation=cancellation)
+    else:
+        return shell.spawn(command, stdout=stdout, stderr=stdout, cwd=cwd, allow_error=True)
+
+
+def _kill_process(process):
+    if isinstance(process, _LocalProcess):
+        process.kill()
+    elif hasattr(process, "send_signal"):
+        process.send_signal(signal.SIGTERM)
+
+
+class _LocalProcess(object):
+    # spur reads output a byte at a time, so local processes are spawned
+    # directly so that their output can be read in chunks
+    
+    def __init__(self, command, stdout, cwd, cancellation):
+        self._process = subprocess.Popen(
+            command,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            cwd=cwd,
+            # Run the shell in its own process group so that the commands it
+            # runs can be killed along with it
+            preexec_fn=os.setsid,
+        )
+        self._process_group = cancellation.track_process_group(self._process.pid)
+        self._stdout = stdout
+        self._reader = threading.Thread(target=self._read_output)
+        self._reader.daemon = True
+        self._reader.start()
+    
+    def stdin_write(self, value):
+        self._process.stdin.write(value)
+        self._process.stdin.flush()
+    
+    def is_running(self):
+        return self._process.poll() is None
+    
+    def send_signal(self, signal):
+        self._process.send_signal(signal)
+    
+    def kill(self):
+        if not self._signal_group(signal.SIGTERM):
+            return
+        force_kill = threading.Timer(_kill_grace_period, lambda: self._signal_group(signal.SIGKILL))
+        force_kill.daemon = True
+        force_kill.start()
+    
+    def _signal_group(self, signal_number):
+        try:
+            os.killpg(self._process.pid, signal_number)
+            return True
+        except OSError:
+            return False
+    
+    def cpu_time(self):
+        # The CPU time of the process and the children it has waited for,
+        # which for a shell includes each command once it's finished
+        try:
+            with open("/proc/{0}/stat".format(self._process.pid)) as stat_file:
+                fields = stat_file.read().rsplit(")", 1)[1].split()
+        except (IOError, OSError, IndexError):
+            return None
+        ticks = sum(int(field) for field in fields[11:15])
+        return ticks / float(os.sysconf("SC_CLK_TCK"))
+    
+    def wait_for_result(self):
+        self._reader.join()
+        return_code = self._process.wait()
+        self._process_group.remove()
+        return Result(return_code)
+    
+    def _read_output(self):
+        output_fd = self._process.stdout.fileno()
+        while True:
+            output = os.read(output_fd, 64 * 1024)
+            if not output:
+                return
+            self._stdout.write(output)
+
+
+class _Tee(object):
+    def __init__(self, outputs):
+        self._outputs = outputs
+    
+    def write(self, output):
+        for stdout in self._outputs:
+            stdout.write(output)
+    
+    def flush(self):
+        for stdout in self._outputs:
+            stdout.flush()
+
+
+class _LineTagger(object):
+    def __init__(self, stdout, tag):
+        self._stdout = stdout
+        self._tag = tag
+        self._at_line_start = True
+    
+    def write(self, output):
+        tagged = []
+        lines = output.split(b"\n")
+        for index, line in enumerate(lines):
+            is_last = index == len(lines) - 1
+            if is_last and not line:
+                break
+            if self._at_line_start:
+                tagged.append(self._tag())
+            tagged.append(line)
+            if is_last:
+                self._at_line_start = False
+            else:
+                tagged.append(b"\n")
+                self._at_line_start = True
+        self._stdout.write(b"".join(tagged))
+    
+    def flush(self):
+        self._stdout.flush()
+
+
+class _StatusMarkerParser(object):
+    def __init__(self, marker):
+        self.stdout = None
+        self.statuses = queue.Queue()
+        self._marker = marker + b" "
+        self._pending = b""
+        self._lock = threading.Lock()
+    
+    def write(self, output):
+        with self._lock:
+            self._pending += output
+            while True:
+                marker_index = self._pending.find(self._marker)
+                if marker_index == -1:
+                    break
+                
+                status_start = marker_index + len(self._marker)
+                status_end = self._pending.find(b"\n", status_start)
+                if status_end == -1:
+                    self._write(self._pending[:marker_index])
+                    self._pending = self._pending[marker_index:]
+                    return
+                
+                self._write(self._pending[:marker_index])
+                self.statuses.put(int(self._pending[status_start:status_end]))
+                self._pending = self._pending[status_end + 1:]
+            
+            partial_marker_length = self._partial_marker_length()
+            self._write(self._pending[:len(self._pending) - partial_marker_length])
+            self._pending = self._pending[len(self._pending) - partial_marker_length:]
+    
+    def finish(self):
+        with self._lock:
+            self._write(self._pending)
+            self._pending = b""
+    
+    def flush(self):
+        if self.stdout is not None:
+            self.stdout.flush()
+    
+    def _partial_marker_length(self):
+        for length in range(min(len(self._marker) - 1, len(self._pending)), 0, -1):
+            if self._marker.startswith(self._pending[-length:]):
+                return length
+        return 0
+    
+    def _write(self, output):
+        if output and self.stdout is not None:
+            self.stdout.write(output)
 
 
 class Command(object):
@@ -54,19 +458,27 @@ class Command(object):
     def shell(command):
         return Command(command, command)
         
-    @staticmethod
-    def hidden_prefix(command, prefix):
-        actual_command = "{0}; {1}".format(prefix, command)
-        return Command(display=command, actual=actual_command)
-    
     def __init__(self, display, actual):
         self.display = display
         self.actual = actual
 
 
 class Result(object):
-    def __init__(self, return_code):
+    def __init__(self, return_code, cancelled=False):
         self.return_code = return_code
+        self.cancelled = cancelled
+
+
+# The exit code of a shell killed by SIGINT
+_cancelled_return_code = 130
+
+
+def cancelled_result(return_code=None):
+    if return_code is None:
+        return_code = _cancelled_return_code
+    elif return_code < 0:
+        return_code = 128 - return_code
+    return Result(return_code, cancelled=True)
 
 
 def _join_shell_args(args):
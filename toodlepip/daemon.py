@@ -0,0 +1,383 @@
+import os
+import json
+import uuid
+import errno
+import shutil
+import socket
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+import xdg.BaseDirectory
+
+
+def default_socket_path():
+    return os.path.join(xdg.BaseDirectory.save_data_path("toodlepip"), "daemon.sock")
+
+
+def create_pool_dir():
+    # Each daemon keeps its pool in a directory named after its PID, and
+    # removes the pools of daemons that are no longer running
+    pools_dir = xdg.BaseDirectory.save_data_path("toodlepip/pools")
+    for name in os.listdir(pools_dir):
+        if name.isdigit() and not _is_running(int(name)):
+            _remove_unused_runtimes(os.path.join(pools_dir, name))
+    path = os.path.join(pools_dir, str(os.getpid()))
+    os.mkdir(path)
+    return path
+
+
+def _remove_unused_runtimes(root):
+    # Runtimes that are checked out are left for the builds using them to
+    # discard, unless the build is no longer running. Each checked out
+    # runtime has a file next to it with the PID of the build.
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        if name.endswith(_checkout_suffix):
+            if not os.path.exists(path[:-len(_checkout_suffix)]):
+                _remove_file(path)
+        elif _checkout_pid(path) is None:
+            _remove_runtime(path)
+    try:
+        os.rmdir(root)
+    except OSError:
+        pass
+
+
+_checkout_suffix = ".checkout"
+
+
+def _checkout_pid(path):
+    try:
+        with open(path + _checkout_suffix) as checkout_file:
+            pid = int(checkout_file.read())
+    except (IOError, OSError, ValueError):
+        return None
+    if _is_running(pid):
+        return pid
+    else:
+        return None
+
+
+def _is_running(pid):
+    try:
+        os.kill(pid, 0)
+        return True
+    except OSError as error:
+        return error.errno != errno.ESRCH
+
+
+class RuntimePool(object):
+    # Keeps up to size prepared runtimes for each entry that has been warmed
+    # or checked out, replacing each runtime that's checked out in the
+    # background. Runtimes are prepared one at a time, so that the daemon
+    # doesn't compete too much with the builds it's serving. Checked out
+    # runtimes are never returned to the pool, since builds install
+    # packages into them, and are left in place when the pool is closed
+    # until the build discards them.
+    #
+    # Runtimes are pooled by the runtime_key of their entry, such as the
+    # interpreter that a virtualenv was created with, if the language
+    # builder has one. Builds check out runtimes with the key they expect,
+    # and runtimes prepared with any other key for the same entry are
+    # discarded.
+
+    def __init__(self, builders, console, root, size=2):
+        self._builders = builders
+        self._console = console
+        self._root = root
+        self._size = size
+        self._language_builders = {}
+        self._wanted = {}
+        self._ready = {}
+        self._pending = {}
+        self._generations = {}
+        self._checked_out = set()
+        self._closed = False
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target=self._prepare_runtimes)
+        self._worker.daemon = True
+        self._worker.start()
+
+    def warm(self, language, entry):
+        if not self._supports(language):
+            return
+        runtime_key = self._runtime_key(language, entry)
+        with self._lock:
+            self._want(language, entry, runtime_key)
+
+    def checkout(self, language, entry, runtime_key=None, pid=None):
+        if not self._supports(language):
+            return None
+        with self._lock:
+            key = self._want(language, entry, runtime_key)
+            ready = self._ready[key]
+            if not ready:
+                return None
+            path = ready.pop(0)
+            with open(path + _checkout_suffix, "w") as checkout_file:
+                checkout_file.write(str(os.getpid() if pid is None else pid))
+            self._checked_out.add(path)
+            self._replenish(key)
+            return path
+
+    def discard(self, path):
+        with self._lock:
+            if path not in self._checked_out:
+                return False
+            self._checked_out.remove(path)
+
+        remover = threading.Thread(target=_remove_runtime, args=(path, ))
+        remover.daemon = True
+        remover.start()
+        return True
+
+    def ready_count(self, language, entry, runtime_key=None):
+        with self._lock:
+            return len(self._ready.get(_pool_key(language, entry, runtime_key), []))
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+        self._queue.put(None)
+        self._worker.join()
+        _remove_unused_runtimes(self._root)
+
+    def _supports(self, language):
+        builder_class = self._builders.get(language)
+        return builder_class is not None and hasattr(builder_class, "prepare_runtime")
+
+    def _want(self, language, entry, runtime_key):
+        key = _pool_key(language, entry, runtime_key)
+        if key not in self._wanted:
+            self._discard_other_runtimes(language, entry, key)
+            self._wanted[key] = (language, entry, runtime_key)
+            self._ready.setdefault(key, [])
+            self._pending[key] = 0
+            self._generations.setdefault(key, 0)
+            self._replenish(key)
+        return key
+
+    def _discard_other_runtimes(self, language, entry, key):
+        for other_key in list(self._ready):
+            if json.loads(other_key)[:2] == [language, entry] and other_key != key:
+                if other_key in self._wanted:
+                    self._stop_preparing(other_key)
+                for path in self._ready.pop(other_key):
+                    remover = threading.Thread(target=_remove_runtime, args=(path, ))
+                    remover.daemon = True
+                    remover.start()
+
+    def _stop_preparing(self, key):
+        # Stop preparing runtimes for the key until it's next wanted
+        del self._wanted[key]
+        del self._pending[key]
+        self._generations[key] += 1
+
+    def _replenish(self, key):
+        missing = self._size - len(self._ready[key]) - self._pending[key]
+        for _ in range(missing):
+            self._pending[key] += 1
+            self._queue.put((key, self._generations[key]))
+
+    def _prepare_runtimes(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            
+            key, generation = item
+            with self._lock:
+                if self._closed:
+                    return
+                if key not in self._wanted or generation != self._generations[key]:
+                    continue
+                language, entry, runtime_key = self._wanted[key]
+
+            path = os.path.join(self._root, uuid.uuid4().hex)
+            try:
+                if self._runtime_key(language, entry) != runtime_key:
+                    raise RuntimeChangedError("its runtime has changed since it was checked out")
+                os.makedirs(path)
+                self._language_builder(language).prepare_runtime(entry, path)
+            except Exception as error:
+                _remove_dir(path)
+                self._console.write("Could not prepare runtime for {0}: {1}\n".format(entry, error).encode("utf8"))
+                with self._lock:
+                    if generation == self._generations[key]:
+                        self._stop_preparing(key)
+                continue
+
+            with self._lock:
+                if generation == self._generations[key]:
+                    self._pending[key] -= 1
+                    self._ready[key].append(path)
+                    continue
+            _remove_dir(path)
+
+    def _runtime_key(self, language, entry):
+        language_builder = self._language_builder(language)
+        return getattr(language_builder, "runtime_key", lambda entry: None)(entry)
+
+    def _language_builder(self, language):
+        if language not in self._language_builders:
+            self._language_builders[language] = self._builders[language](self._console)
+        return self._language_builders[language]
+
+
+class RuntimeChangedError(Exception):
+    pass
+
+
+def _pool_key(language, entry, runtime_key):
+    return json.dumps([language, entry, runtime_key], sort_keys=True)
+
+
+def _remove_runtime(path):
+    _remove_dir(path)
+    _remove_file(path + _checkout_suffix)
+
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _remove_dir(path):
+    shutil.rmtree(path, ignore_errors=True)
+
+
+def serve(pool, socket_path):
+    server = create_server(pool, socket_path)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        _remove_socket(socket_path)
+
+
+def create_server(pool, socket_path):
+    if connect(socket_path) is not None:
+        raise DaemonAlreadyRunningError("A daemon is already listening on {0}".format(socket_path))
+    _remove_socket(socket_path)
+
+    server = _Server(socket_path, _RequestHandler)
+    server.pool = pool
+    return server
+
+
+class DaemonAlreadyRunningError(Exception):
+    pass
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            response = self._handle_request(json.loads(self.rfile.readline().decode("utf8")))
+        except (ValueError, KeyError, TypeError, AttributeError) as error:
+            response = {"error": "Invalid request: {0}".format(error)}
+        self.wfile.write(json.dumps(response).encode("utf8") + b"\n")
+
+    def _handle_request(self, request):
+        pool = self.server.pool
+        if request["command"] == "checkout":
+            return {"path": pool.checkout(
+                request["language"],
+                request["entry"],
+                runtime_key=request.get("runtime_key"),
+                pid=request.get("pid"),
+            )}
+        elif request["command"] == "discard":
+            return {"discarded": pool.discard(request["path"])}
+        else:
+            return {}
+
+
+def _remove_socket(path):
+    try:
+        os.remove(path)
+    except OSError as error:
+        if error.errno != errno.ENOENT:
+            raise
+
+
+def connect(socket_path):
+    client = RuntimePoolClient(socket_path)
+    if os.path.exists(socket_path) and client.ping():
+        return client
+    else:
+        return None
+
+
+class RuntimePoolClient(object):
+    # If the daemon can't be reached, runtimes aren't checked out, and
+    # builds create their own
+
+    def __init__(self, socket_path):
+        self._socket_path = socket_path
+
+    def ping(self):
+        return self._request({"command": "ping"}) is not None
+
+    def checkout(self, language, entry, runtime_key=None):
+        response = self._request({
+            "command": "checkout",
+            "language": language,
+            "entry": entry,
+            "runtime_key": runtime_key,
+            "pid": os.getpid(),
+        })
+        if response is None or response.get("path") is None:
+            return None
+        else:
+            return _PooledRuntimeDir(self, response["path"])
+
+    def discard(self, path):
+        # If the daemon has stopped, the build removes the runtime itself
+        response = self._request({"command": "discard", "path": path})
+        if response is None or not response.get("discarded"):
+            _remove_runtime(path)
+
+    def _request(self, request):
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            client.connect(self._socket_path)
+            client.sendall(json.dumps(request).encode("utf8") + b"\n")
+            response_file = client.makefile("rb")
+            try:
+                response = response_file.readline()
+            finally:
+                response_file.close()
+        except socket.error:
+            return None
+        finally:
+            client.close()
+
+        try:
+            return json.loads(response.decode("utf8"))
+        except ValueError:
+            return None
+
+
+class _PooledRuntimeDir(object):
+    def __init__(self, client, path):
+        self._client = client
+        self.path = path
+
+    def close(self):
+        self._client.discard(self.path)
@@ -1,37 +1,526 @@
 import os
+import errno
+import shutil
+import fcntl
+import time
+import contextlib
+import json
+import hashlib
+import fnmatch
+import subprocess
 
-import spur
-import mayo
+from .parallel import map_in_parallel
 
+_parallel_copy_threshold = 256
+_copy_jobs = 8
 
-_local = spur.LocalShell()
 
 def copy(source, destination):
-    if os.path.isdir(destination) and _is_git_repo(source):
+    timings = _Timings()
+    if os.path.isdir(source):
+        with timings.phase("filter"):
+            include = copy_filter(source)
+        
+        with timings.phase("walk"):
+            directories, filenames = _list_tree(source, include)
+        
+        with timings.phase("copy"):
+            _copy_tree(source, destination, directories, filenames)
+    else:
+        filenames = [os.path.basename(source)]
+        with timings.phase("copy"):
+            _mkdir_p(os.path.dirname(destination))
+            _copy_entry(source, destination)
+    
+    return CopyResult(len(filenames), timings.phases)
+
+
+def copy_tree(source, destination):
+    # Copies all of source, including files ignored by git, such as a
+    # virtualenv. Modification times are kept, so that compiled Python
+    # files are still up to date.
+    directories, filenames = _list_tree(source, lambda filename: True)
+    _copy_tree(source, destination, directories, filenames, preserve_times=True)
+
+
+def snapshot_git(source, destination):
+    # git archive leaves out submodules and files marked export-ignore, and
+    # rewrites files marked export-subst, so those projects are copied
+    if not _is_git_repo(source) or not _has_head(source) or not _archive_is_complete(source):
+        return copy(source, destination)
+    
+    timings = _Timings()
+    _mkdir_p(destination)
+    
+    with timings.phase("archive"):
+        prefix = _local().run(["git", "rev-parse", "--show-prefix"], cwd=source).output.decode("utf8").strip()
+        tree = "HEAD:{0}".format(prefix) if prefix else "HEAD"
+        extracted = _extract_archive(source, tree, destination).splitlines()
+        file_count = len([path for path in extracted if not path.endswith(b"/")])
+    
+    with timings.phase("changes"):
+        changed = _local().run(
+            ["git", "diff", "--name-only", "--relative", "-z", "HEAD"],
+            cwd=source,
+        ).output.split(b"\0")
+        for filename in changed:
+            if filename:
+                _copy_change(source, destination, filename.decode("utf8"))
+    
+    return CopyResult(file_count, timings.phases)
+
+
+def _archive_is_complete(path):
+    git_dir = _local().run(["git", "rev-parse", "--git-dir"], cwd=path).output.decode("utf8").strip()
+    top_level = _local().run(["git", "rev-parse", "--show-toplevel"], cwd=path).output.decode("utf8").strip()
+    if os.path.exists(os.path.join(top_level, ".gitmodules")):
+        return False
+    
+    attributes_files = _local().run(
+        ["git", "ls-files", "-z", "--full-name", "--", ":(top,glob)**/.gitattributes"],
+        cwd=path,
+    ).output.split(b"\0")
+    attributes_paths = [os.path.join(path, git_dir, "info", "attributes")] + [
+        os.path.join(top_level, filename.decode("utf8"))
+        for filename in attributes_files
+        if filename
+    ]
+    for attributes_path in attributes_paths:
+        try:
+            with open(attributes_path, "rb") as attributes_file:
+                attributes = attributes_file.read()
+        except (IOError, OSError):
+            continue
+        if b"export-ignore" in attributes or b"export-subst" in attributes:
+            return False
+    return True
+
+
+def _extract_archive(source, tree, destination):
+    # git archive and tar are run separately, rather than as a shell
+    # pipeline, so that a failure of either is detected
+    archive = subprocess.Popen(
+        ["git", "archive", "--format=tar", tree],
+        cwd=source,
+        stdout=subprocess.PIPE,
+    )
+    try:
+        extract = subprocess.Popen(
+            ["tar", "-x", "-v", "-C", destination],
+            stdin=archive.stdout,
+            stdout=subprocess.PIPE,
+        )
+        archive.stdout.close()
+        output = extract.communicate()[0]
+    finally:
+        archive_return_code = archive.wait()
+    
+    if archive_return_code != 0:
+        raise SnapshotError("git archive of {0} failed with return code {1}".format(tree, archive_return_code))
+    if extract.returncode != 0:
+        raise SnapshotError("extracting git archive failed with return code {0}".format(extract.returncode))
+    return output
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def sync(source, destination, index_path, keep_extra_files=False):
+    # Files in destination that aren't in source, such as those created by
+    # a previous build, are removed unless keep_extra_files is set, so that
+    # each build starts from the same files
+    timings = _Timings()
+    with timings.phase("filter"):
+        include = copy_filter(source)
+    
+    with timings.phase("walk"):
+        directories, filenames = _list_tree(source, include)
+    
+    with timings.phase("compare"):
+        previous_index = _read_index(index_path)
+        index = {}
+        changed = []
+        for filename in filenames:
+            entry = _sync_entry(source, destination, filename, previous_index.get(filename))
+            if entry is None:
+                changed.append(filename)
+            else:
+                index[filename] = entry
+    
+    with timings.phase("copy"):
+        removed = set(previous_index) - set(filenames)
+        _remove_synced_files(destination, removed, set(directories))
+        if not keep_extra_files:
+            _remove_extra_files(destination, directories, filenames)
+        _remove_mismatched_types(destination, directories, changed)
+        _copy_tree(source, destination, directories, changed)
+        for filename in changed:
+            index[filename] = _index_entry(source, destination, filename)
+        _write_index(index_path, index)
+    
+    return CopyResult(len(changed), timings.phases, filenames=changed + sorted(removed))
+
+
+def tree_hash(path, patterns=None):
+    # A hash of the files that would be copied from path, including their
+    # permissions. If patterns is given, only files whose paths match one
+    # of the patterns are included.
+    include = copy_filter(path)
+    directories, filenames = _list_tree(path, include)
+    if patterns is not None:
+        filenames = [
+            filename for filename in filenames
+            if any(fnmatch.fnmatch(filename, pattern) for pattern in patterns)
+        ]
+    return _hash_files(path, filenames)
+
+
+def git_tree_hash(path):
+    # A hash of the files that snapshot_git would copy from path: the files
+    # tracked by git, as they are in the working tree
+    if not _is_git_repo(path) or not _has_head(path) or not _archive_is_complete(path):
+        return tree_hash(path)
+    
+    tracked = _local().run(["git", "ls-files", "-z"], cwd=path).output.split(b"\0")
+    filenames = [
+        filename.decode("utf8") for filename in tracked
+        if filename and os.path.lexists(os.path.join(path, filename.decode("utf8")))
+    ]
+    return _hash_files(path, filenames)
+
+
+def _hash_files(path, filenames):
+    filenames = sorted(filenames)
+    
+    def _file_hash(filename):
+        full_path = os.path.join(path, filename)
+        executable = not os.path.islink(full_path) and os.access(full_path, os.X_OK)
+        return "{0}\0{1}\0{2}\0".format(filename, int(executable), _content_hash(full_path))
+    
+    if len(filenames) < _parallel_copy_threshold:
+        file_hashes = [_file_hash(filename) for filename in filenames]
+    else:
+        file_hashes = map_in_parallel(_file_hash, filenames, jobs=_copy_jobs)
+    
+    result = hashlib.sha1()
+    for file_hash in file_hashes:
+        result.update(file_hash.encode("utf8"))
+    return result.hexdigest()
+
+
+def _sync_entry(source, destination, filename, previous_entry):
+    # Returns the index entry for the file if it's unchanged since the last
+    # sync, or None if it needs copying
+    if previous_entry is None:
+        return None
+    
+    source_path = os.path.join(source, filename)
+    destination_path = os.path.join(destination, filename)
+    try:
+        destination_signature = _signature(destination_path)
+    except OSError:
+        return None
+    if destination_signature != previous_entry["destination"]:
+        return None
+    
+    source_signature = _signature(source_path)
+    if source_signature == previous_entry["source"]:
+        return previous_entry
+    
+    # The file has been touched, but may not have changed
+    if _content_hash(source_path) == previous_entry["hash"]:
+        return dict(previous_entry, source=source_signature)
+    else:
+        return None
+
+
+def _index_entry(source, destination, filename):
+    source_path = os.path.join(source, filename)
+    return {
+        "source": _signature(source_path),
+        "destination": _signature(os.path.join(destination, filename)),
+        "hash": _content_hash(source_path),
+    }
+
+
+def _signature(path):
+    stat = os.lstat(path)
+    return [stat.st_size, stat.st_mtime]
+
+
+def _content_hash(path):
+    if os.path.islink(path):
+        return "link:{0}".format(os.readlink(path))
+    
+    content_hash = hashlib.sha1()
+    with open(path, "rb") as content_file:
+        for chunk in iter(lambda: content_file.read(64 * 1024), b""):
+            content_hash.update(chunk)
+    return content_hash.hexdigest()
+
+
+def _remove_synced_files(destination, filenames, directories):
+    for filename in filenames:
+        path = os.path.join(destination, filename)
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path)
+        else:
+            _remove_file(path)
+        
+        parent = os.path.dirname(filename)
+        while parent and parent not in directories:
+            try:
+                os.rmdir(os.path.join(destination, parent))
+            except OSError:
+                break
+            parent = os.path.dirname(parent)
+
+
+def _remove_extra_files(destination, directories, filenames):
+    directories = set(directories)
+    filenames = set(filenames)
+    for root, dirs, files in os.walk(destination):
+        relative_root = os.path.relpath(root, destination)
+        
+        def _relative(name):
+            if relative_root == ".":
+                return name
+            else:
+                return os.path.join(relative_root, name)
+        
+        for name in list(dirs):
+            relative_path = _relative(name)
+            if os.path.islink(os.path.join(root, name)) or relative_path not in directories:
+                dirs.remove(name)
+                if relative_path not in filenames:
+                    _remove_entry(os.path.join(root, name))
+        
+        for name in files:
+            if _relative(name) not in filenames:
+                _remove_file(os.path.join(root, name))
+
+
+def _remove_mismatched_types(destination, directories, filenames):
+    # A path that has changed from a file to a directory, or the other way
+    # around, is removed before it's copied
+    for directory in directories:
+        path = os.path.join(destination, directory)
+        if os.path.lexists(path) and (os.path.islink(path) or not os.path.isdir(path)):
+            _remove_file(path)
+    for filename in filenames:
+        path = os.path.join(destination, filename)
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path)
+
+
+def _remove_entry(path):
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    else:
+        _remove_file(path)
+
+
+def _read_index(path):
+    try:
+        with open(path) as index_file:
+            return json.load(index_file)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def _write_index(path, index):
+    temp_path = "{0}.tmp".format(path)
+    with open(temp_path, "w") as index_file:
+        json.dump(index, index_file)
+    os.rename(temp_path, path)
+
+
+def _has_head(path):
+    result = _local().run(["git", "rev-parse", "--verify", "-q", "HEAD"], cwd=path, allow_error=True)
+    return result.return_code == 0
+
+
+def _copy_change(source, destination, filename):
+    source_path = os.path.join(source, filename)
+    destination_path = os.path.join(destination, filename)
+    if os.path.islink(source_path) or os.path.isfile(source_path):
+        _mkdir_p(os.path.dirname(destination_path))
+        _copy_entry(source_path, destination_path)
+    elif not os.path.exists(source_path):
+        _remove_file(destination_path)
+
+
+class CopyResult(object):
+    # filenames is the files that were copied or removed, if known
+    def __init__(self, file_count, timings, filenames=None):
+        self.file_count = file_count
+        self.timings = timings
+        self.filenames = filenames
+
+
+def copy_filter(source):
+    if _is_git_repo(source):
         ignored_files = _find_ignored_files(source)
+
+        def include(filename):
+            return filename not in ignored_files and filename != ".git"
         
-        for filename in all_filenames(source):
-            if filename not in ignored_files and not filename.startswith(".git/"):
-                copy(
-                    os.path.join(source, filename),
-                    os.path.join(destination, filename)
-                )
+        return include
     else:
-        _local.run(["mkdir", "-p", os.path.dirname(destination)])
-        _local.run(["cp", "-rT", source, destination])
+        return lambda filename: True
+
+
+def _copy_tree(source, destination, directories, filenames, preserve_times=False):
+    _mkdir_p(destination)
+    for directory in directories:
+        _mkdir_p(os.path.join(destination, directory))
+
+    def _copy(filename):
+        source_path = os.path.join(source, filename)
+        destination_path = os.path.join(destination, filename)
+        _copy_entry(source_path, destination_path)
+        if preserve_times and not os.path.islink(source_path):
+            source_stat = os.stat(source_path)
+            os.utime(destination_path, (source_stat.st_atime, source_stat.st_mtime))
+
+    if len(filenames) < _parallel_copy_threshold:
+        for filename in filenames:
+            _copy(filename)
+    else:
+        map_in_parallel(_copy, filenames, jobs=_copy_jobs)
+
+
+def _list_tree(path, include):
+    directories = []
+    filenames = []
+    for root, dirs, files in os.walk(path):
+        relative_root = os.path.relpath(root, path)
+
+        def _relative(name):
+            if relative_root == ".":
+                return name
+            else:
+                return os.path.join(relative_root, name)
+
+        for name in list(dirs):
+            relative_path = _relative(name)
+            if not include(relative_path):
+                dirs.remove(name)
+            elif os.path.islink(os.path.join(root, name)):
+                # os.walk doesn't follow symlinks to directories, so copy the
+                # symlink itself, as cp does
+                dirs.remove(name)
+                filenames.append(relative_path)
+            else:
+                directories.append(relative_path)
+
+        for name in files:
+            relative_path = _relative(name)
+            if include(relative_path):
+                filenames.append(relative_path)
+
+    return directories, filenames
+
+
+def _copy_entry(source, destination):
+    if os.path.islink(source):
+        _remove_file(destination)
+        os.symlink(os.readlink(source), destination)
+    else:
+        _copy_file(source, destination)
+
+
+def _copy_file(source, destination):
+    _remove_file(destination)
+    with open(source, "rb") as source_file:
+        with open(destination, "wb") as destination_file:
+            _copy_contents(source_file, destination_file)
+    shutil.copymode(source, destination)
+
+
+# From linux/fs.h
+_FICLONE = 0x40049409
+
+_unsupported_copy_errors = (errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP, errno.ENOTTY, errno.EBADF)
+
+
+def _copy_contents(source_file, destination_file):
+    source_fd = source_file.fileno()
+    destination_fd = destination_file.fileno()
+    size = os.fstat(source_fd).st_size
+    if size == 0:
+        return
+
+    if _reflink(source_fd, destination_fd):
+        return
+
+    for copy_range in _kernel_copiers:
+        if _copy_with(copy_range, source_fd, destination_fd, size):
+            return
+
+    shutil.copyfileobj(source_file, destination_file)
+
+
+def _reflink(source_fd, destination_fd):
+    try:
+        fcntl.ioctl(destination_fd, _FICLONE, source_fd)
+        return True
+    except (IOError, OSError):
+        return False
+
+
+def _copy_with(copy_range, source_fd, destination_fd, size):
+    offset = 0
+    try:
+        while offset < size:
+            copied = copy_range(source_fd, destination_fd, offset, size - offset)
+            if copied == 0:
+                break
+            offset += copied
+    except OSError as error:
+        if offset == 0 and error.errno in _unsupported_copy_errors:
+            return False
+        raise
+    return offset == size
+
+
+def _copy_file_range(source_fd, destination_fd, offset, count):
+    return os.copy_file_range(source_fd, destination_fd, count, offset, offset)
+
+
+def _sendfile(source_fd, destination_fd, offset, count):
+    return os.sendfile(destination_fd, source_fd, offset, count)
+
+
+_kernel_copiers = []
+if hasattr(os, "copy_file_range"):
+    _kernel_copiers.append(_copy_file_range)
+if hasattr(os, "sendfile"):
+    _kernel_copiers.append(_sendfile)
 
 
 def _find_ignored_files(path):
-    result = _local.run(["git", "status", "-z", "--ignored"], cwd=path)
+    # Ignored directories are reported once with a trailing slash, rather
+    # than as each file they contain, so they're pruned from the walk
+    result = _local().run(["git", "status", "-z", "--ignored"], cwd=path)
     lines = result.output.split(b"\0")
     ignore_prefix = b"!! "
-    return [
-        line[len(ignore_prefix):].decode("utf8")
+    return frozenset(
+        line[len(ignore_prefix):].decode("utf8").rstrip("/")
         for line in lines
         if line.startswith(ignore_prefix)
-    ]
+    )
+
+
+def _local():
+    import spur
+    return spur.LocalShell()
+
 
 def _is_git_repo(path):
+    import mayo
+    
     repository = mayo.repository_at(path)
     if repository is None:
         return False
@@ -46,3 +535,32 @@ def all_filenames(path):
             full_path = os.path.join(root, filename)
             result.append(os.path.relpath(full_path, path))
     return result
+
+
+class _Timings(object):
+    def __init__(self):
+        self.phases = []
+    
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.time() - start))
+
+
+def _mkdir_p(path):
+    try:
+        os.makedirs(path)
+    except OSError as error:
+        if not (error.errno == errno.EEXIST and os.path.isdir(path)):
+            raise
+
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except OSError as error:
+        if error.errno != errno.ENOENT:
+            raise
@@ -0,0 +1,219 @@
+from . import json_files
+
+
+# The number of recent durations kept for each entry, step and runtime
+_history_length = 5
+
+
+def create_history_store():
+    import xdg.BaseDirectory
+
+    return HistoryStore(xdg.BaseDirectory.save_data_path("toodlepip/history"))
+
+
+class HistoryStore(object):
+    def __init__(self, path):
+        self._path = path
+
+    def for_project(self, project_path):
+        return BuildHistory(json_files.project_file_path(self._path, project_path))
+
+
+class BuildHistory(object):
+    # The recent durations of each entry, of the steps in each entry, and
+    # of creating each runtime, which are used to predict how long entries
+    # will take
+
+    def __init__(self, path):
+        self._file = json_files.JsonFile(path)
+
+    def estimates(self):
+        return Estimates(_with_defaults(self._file.read()))
+
+    def record(self, records):
+        durations = _durations(records)
+        if not durations["entries"]:
+            return
+
+        def _update(history):
+            history = _with_defaults(history)
+            for entry_label, entry_durations in durations["entries"].items():
+                entry_history = history["entries"].setdefault(entry_label, {"total": [], "steps": {}})
+                _append(entry_history["total"], entry_durations["total"])
+                for step_name, seconds in entry_durations["steps"].items():
+                    _append(entry_history["steps"].setdefault(step_name, []), seconds)
+            for runtime, seconds in durations["runtimes"].items():
+                _append(history["runtimes"].setdefault(runtime, []), seconds)
+            return history
+
+        self._file.update(_update)
+
+
+class Estimates(object):
+    # Entries without any history are assumed to take as long as other
+    # entries with the same runtime, or failing that, any other entry. If
+    # there's no history at all, there are no estimates.
+
+    def __init__(self, history):
+        self._entries = dict(
+            (entry_label, _median(entry_history["total"]))
+            for entry_label, entry_history in history["entries"].items()
+            if entry_history["total"]
+        )
+        self._steps = dict(
+            (entry_label, dict(
+                (step_name, _median(durations))
+                for step_name, durations in entry_history["steps"].items()
+                if durations
+            ))
+            for entry_label, entry_history in history["entries"].items()
+        )
+        self._runtimes = dict(
+            (runtime, _median(durations))
+            for runtime, durations in history["runtimes"].items()
+            if durations
+        )
+
+    @property
+    def known(self):
+        return bool(self._entries)
+
+    def entry(self, entry):
+        label = _label(entry.label)
+        if label in self._entries:
+            return self._entries[label]
+
+        if entry.runtime is None:
+            same_runtime = []
+        else:
+            runtime = _label(entry.runtime)
+            same_runtime = [
+                seconds for entry_label, seconds in self._entries.items()
+                if entry_label == runtime or entry_label.startswith(runtime + " ")
+            ]
+        if same_runtime:
+            return _mean(same_runtime)
+        elif self._entries:
+            return _mean(list(self._entries.values()))
+        else:
+            return None
+
+    def group(self, group):
+        entry_estimates = [self.entry(entry) for entry in group.entries]
+        if None in entry_estimates:
+            return None
+        return self._runtimes.get(_label(group.runtime), 0) + sum(entry_estimates)
+
+    def steps(self, entry):
+        return self._steps.get(_label(entry.label), {})
+
+
+def longest_first(values, estimate):
+    # Values with the same estimate, or without one, keep their original
+    # order
+    indexed = list(enumerate(values))
+    indexed.sort(key=lambda indexed_value: (
+        -(estimate(indexed_value[1]) or 0),
+        indexed_value[0],
+    ))
+    return [value for index, value in indexed]
+
+
+def predict_total(estimates, workers):
+    # The time taken to run work with the given estimates when it's
+    # started longest first on the first worker to become free
+    loads = [0.0] * max(1, workers)
+    for seconds in sorted(estimates, reverse=True):
+        index = loads.index(min(loads))
+        loads[index] += seconds
+    return max(loads)
+
+
+def describe_predictions(estimates, entries, records, predicted_total, total):
+    # How long the build and each entry were predicted to take, and how
+    # long they took. If an entry took much longer than predicted, the
+    # step that slowed down the most is included.
+    durations = _durations(records)
+    entry_estimates = [estimates.entry(entry) for entry in entries]
+    lines = ["Predicted {0:.1f}s, took {1:.1f}s".format(predicted_total, total)]
+    for entry, predicted in zip(entries, entry_estimates):
+        entry_durations = durations["entries"].get(_label(entry.label))
+        if predicted is None or entry_durations is None:
+            continue
+        line = "  {0}: predicted {1:.1f}s, took {2:.1f}s".format(
+            entry.label or "build",
+            predicted,
+            entry_durations["total"],
+        )
+        if entry_durations["total"] > predicted * _slow_threshold:
+            slowest_step = _slowest_step(estimates.steps(entry), entry_durations["steps"])
+            if slowest_step is not None:
+                step_name, usual, actual = slowest_step
+                line += " ({0} took {1:.1f}s, usually {2:.1f}s)".format(step_name, actual, usual)
+        lines.append(line)
+    return "\n".join(lines) + "\n"
+
+
+# Entries that take this many times longer than predicted are reported as
+# slow
+_slow_threshold = 1.5
+
+
+def _slowest_step(usual_steps, actual_steps):
+    changes = [
+        (actual - usual_steps[step_name], step_name, usual_steps[step_name], actual)
+        for step_name, actual in actual_steps.items()
+        if step_name in usual_steps
+    ]
+    if not changes:
+        return None
+    change, step_name, usual, actual = max(changes)
+    if change <= 0:
+        return None
+    return step_name, usual, actual
+
+
+def _durations(records):
+    entries = {}
+    runtimes = {}
+    for record in records:
+        if record.kind == "entry":
+            entries.setdefault(_label(record.entry), {"total": 0.0, "steps": {}})["total"] += record.wall
+        elif record.kind == "runtime" and record.name == "create":
+            runtimes[_label(record.entry)] = record.wall
+    for record in records:
+        if record.kind == "step" and _label(record.entry) in entries:
+            steps = entries[_label(record.entry)]["steps"]
+            steps[record.name] = steps.get(record.name, 0.0) + record.wall
+    return {"entries": entries, "runtimes": runtimes}
+
+
+def _with_defaults(history):
+    history.setdefault("entries", {})
+    history.setdefault("runtimes", {})
+    return history
+
+
+def _append(durations, seconds):
+    durations.append(seconds)
+    del durations[:-_history_length]
+
+
+def _median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2 == 1:
+        return values[middle]
+    else:
+        return (values[middle - 1] + values[middle]) / 2.0
+
+
+def _mean(values):
+    return sum(values) / float(len(values))
+
+
+def _label(value):
+    if value is None:
+        return ""
+    else:
+        return str(value)
@@ -0,0 +1,61 @@
+from datetime import timedelta
+
+from . import caches
+
+
+# Incremented whenever the way snapshots are taken changes, so that
+# snapshots taken by older versions aren't restored
+_version = 2
+
+
+# The least recently used snapshots are removed once the snapshots take up
+# more than this many bytes
+_max_size = 4 * 1024 * 1024 * 1024
+
+
+def create_install_cache():
+    return InstallCache(caches.create_cache("installs", max_age=timedelta(days=30), max_size=_max_size))
+
+
+class InstallCache(object):
+    # Snapshots of runtimes taken after the before_install and install
+    # steps, keyed by the commands in those steps and the files that they
+    # read, such as setup.py and requirements files, so that the steps can
+    # be skipped if neither has changed
+
+    def __init__(self, cache):
+        self._cache = cache
+
+    def key(self, project_dir, project_config, entry, runtime_key, install_files):
+        from . import files
+
+        return caches.hash_key(
+            _version,
+            runtime_key,
+            project_config.language,
+            None if entry.runtime is None else str(entry.runtime),
+            entry.exports,
+            project_config.get_list("before_install", []),
+            project_config.get_list("install", []),
+            files.tree_hash(project_dir, patterns=install_files),
+        )
+
+    def project_key(self, key, project_hash):
+        # The key of a snapshot that's only restored for the same project
+        # files, such as when a copy of the project has been installed
+        return caches.hash_key(key, project_hash)
+
+    def find(self, key):
+        return self._cache.find(key)
+
+    def restore(self, key, restore):
+        # Calls restore with the path of the snapshot, which isn't removed
+        # until restore returns. Returns whether there was a snapshot.
+        with self._cache.use_found(key) as path:
+            if path is None:
+                return False
+            restore(path)
+            return True
+
+    def store(self, key, snapshot, description=None):
+        self._cache.get(key, snapshot, description=description)
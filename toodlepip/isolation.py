@@ -0,0 +1,170 @@
+import os
+import pipes
+import threading
+import subprocess
+
+from .temp import create_temp_dir
+
+
+# Each session's shell is run in new user, mount, PID, IPC and UTS
+# namespaces, with the user mapped to root so that it can mount a private
+# /tmp and the overlays of the namespace. The rest of the host's
+# filesystem is still visible. When the shell exits or unshare is killed,
+# every process the shell started is killed along with the PID namespace.
+_unshare_command = [
+    "unshare",
+    "--user",
+    "--map-root-user",
+    "--mount",
+    "--pid",
+    "--fork",
+    "--kill-child",
+    "--mount-proc",
+    "--ipc",
+    "--uts",
+]
+
+
+def create_namespace(network=False):
+    return Namespace(create_temp_dir(), network=network)
+
+
+class Namespace(object):
+    # temp_dir is a directory on the host for the namespace's own use, such
+    # as storing changes made to overlays
+
+    def __init__(self, temp_dir, network=False):
+        self._temp_dir = temp_dir
+        self._path = temp_dir.path
+        self._network = network
+        self._overlays = []
+        self._kept_paths = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        # The work directories of overlays contain directories that can't
+        # be removed until their permissions are changed
+        for root, dirs, filenames in os.walk(self._path):
+            for name in dirs:
+                try:
+                    os.chmod(os.path.join(root, name), 0o700)
+                except OSError:
+                    pass
+        self._temp_dir.close()
+
+    def overlay(self, path):
+        # Inside the namespace, changes to path are stored in the
+        # namespace's directory, leaving path unchanged on the host
+        index = len(self._overlays)
+        upper_dir = os.path.join(self._path, "overlay-{0}".format(index), "upper")
+        work_dir = os.path.join(self._path, "overlay-{0}".format(index), "work")
+        os.makedirs(upper_dir)
+        os.makedirs(work_dir)
+        self._overlays.append((path, upper_dir, work_dir))
+
+    def keep(self, path):
+        # Paths under /tmp are hidden by the private /tmp unless kept
+        self._kept_paths.append(path)
+
+    def shell_command(self, command, cwd=None):
+        kept_paths = [self._path] + self._kept_paths
+        if cwd is not None:
+            kept_paths.append(cwd)
+        kept_paths += [path for path, upper_dir, work_dir in self._overlays]
+
+        # The private /tmp is prepared in the namespace's directory, and
+        # then moved over /tmp, so that kept paths can still be found
+        private_tmp = os.path.join(self._path, "tmp")
+        if not os.path.isdir(private_tmp):
+            os.mkdir(private_tmp)
+        setup = [
+            "set -e",
+            "mount -t tmpfs tmpfs {0}".format(pipes.quote(private_tmp)),
+        ]
+        for path in kept_paths:
+            relative_path = _relative_to_tmp(path)
+            if relative_path is not None:
+                mount_point = os.path.join(private_tmp, relative_path)
+                setup += [
+                    "mkdir -p {0}".format(pipes.quote(mount_point)),
+                    "mount --bind {0} {1}".format(
+                        pipes.quote(os.path.join("/tmp", relative_path)),
+                        pipes.quote(mount_point),
+                    ),
+                ]
+        setup.append("mount --move {0} /tmp".format(pipes.quote(private_tmp)))
+        for path, upper_dir, work_dir in self._overlays:
+            setup.append(_overlay_mount(path, upper_dir, work_dir))
+        if self._network:
+            setup.append("ip link set lo up")
+        setup.append("cd {0}".format(pipes.quote(cwd or "/")))
+        script = "\n".join(setup + ['exec "$@"'])
+
+        unshare_command = list(_unshare_command)
+        if self._network:
+            unshare_command.append("--net")
+        return unshare_command + ["--", "sh", "-c", script, "sh"] + command
+
+
+def is_supported():
+    return _probe().namespaces
+
+
+def supports_overlays():
+    return _probe().overlays
+
+
+def _relative_to_tmp(path):
+    relative_path = os.path.relpath(os.path.realpath(path), "/tmp")
+    if relative_path == "." or relative_path.startswith(".."):
+        return None
+    else:
+        return relative_path
+
+
+def _overlay_mount(path, upper_dir, work_dir):
+    options = "lowerdir={0},upperdir={1},workdir={2}".format(path, upper_dir, work_dir)
+    return "mount -t overlay overlay -o {0} {1}".format(pipes.quote(options), pipes.quote(path))
+
+
+_probe_lock = threading.Lock()
+_probe_result = []
+
+
+def _probe():
+    # Whether namespaces can be created, and whether overlays can be
+    # mounted in them, which unprivileged users can only do on Linux 5.11
+    # and later
+    with _probe_lock:
+        if not _probe_result:
+            _probe_result.append(_run_probe())
+        return _probe_result[0]
+
+
+def _run_probe():
+    with create_namespace() as namespace:
+        namespaces = _succeeds(namespace.shell_command(["true"]))
+        lower_dir = os.path.join(namespace._path, "lower")
+        os.mkdir(lower_dir)
+        namespace.overlay(lower_dir)
+        overlays = namespaces and _succeeds(namespace.shell_command(["true"]))
+        return _ProbeResult(namespaces=namespaces, overlays=overlays)
+
+
+def _succeeds(command):
+    with open(os.devnull, "wb") as devnull:
+        try:
+            return subprocess.call(command, stdout=devnull, stderr=devnull) == 0
+        except OSError:
+            return False
+
+
+class _ProbeResult(object):
+    def __init__(self, namespaces, overlays):
+        self.namespaces = namespaces
+        self.overlays = overlays
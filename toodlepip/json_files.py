@@ -0,0 +1,47 @@
+import os
+import json
+import hashlib
+import tempfile
+
+from .locks import FileLock
+
+
+def project_file_path(directory, project_path):
+    # Each project's file is named by its absolute path
+    project_path = os.path.abspath(project_path)
+    name = hashlib.sha1(project_path.encode("utf8")).hexdigest()[:16]
+    return os.path.join(directory, "{0}.json".format(name))
+
+
+class JsonFile(object):
+    # Updates hold a lock on a file next to it, so builds running at the
+    # same time, in this process or another, don't lose each other's
+    # updates. The new value is written to a temporary file that's renamed
+    # over the old one, so readers never see a partly written file.
+
+    def __init__(self, path):
+        self._path = path
+
+    def read(self):
+        try:
+            with open(self._path) as json_file:
+                return json.load(json_file)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def update(self, update):
+        with self._lock():
+            self._write(update(self.read()))
+
+    def write(self, value):
+        with self._lock():
+            self._write(value)
+
+    def _lock(self):
+        return FileLock("{0}.lock".format(self._path))
+
+    def _write(self, value):
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(self._path))
+        with os.fdopen(fd, "w") as json_file:
+            json.dump(value, json_file, indent=2, sort_keys=True)
+        os.rename(temp_path, self._path)
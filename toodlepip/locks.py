@@ -0,0 +1,42 @@
+import errno
+import fcntl
+
+
+class FileLock(object):
+    # An exclusive lock on a file, held by at most one process at a time,
+    # such as a build using a workspace. The lock is released if the process
+    # exits without releasing it.
+
+    def __init__(self, path):
+        self._path = path
+        self._file = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+    def acquire(self, on_wait=None):
+        lock_file = open(self._path, "a")
+        acquired = False
+        try:
+            try:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except (IOError, OSError) as error:
+                if error.errno not in (errno.EAGAIN, errno.EACCES):
+                    raise
+                if on_wait is not None:
+                    on_wait()
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            acquired = True
+        finally:
+            if not acquired:
+                lock_file.close()
+        self._file = lock_file
+
+    def release(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,150 @@
+from .strings import is_string
+
+
+def expand(project_config, runtime_key, runtimes):
+    # Expands the runtimes of the language (such as the python versions)
+    # and the rows of env into entries, as Travis does. Conditions in
+    # matrix.exclude, matrix.include and matrix.allow_failures can match on
+    # runtime_key and env. Conditions on other keys, such as os, never
+    # match.
+    global_env, env_rows = _env_rows(project_config.get("env"))
+    matrix_config = project_config.get("matrix") or project_config.get("jobs") or {}
+
+    entries = []
+    for runtime in runtimes:
+        for env in env_rows:
+            entries.append(MatrixEntry(runtime, env, global_env))
+
+    excludes = matrix_config.get("exclude") or []
+    entries = [
+        entry for entry in entries
+        if not _matches_any(entry, excludes, runtime_key)
+    ]
+
+    default_runtime = runtimes[0] if runtimes else None
+    for include in matrix_config.get("include") or []:
+        runtime = include.get(runtime_key, default_runtime)
+        entries.append(MatrixEntry(runtime, _env_value(include.get("env")), global_env))
+
+    allow_failures = matrix_config.get("allow_failures") or []
+    for entry in entries:
+        entry.allow_failure = _matches_any(entry, allow_failures, runtime_key)
+
+    return _unique(entries)
+
+
+def group_by_runtime(entries):
+    groups = []
+    groups_by_runtime = {}
+    for entry in entries:
+        key = _runtime_key(entry.runtime)
+        if key not in groups_by_runtime:
+            group = RuntimeGroup(entry.runtime, [])
+            groups_by_runtime[key] = group
+            groups.append(group)
+        groups_by_runtime[key].entries.append(entry)
+    return groups
+
+
+class MatrixEntry(object):
+    def __init__(self, runtime, env=None, global_env=(), allow_failure=False):
+        self.runtime = runtime
+        self.env = env
+        self.global_env = tuple(global_env)
+        self.allow_failure = allow_failure
+
+    @property
+    def exports(self):
+        if self.env is None:
+            return self.global_env
+        else:
+            return self.global_env + (self.env, )
+
+    @property
+    def label(self):
+        parts = []
+        if self.runtime is not None:
+            parts.append(str(self.runtime))
+        if self.env is not None:
+            parts.append(self.env)
+        if parts:
+            return " ".join(parts)
+        else:
+            return None
+
+    def __str__(self):
+        return self.label or ""
+
+    def __repr__(self):
+        return "MatrixEntry({0!r}, {1!r})".format(self.runtime, self.env)
+
+
+class RuntimeGroup(object):
+    def __init__(self, runtime, entries):
+        self.runtime = runtime
+        self.entries = entries
+
+
+def _env_rows(env):
+    if isinstance(env, dict):
+        global_env = _strings(env.get("global"))
+        env_rows = _strings(env.get("matrix"))
+    else:
+        global_env = []
+        env_rows = _strings(env)
+    return global_env, env_rows or [None]
+
+
+def _strings(value):
+    # Encrypted values, such as secure: ..., can't be used locally, and are
+    # skipped
+    if value is None:
+        return []
+    elif is_string(value):
+        return [value]
+    else:
+        return [element for element in value if is_string(element)]
+
+
+def _env_value(value):
+    if value is None:
+        return None
+    else:
+        return " ".join(_strings(value)) or None
+
+
+def _matches_any(entry, conditions, runtime_key):
+    return any(_matches(entry, condition, runtime_key) for condition in conditions)
+
+
+def _matches(entry, condition, runtime_key):
+    for key, value in condition.items():
+        if key == runtime_key:
+            if _runtime_key(value) != _runtime_key(entry.runtime):
+                return False
+        elif key == "env":
+            if _env_value(value) != entry.env:
+                return False
+        else:
+            return False
+    return True
+
+
+def _unique(entries):
+    result = []
+    seen = set()
+    for entry in entries:
+        key = (_runtime_key(entry.runtime), entry.env)
+        if key not in seen:
+            seen.add(key)
+            result.append(entry)
+    return result
+
+
+def _runtime_key(runtime):
+    # YAML reads python: 2.7 as a number, but python: "2.7" as a string
+    if runtime is None:
+        return None
+    else:
+        return str(runtime)
+
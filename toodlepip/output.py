@@ -0,0 +1,100 @@
+import time
+import threading
+
+
+# Large writes, such as the buffered log of an entry built in parallel, are
+# passed to the terminal in chunks of this size
+_chunk_size = 64 * 1024
+
+
+class OutputPipeline(object):
+    # Writes output to the terminal from a separate thread through a bounded
+    # buffer. When the buffer is full, the process producing the output
+    # waits for the terminal to catch up. If there's a log file, which
+    # receives the full output, the oldest buffered lines are skipped
+    # instead once the terminal has been stuck on a single write for
+    # stall_time, so that a slow terminal never blocks the build.
+
+    def __init__(self, stdout, log_file=None, max_buffered=1024 * 1024, stall_time=0.1):
+        self._stdout = stdout
+        self._log_file = log_file
+        self._max_buffered = max_buffered
+        self._stall_time = stall_time
+        self._buffer = bytearray()
+        self._skipped = 0
+        self._writing_since = None
+        self._closed = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._drain)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(self, output):
+        if self._log_file is not None:
+            self._log_file.write(output)
+
+        for start in range(0, len(output), _chunk_size):
+            with self._condition:
+                self._buffer.extend(output[start:start + _chunk_size])
+                self._condition.notify_all()
+                self._wait_until_buffered()
+
+    def flush(self):
+        if self._log_file is not None:
+            self._log_file.flush()
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join()
+        self.flush()
+
+    def _wait_until_buffered(self):
+        while len(self._buffer) > self._max_buffered:
+            if self._log_file is None:
+                self._condition.wait()
+            elif self._is_stalled():
+                self._skip_oldest_lines()
+            else:
+                self._condition.wait(self._stall_time)
+
+    def _is_stalled(self):
+        return (
+            self._writing_since is not None and
+            time.time() - self._writing_since >= self._stall_time
+        )
+
+    def _skip_oldest_lines(self):
+        end = len(self._buffer) - self._max_buffered
+        newline_index = self._buffer.find(b"\n", end - 1)
+        if newline_index != -1:
+            end = newline_index + 1
+        self._skipped += end
+        del self._buffer[:end]
+
+    def _drain(self):
+        while True:
+            with self._condition:
+                self._writing_since = None
+                self._condition.notify_all()
+                while not self._buffer and not self._skipped and not self._closed:
+                    self._condition.wait()
+                if not self._buffer and not self._skipped and self._closed:
+                    return
+                output = bytes(self._buffer[:_chunk_size])
+                del self._buffer[:_chunk_size]
+                skipped = self._skipped
+                self._skipped = 0
+                self._writing_since = time.time()
+
+            if skipped:
+                self._stdout.write("[toodlepip: skipped {0} bytes of output]\n".format(skipped).encode("utf8"))
+            self._stdout.write(output)
+            self._stdout.flush()
@@ -0,0 +1,45 @@
+import sys
+import threading
+
+
+def map_in_parallel(func, values, jobs, cancelled=None):
+    if cancelled is None:
+        cancelled = lambda: False
+
+    values = list(values)
+    results = [None] * len(values)
+    indices = iter(range(len(values)))
+    lock = threading.Lock()
+    errors = []
+
+    def _next_index():
+        with lock:
+            if errors or cancelled():
+                return None
+            return next(indices, None)
+
+    def _work():
+        while True:
+            index = _next_index()
+            if index is None:
+                return
+            try:
+                results[index] = func(values[index])
+            except BaseException:
+                with lock:
+                    errors.append(sys.exc_info()[1])
+
+    threads = [
+        threading.Thread(target=_work)
+        for _ in range(max(1, min(jobs, len(values))))
+    ]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    if errors:
+        raise errors[0]
+
+    return results
@@ -1,11 +1,14 @@
 class DefaultBuilder(object):
+    matrix_key = None
+    install_files = []
+    
     def __init__(self, console):
         self._console = console
     
     def matrix(self, project_config):
         return [None]
     
-    def create_runtime(self, project_dir, entry):
+    def create_runtime(self, project_dir, entry, isolated=False):
         return DefaultRuntime()
 
 
@@ -16,5 +19,11 @@ class DefaultRuntime(object):
     def __exit__(self, *args):
         return
     
+    def isolate(self, namespace):
+        pass
+    
     def before_step(self, step):
         return None
+    
+    def after_step(self, step):
+        return None
@@ -0,0 +1,183 @@
+import os
+import re
+import json
+import threading
+
+import spur
+import xdg.BaseDirectory
+
+from .. import json_files
+
+
+_interpreter_name_regex = re.compile(r"^(python[0-9]+(\.[0-9]+)?|pypy[0-9]*(\.[0-9]+)?)$")
+
+_probe_script = """
+import json
+import platform
+import sys
+try:
+    import sysconfig
+    abi = sysconfig.get_config_var("SOABI")
+except ImportError:
+    abi = None
+print(json.dumps({
+    "implementation": platform.python_implementation(),
+    "version": ".".join(map(str, sys.version_info[:3])),
+    "abi": abi,
+}))
+"""
+
+
+def create_registry():
+    cache_dir = xdg.BaseDirectory.save_cache_path("toodlepip")
+    return InterpreterRegistry(os.path.join(cache_dir, "interpreters.json"))
+
+
+class InterpreterRegistry(object):
+    # Interpreters are discovered by searching the PATH of a login shell,
+    # which is slow to start, so the results are persisted and only
+    # rediscovered when an interpreter can't be found. Each interpreter is
+    # probed for its version and ABI, and probed again if its binary
+    # changes.
+
+    _lock = threading.Lock()
+
+    def __init__(self, path, search_path=None):
+        self._path = path
+        self._search_path = _login_path if search_path is None else search_path
+
+    def find(self, name):
+        with self._lock:
+            interpreters = self._load()
+            if interpreters is not None:
+                interpreter = self._find(interpreters, name)
+                if interpreter is not None:
+                    return interpreter
+
+            interpreters = self._discover(interpreters or [])
+            return self._find(interpreters, name)
+
+    def interpreters(self, refresh=False):
+        with self._lock:
+            interpreters = self._load()
+            if refresh or interpreters is None:
+                interpreters = self._discover(interpreters or [])
+            return interpreters
+
+    def _find(self, interpreters, name):
+        for index, interpreter in enumerate(interpreters):
+            if interpreter.name == name:
+                if interpreter.mtime == _mtime(interpreter.path):
+                    return interpreter
+                interpreter = _probe(interpreter.name, interpreter.path)
+                if interpreter is not None:
+                    interpreters[index] = interpreter
+                    self._save(interpreters)
+                    return interpreter
+        return None
+
+    def _discover(self, previous_interpreters):
+        previous = dict(
+            (interpreter.path, interpreter)
+            for interpreter in previous_interpreters
+        )
+        interpreters = []
+        for directory in self._search_path().split(os.pathsep):
+            try:
+                names = sorted(os.listdir(directory))
+            except OSError:
+                continue
+            for name in names:
+                path = os.path.join(directory, name)
+                if not _interpreter_name_regex.match(name) or not _is_executable(path):
+                    continue
+                interpreter = previous.get(path)
+                if interpreter is None or interpreter.mtime != _mtime(path):
+                    interpreter = _probe(name, path)
+                if interpreter is not None:
+                    interpreters.append(interpreter)
+
+        self._save(interpreters)
+        return interpreters
+
+    def _load(self):
+        try:
+            with open(self._path) as registry_file:
+                return [Interpreter.from_json(value) for value in json.load(registry_file)]
+        except (IOError, OSError, ValueError, KeyError):
+            return None
+
+    def _save(self, interpreters):
+        json_files.JsonFile(self._path).write([interpreter.to_json() for interpreter in interpreters])
+
+
+class Interpreter(object):
+    def __init__(self, name, path, mtime, implementation, version, abi):
+        self.name = name
+        self.path = path
+        self.mtime = mtime
+        self.implementation = implementation
+        self.version = version
+        self.abi = abi
+
+    @staticmethod
+    def from_json(value):
+        return Interpreter(
+            name=value["name"],
+            path=value["path"],
+            mtime=value["mtime"],
+            implementation=value["implementation"],
+            version=value["version"],
+            abi=value["abi"],
+        )
+
+    def to_json(self):
+        return {
+            "name": self.name,
+            "path": self.path,
+            "mtime": self.mtime,
+            "implementation": self.implementation,
+            "version": self.version,
+            "abi": self.abi,
+        }
+
+
+def _probe(name, path):
+    # Interpreters that have been removed since they were found aren't
+    # probed, so they're found again by searching the PATH
+    mtime = _mtime(path)
+    if mtime is None:
+        return None
+    try:
+        result = spur.LocalShell().run([path, "-c", _probe_script], allow_error=True)
+    except (spur.NoSuchCommandError, OSError):
+        return None
+    if result.return_code != 0:
+        return None
+    try:
+        details = json.loads(result.output.decode("utf8"))
+    except ValueError:
+        return None
+    return Interpreter(
+        name=name,
+        path=path,
+        mtime=mtime,
+        implementation=details["implementation"],
+        version=details["version"],
+        abi=details["abi"],
+    )
+
+
+def _login_path():
+    return spur.LocalShell().run(["bash", "-lc", "echo $PATH"]).output.decode("utf8").strip()
+
+
+def _is_executable(path):
+    return os.path.isfile(path) and os.access(path, os.X_OK)
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
@@ -1,78 +1,652 @@
 import os
+import re
+import json
+import pipes
+import shlex
+import shutil
+from datetime import timedelta
 
-import spur
+import xdg.BaseDirectory
 
 from ..temp import create_temp_dir
 from ..consoles import Command
+from .. import caches
+from .. import files
+from .. import isolation
+from .. import sharding
+from . import interpreters
+
+
+# The least recently used virtualenvs are removed once the cached
+# virtualenvs take up more than this many bytes
+_virtualenv_cache_size = 2 * 1024 * 1024 * 1024
 
 
 class PythonBuilder(object):
+    matrix_key = "python"
+    # Changes to these files cause the install steps to be run again in
+    # watch mode
+    install_files = ["setup.py", "setup.cfg", "pyproject.toml", "requirements*.txt"]
+    
     def __init__(self, console):
         self._console = console
+        self._virtualenv_cache = caches.create_cache(
+            "virtualenvs",
+            max_age=timedelta(days=30),
+            max_size=_virtualenv_cache_size,
+        )
+        self._interpreters = interpreters.create_registry()
 
     def matrix(self, project_config):
         return project_config.get_list("python", ["2.7"])
     
-    def create_runtime(self, project_dir, entry):
-        python_version = entry
-        temp_dir = create_temp_dir()
+    def create_runtime(self, project_dir, entry, runtime_dir=None, isolated=False):
+        # runtime_dir is a directory already prepared by prepare_runtime,
+        # such as one checked out from the daemon's pool
+        if isolated and isolation.supports_overlays():
+            # Changes to the cached virtualenv are written to an overlay in
+            # the namespace of each entry, so it doesn't need to be copied.
+            # The cached virtualenv is in use until the runtime is closed.
+            cached_virtualenv = self._cached_virtualenv(entry)
+            virtualenv_dir = cached_virtualenv.__enter__()
+            return PythonRuntime(_ClosingContext(cached_virtualenv), virtualenv_dir, _pip_dirs(), overlay=True, project_dir=project_dir)
+        if runtime_dir is None:
+            runtime_dir = create_temp_dir()
+            try:
+                self.prepare_runtime(entry, runtime_dir.path)
+            except Exception:
+                runtime_dir.close()
+                raise
+        virtualenv_dir = os.path.join(runtime_dir.path, "virtualenv")
+        install_key = self._virtualenv_key(self._interpreter(entry))
+        return PythonRuntime(runtime_dir, virtualenv_dir, _pip_dirs(), install_key=install_key, project_dir=project_dir)
+    
+    def runtime_key(self, entry):
         try:
-            working_dir = temp_dir.path
-            virtualenv_dir = os.path.join(working_dir, "virtualenv")
-            self._create_virtualenv(virtualenv_dir, python_version)
-        except Exception:
-            temp_dir.close()
-            raise
-        return PythonRuntime(temp_dir, virtualenv_dir)
-    
-    def _create_virtualenv(self, path, python_version):
-        python_binary = self._python_binary(python_version)
+            return self._virtualenv_key(self._interpreter(entry))
+        except InterpreterNotFoundError:
+            return None
+    
+    def prepare_runtime(self, entry, path):
+        python_version = entry
+        with self._cached_virtualenv(python_version) as base_virtualenv_dir:
+            _clone_virtualenv(base_virtualenv_dir, os.path.join(path, "virtualenv"))
+    
+    def _cached_virtualenv(self, python_version):
+        self._console.run_all(
+            "Creating virtualenv for {0}".format(python_version),
+            [],
+            quiet=True,
+        )
+        interpreter = self._interpreter(python_version)
+        python_binary = interpreter.path
+        key = self._virtualenv_key(interpreter)
         
+        def _create(path):
+            self._console.run_all(
+                None,
+                self._virtualenv_commands(path, python_binary),
+                quiet=True,
+                allow_error=False,
+            )
+        
+        return self._virtualenv_cache.use(
+            key,
+            _create,
+            description="{0} ({1} {2})".format(python_binary, interpreter.implementation, interpreter.version),
+        )
+    
+    def _virtualenv_key(self, interpreter):
+        placeholder = "$VIRTUALENV"
+        commands = self._virtualenv_commands(placeholder, interpreter.path)
+        return caches.hash_key(
+            interpreter.path,
+            interpreter.implementation,
+            interpreter.version,
+            interpreter.abi,
+            [command.actual for command in commands],
+        )
+    
+    def _virtualenv_commands(self, path, python_binary):
         def _pip_upgrade(package_name):
             pip = os.path.join(path, "bin", "pip")
             return Command.raw([pip, "install", "--upgrade", package_name])
         
-        commands = [
+        return [
             Command.raw(["virtualenv", path, "--python={0}".format(python_binary)]),
             _pip_upgrade("pip"),
             _pip_upgrade("setuptools"),
             _pip_upgrade("virtualenv"),
         ]
         
-        self._console.run_all(
-            "Creating virtualenv for {0}".format(python_version),
-            commands,
-            quiet=True,
-            allow_error=False,
-        )
-        
-        
-    def _python_binary(self, python_version):
+    def _interpreter(self, python_version):
         if python_version == "pypy":
             binary_name = "pypy"
         else:
             binary_name = "python{0}".format(python_version)
         
-        return self._which(binary_name)
+        interpreter = self._interpreters.find(binary_name)
+        if interpreter is None:
+            raise InterpreterNotFoundError("Could not find {0}".format(binary_name))
+        return interpreter
+
+
+class InterpreterNotFoundError(Exception):
+    pass
+
+
+class _ClosingContext(object):
+    # Exits a context that has been entered when closed
+    def __init__(self, context):
+        self._context = context
     
-    def _which(self, binary_name):
-        shell = spur.LocalShell()
-        path = shell.run(["bash", "-lc", "echo $PATH"]).output.strip()
-        return shell.run(["which", binary_name], update_env={"PATH": path}).output.decode("utf8").strip()
+    def close(self):
+        self._context.__exit__(None, None, None)
+
+
+def _clone_virtualenv(source, destination):
+    _copy_virtualenv(source, destination, [(source, destination)])
+
+
+def _copy_virtualenv(source, destination, replacements):
+    # Virtualenvs contain absolute paths to themselves, such as in the
+    # shebangs of scripts and in the activate scripts, and to projects
+    # installed in development mode, which are replaced with their new
+    # paths. The files are copied as the project is, so they're cloned
+    # where the filesystem supports it.
+    files.copy_tree(source, destination)
+    replacements = [
+        (old_path.encode("utf8"), new_path.encode("utf8"))
+        for old_path, new_path in replacements
+    ]
+    for path in _files_with_paths(destination):
+        if os.path.islink(path) or not os.path.isfile(path):
+            continue
+        with open(path, "rb") as path_file:
+            contents = path_file.read()
+        new_contents = contents
+        for old_path, new_path in replacements:
+            new_contents = new_contents.replace(old_path, new_path)
+        if new_contents != contents:
+            with open(path, "wb") as path_file:
+                path_file.write(new_contents)
+
+
+def _files_with_paths(virtualenv_dir):
+    bin_dir = os.path.join(virtualenv_dir, "bin")
+    for filename in os.listdir(bin_dir):
+        yield os.path.join(bin_dir, filename)
+    for site_packages_dir in _site_packages_dirs(virtualenv_dir):
+        for root, dirs, filenames in os.walk(site_packages_dir):
+            for filename in filenames:
+                is_path_file = (
+                    filename.endswith(".pth") or
+                    filename.endswith(".egg-link") or
+                    filename.startswith("__editable__") or
+                    filename == "direct_url.json"
+                )
+                if is_path_file:
+                    yield os.path.join(root, filename)
+
+
+def _site_packages_dirs(virtualenv_dir):
+    lib_dir = os.path.join(virtualenv_dir, "lib")
+    if not os.path.isdir(lib_dir):
+        return []
+    return [
+        os.path.join(lib_dir, name, "site-packages")
+        for name in os.listdir(lib_dir)
+        if os.path.isdir(os.path.join(lib_dir, name, "site-packages"))
+    ]
+
+
+def _installs_copy_of_project(virtualenv_dir, project_dir):
+    # Whether the project has been installed by copying it into the
+    # virtualenv, rather than in development mode
+    project_url = "file://{0}".format(project_dir)
+    for site_packages_dir in _site_packages_dirs(virtualenv_dir):
+        for name in os.listdir(site_packages_dir):
+            direct_url_path = os.path.join(site_packages_dir, name, "direct_url.json")
+            if name.endswith(".dist-info") and os.path.exists(direct_url_path):
+                with open(direct_url_path) as direct_url_file:
+                    direct_url = json.load(direct_url_file)
+                editable = direct_url.get("dir_info", {}).get("editable", False)
+                if direct_url.get("url") == project_url and not editable:
+                    return True
+    return False
+
+
+def _installs_project_in_development_mode(virtualenv_dir, project_dir):
+    # Whether the project, or a directory in it such as src, is linked into
+    # the virtualenv by an editable install or setup.py develop. pip only
+    # records how the project was installed since pip 20.1, so a copy of the
+    # project installed without such a link can't be told apart from the
+    # project not being installed.
+    project_url = "file://{0}".format(project_dir)
+    for site_packages_dir in _site_packages_dirs(virtualenv_dir):
+        for root, dirs, filenames in os.walk(site_packages_dir):
+            for filename in filenames:
+                path = os.path.join(root, filename)
+                if filename == "direct_url.json":
+                    with open(path) as direct_url_file:
+                        direct_url = json.load(direct_url_file)
+                    editable = direct_url.get("dir_info", {}).get("editable", False)
+                    if direct_url.get("url") == project_url and editable:
+                        return True
+                elif filename.endswith(".egg-link") or filename.endswith(".pth"):
+                    with open(path) as path_file:
+                        lines = [line.strip() for line in path_file]
+                    if any(_is_in_directory(line, project_dir) for line in lines):
+                        return True
+    return False
+
+
+def _is_in_directory(path, directory):
+    path = os.path.normpath(path)
+    return path == directory or path.startswith(directory.rstrip(os.sep) + os.sep)
+
+
+def _project_metadata_dirs(project_dir):
+    # The metadata directories in the project and its immediate
+    # subdirectories, such as src/project.egg-info
+    metadata_dirs = []
+    for name in sorted(os.listdir(project_dir)):
+        if _is_metadata_dir(project_dir, name):
+            metadata_dirs.append(name)
+        elif not name.startswith(".") and os.path.isdir(os.path.join(project_dir, name)):
+            subdirectory = os.path.join(project_dir, name)
+            metadata_dirs += [
+                os.path.join(name, subname)
+                for subname in sorted(os.listdir(subdirectory))
+                if _is_metadata_dir(subdirectory, subname)
+            ]
+    return metadata_dirs
+
+
+def _is_metadata_dir(parent_dir, name):
+    path = os.path.join(parent_dir, name)
+    return (
+        (name.endswith(".egg-info") or name.endswith(".dist-info")) and
+        os.path.isdir(path) and
+        not os.path.islink(path)
+    )
+
+
+def _pip_dirs():
+    return _PipDirs(
+        cache_dir=xdg.BaseDirectory.save_data_path("toodlepip/pip-cache"),
+        wheel_dir=xdg.BaseDirectory.save_data_path("toodlepip/wheels"),
+    )
+
+
+class _PipDirs(object):
+    def __init__(self, cache_dir, wheel_dir):
+        self.cache_dir = cache_dir
+        self.wheel_dir = wheel_dir
+
+
+# Run by the virtualenv's python after the install step to build wheels of
+# the installed packages that aren't already in the wheel directory, so
+# that later installs don't need to download or build them. Packages
+# installed from a directory, such as the project itself, aren't built.
+# Builds running at the same time hold a lock on the wheel directory, in
+# the same way as locks.FileLock, since the script runs in the virtualenv's
+# python without toodlepip. Each wheel is built in a temporary directory
+# and moved into the wheel directory, so installs never see partial wheels.
+_build_wheels_script = """
+import fcntl
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+
+wheel_dir = sys.argv[1]
+project_dir = sys.argv[2] if len(sys.argv) > 2 else None
+unbuildable_path = os.path.join(wheel_dir, ".unbuildable")
+built_path = os.path.join(wheel_dir, ".built")
+python_tags = set([
+    "py{0}".format(sys.version_info[0]),
+    "cp{0}{1}".format(*sys.version_info[:2]),
+    "py{0}{1}".format(*sys.version_info[:2]),
+])
+
+def normalise(name):
+    return re.sub(r"[-_.]+", "_", name).lower()
+
+def is_compatible(python_tag, platform_tag):
+    return bool(python_tags.intersection(python_tag.split("."))) and (
+        platform_tag == "any" or python_tag.startswith("cp")
+    )
+
+def read_lines(path):
+    if os.path.exists(path):
+        with open(path) as lines_file:
+            return set(lines_file.read().splitlines())
+    else:
+        return set()
+
+def project_name():
+    if project_dir is None or not os.path.exists(os.path.join(project_dir, "setup.py")):
+        return None
+    process = subprocess.Popen(
+        [sys.executable, "setup.py", "--name"],
+        cwd=project_dir,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    output = process.communicate()[0].decode("utf8").strip().splitlines()
+    if process.returncode != 0 or not output:
+        return None
+    return normalise(output[-1])
+
+freeze = subprocess.Popen(
+    [sys.executable, "-m", "pip", "freeze"],
+    stdout=subprocess.PIPE,
+).communicate()[0].decode("utf8")
+skipped_names = set([project_name()])
+
+lock_file = open(os.path.join(wheel_dir, ".lock"), "a")
+fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+
+# Wheels that were built for this python, but with tags that don't look
+# compatible, such as abi3 wheels, are recorded so they aren't built again
+available = set()
+built = set()
+for filename in os.listdir(wheel_dir):
+    if filename.endswith(".whl"):
+        parts = filename[:-len(".whl")].split("-")
+        built.add((normalise(parts[0]), parts[1]))
+        if is_compatible(parts[-3], parts[-1]):
+            available.add((normalise(parts[0]), parts[1]))
+
+unbuildable = read_lines(unbuildable_path)
+built_requirements = read_lines(built_path)
+
+for requirement in freeze.splitlines():
+    # Editable installs and packages installed from a URL or directory,
+    # such as "-e ..." and "name @ file://...", aren't pinned to a version
+    if requirement.startswith("-") or "==" not in requirement or requirement in unbuildable:
+        continue
+    name, version = requirement.split("==", 1)
+    key = (normalise(name), version)
+    if normalise(name) in skipped_names or key in available:
+        continue
+    if requirement in built_requirements and key in built:
+        continue
+    build_dir = tempfile.mkdtemp(dir=wheel_dir)
+    try:
+        return_code = subprocess.call([
+            sys.executable, "-m", "pip", "wheel", "--quiet", "--no-deps",
+            "--wheel-dir", build_dir, "--find-links", wheel_dir, requirement,
+        ])
+        if return_code == 0:
+            for filename in os.listdir(build_dir):
+                os.rename(os.path.join(build_dir, filename), os.path.join(wheel_dir, filename))
+    finally:
+        shutil.rmtree(build_dir)
+    with open(built_path if return_code == 0 else unbuildable_path, "a") as skipped_file:
+        skipped_file.write(requirement + "\\n")
+"""
 
 
 class PythonRuntime(object):
-    def __init__(self, temp_dir, virtualenv_dir):
-        self._temp_dir = temp_dir
+    # install_key identifies the virtualenv that the runtime started from,
+    # and is None if the runtime can't be snapshotted after installing
+    # dependencies, such as when the virtualenv is an overlay
+    def __init__(self, runtime_dir, virtualenv_dir, pip_dirs, overlay=False, install_key=None, project_dir=None):
+        self._runtime_dir = runtime_dir
         self._virtualenv_dir = virtualenv_dir
+        self._pip_dirs = pip_dirs
+        self._overlay = overlay
+        self.install_key = install_key
+        self._project_dir = project_dir
     
     def __enter__(self):
         return self
     
     def __exit__(self, *args):
-        self._temp_dir.close()
+        if self._runtime_dir is not None:
+            self._runtime_dir.close()
+    
+    def installs_project_in_place(self, project_dir):
+        # A copy of the project in the virtualenv would be out of date when
+        # the snapshot is restored after the project has changed
+        return (
+            _installs_project_in_development_mode(self._virtualenv_dir, project_dir) and
+            not _installs_copy_of_project(self._virtualenv_dir, project_dir)
+        )
+    
+    def snapshot_install(self, path, project_dir):
+        # Installing the project in development mode also writes its
+        # metadata, such as project.egg-info, into the project, which is
+        # needed by console scripts that use pkg_resources
+        os.mkdir(path)
+        files.copy_tree(self._virtualenv_dir, os.path.join(path, "virtualenv"))
+        metadata_dirs = _project_metadata_dirs(project_dir)
+        for metadata_dir in metadata_dirs:
+            shutil.copytree(
+                os.path.join(project_dir, metadata_dir),
+                os.path.join(path, "project", metadata_dir),
+                symlinks=True,
+            )
+        with open(os.path.join(path, "paths.json"), "w") as paths_file:
+            json.dump({
+                "virtualenv": self._virtualenv_dir,
+                "project": project_dir,
+                "project_metadata": metadata_dirs,
+            }, paths_file)
+    
+    def restore_install(self, path, project_dir):
+        with open(os.path.join(path, "paths.json")) as paths_file:
+            paths = json.load(paths_file)
+        shutil.rmtree(self._virtualenv_dir)
+        _copy_virtualenv(
+            os.path.join(path, "virtualenv"),
+            self._virtualenv_dir,
+            [(paths["virtualenv"], self._virtualenv_dir), (paths["project"], project_dir)],
+        )
+        for metadata_dir in paths.get("project_metadata", []):
+            destination = os.path.join(project_dir, metadata_dir)
+            if os.path.isdir(destination):
+                shutil.rmtree(destination)
+            shutil.copytree(os.path.join(path, "project", metadata_dir), destination, symlinks=True)
+    
+    def isolate(self, namespace):
+        if self._overlay:
+            namespace.overlay(self._virtualenv_dir)
+        namespace.keep(self._pip_dirs.cache_dir)
+        namespace.keep(self._pip_dirs.wheel_dir)
 
     def before_step(self, step):
-        # TODO: set PIP_DOWNLOAD_CACHE
         virtualenv_activate = os.path.join(self._virtualenv_dir, "bin/activate")
-        return ". {0}".format(virtualenv_activate)
+        # pip still asks the index for the versions of each requirement,
+        # since the install commands may ask for versions that haven't been
+        # built yet, but downloads and builds are replaced by local wheels
+        pip_env = [
+            ("PIP_CACHE_DIR", self._pip_dirs.cache_dir),
+            ("PIP_FIND_LINKS", self._pip_dirs.wheel_dir),
+        ]
+        exports = "".join(
+            "; export {0}={1}".format(name, pipes.quote(value))
+            for name, value in pip_env
+        )
+        return ". {0}{1}".format(virtualenv_activate, exports)
+    
+    def test_runner(self, command, project_dir):
+        return find_test_runner(command, project_dir)
+    
+    def after_step(self, step):
+        if step.name == "install":
+            python = os.path.join(self._virtualenv_dir, "bin/python")
+            return Command(
+                display="Building wheels for installed packages",
+                actual=Command.raw(
+                    [python, "-c", _build_wheels_script, self._pip_dirs.wheel_dir] +
+                    ([] if self._project_dir is None else [self._project_dir])
+                ).actual,
+            )
+        else:
+            return None
+
+
+def find_test_runner(command, project_dir):
+    # Commands that run nose or pytest, such as nosetests tests, can be
+    # sharded, so long as they're a single command without any shell
+    # syntax, such as pipes or variables
+    if any(character in command for character in "&|;<>()$`\\\n"):
+        return None
+    try:
+        words = shlex.split(command)
+    except ValueError:
+        return None
+    
+    for program, runner_cls in _test_runners:
+        if words[:len(program)] == program or (
+            len(program) == 1 and words and os.path.basename(words[0]) == program[0]
+        ):
+            args = words[len(program):]
+            options = runner_cls.options(args, project_dir)
+            if options is None:
+                return None
+            return runner_cls(words[:len(program)], args, options)
+    return None
+
+
+class _TestRunner(object):
+    # Options that are followed by a value, such as -k EXPRESSION, options
+    # that aren't, and prefixes of options that stop the command being
+    # sharded
+    value_options = frozenset()
+    flags = frozenset()
+    unshardable_options = ()
+    
+    def __init__(self, program, args, options):
+        self._program = program
+        self._args = args
+        self._options = options
+    
+    @classmethod
+    def options(cls, args, project_dir):
+        # Arguments that select which tests to run, such as the tests
+        # directory, are replaced by the test files in each shard. Any
+        # other argument might be the value of an option or select tests
+        # that aren't a path, such as the source in --cov toodlepip, so
+        # commands with them aren't sharded. Shards run in the same
+        # project directory, so commands with options that write output
+        # files, such as coverage data, aren't sharded either.
+        def is_path(arg):
+            return not arg.startswith("-") and os.path.exists(os.path.join(project_dir, arg))
+        
+        options = []
+        index = 0
+        while index < len(args):
+            arg = args[index]
+            next_arg = args[index + 1] if index + 1 < len(args) else None
+            if arg.startswith(cls.unshardable_options):
+                return None
+            elif arg in cls.value_options and next_arg is not None:
+                options += [arg, next_arg]
+                index += 1
+            elif arg.startswith("-"):
+                if "=" not in arg and arg not in cls.flags and next_arg is not None and is_path(next_arg):
+                    return None
+                options.append(arg)
+            elif not is_path(arg):
+                return None
+            index += 1
+        return options
+    
+    def shard_command(self, test_files, report_path):
+        return _join(self._program + self._options + self._report_args(report_path) + list(test_files))
+
+
+class _NoseRunner(_TestRunner):
+    value_options = frozenset([
+        "-a", "--attr", "-A", "--eval-attr", "-e", "--exclude", "-i", "--include",
+        "-m", "--match", "--testmatch", "-c", "--config", "-l", "--debug",
+        "--logging-level", "--verbosity", "--processes", "--process-timeout",
+    ])
+    flags = frozenset([
+        "-v", "-vv", "-q", "-s", "-x", "-d", "--verbose", "--quiet", "--nocapture",
+        "--stop", "--detailed-errors", "--nologcapture", "--with-doctest",
+        "--exe", "--noexe", "--all-modules", "--no-byte-compile",
+    ])
+    # -w and --tests change where tests are found, and the coverage and
+    # xunit plugins write output files
+    unshardable_options = ("-w", "--where", "--tests", "--with-coverage", "--cover-", "--with-xunit", "--xunit-")
+    
+    def collect_command(self, output_path):
+        return _join(self._program + self._args + ["--collect-only"] + self._report_args(output_path))
+    
+    def read_collected(self, output_path, project_dir):
+        # Tests in a directory that isn't a package are named after their
+        # module alone, such as test_a, so can't be found in a file
+        test_files = set()
+        for class_name in sharding.read_junit_class_names(output_path):
+            test_file = sharding.module_file(class_name, project_dir)
+            if test_file is None:
+                return None
+            test_files.add(test_file)
+        return sorted(test_files)
+    
+    def _report_args(self, report_path):
+        return ["--with-xunit", "--xunit-file={0}".format(report_path)]
+
+
+class _PytestRunner(_TestRunner):
+    value_options = frozenset([
+        "-k", "-m", "-p", "-c", "-o", "-W", "-r", "-n", "--rootdir", "--confcutdir",
+        "--basetemp", "--ignore", "--ignore-glob", "--deselect", "--maxfail", "--tb",
+        "--durations", "--import-mode", "--override-ini", "--capture", "--log-level",
+        "--numprocesses", "--dist", "--timeout",
+    ])
+    flags = frozenset([
+        "-q", "-qq", "-v", "-vv", "-s", "-x", "-l", "--quiet", "--verbose",
+        "--exitfirst", "--showlocals", "--lf", "--last-failed", "--ff",
+        "--failed-first", "--strict", "--strict-markers", "--disable-warnings",
+    ])
+    # pytest-cov and JUnit XML reports write output files
+    unshardable_options = ("--cov", "--junitxml", "--junit-xml")
+    
+    def collect_command(self, output_path):
+        return "{0} > {1} 2>&1".format(
+            _join(self._program + self._args + ["--collect-only", "-q"]),
+            pipes.quote(output_path),
+        )
+    
+    def read_collected(self, output_path, project_dir):
+        # Tests are listed as test IDs, such as tests/test_a.py::test_one,
+        # or with -qq, the number of tests in each file, such as
+        # tests/test_a.py: 1. Test IDs relative to another directory, such
+        # as when rootdir is set, can't be found in a file.
+        test_files = set()
+        with open(output_path) as output_file:
+            for line in output_file:
+                if "::" in line:
+                    test_file = line.split("::", 1)[0].strip()
+                elif re.match(r"^\S+\.py: \d+$", line.strip()):
+                    test_file = line.rsplit(": ", 1)[0].strip()
+                else:
+                    continue
+                if not os.path.isfile(os.path.join(project_dir, test_file)):
+                    return None
+                test_files.add(test_file)
+        return sorted(test_files)
+    
+    def _report_args(self, report_path):
+        return ["--junitxml={0}".format(report_path)]
+
+
+_test_runners = [
+    (["nosetests"], _NoseRunner),
+    (["python", "-m", "nose"], _NoseRunner),
+    (["py.test"], _PytestRunner),
+    (["pytest"], _PytestRunner),
+    (["python", "-m", "pytest"], _PytestRunner),
+]
+
+
+def _join(args):
+    return " ".join(pipes.quote(arg) for arg in args)
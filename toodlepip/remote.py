@@ -0,0 +1,133 @@
+import os
+import signal
+import shutil
+import tarfile
+import contextlib
+
+import spur
+
+from .consoles import Result, cancelled_result
+
+
+def is_supported():
+    # SSH support is in the full spur package, rather than spur.local
+    return hasattr(spur, "SshShell")
+
+
+def create_hosts(names, command=None, build_args=()):
+    return [
+        RemoteHost(name, _create_ssh_shell(name), command=command, build_args=build_args)
+        for name in names
+    ]
+
+
+def parse_host(name):
+    # Hosts are written as [user@]hostname[:port]
+    if "@" in name:
+        username, address = name.split("@", 1)
+    else:
+        username, address = None, name
+    if ":" in address:
+        hostname, port = address.rsplit(":", 1)
+        port = int(port)
+    else:
+        hostname, port = address, 22
+    return username, hostname, port
+
+
+def _create_ssh_shell(name):
+    username, hostname, port = parse_host(name)
+    return spur.SshShell(hostname=hostname, username=username, port=port)
+
+
+@contextlib.contextmanager
+def create_archive(console, project_dir):
+    from .temp import create_temp_dir
+
+    temp_dir = create_temp_dir()
+    try:
+        archive_path = os.path.join(temp_dir.path, "project.tar.gz")
+        with console.timings.record("project", "archive"):
+            archive = tarfile.open(archive_path, "w:gz")
+            try:
+                archive.add(project_dir, arcname=".")
+            finally:
+                archive.close()
+        yield archive_path
+    finally:
+        temp_dir.close()
+
+
+class RemoteHost(object):
+    # Builds entries using toodlepip on another machine. The project is
+    # uploaded as a compressed archive, and each entry is then built by
+    # running toodlepip build on the uploaded project, with its output
+    # streamed back. Interrupting the remote toodlepip cancels its build,
+    # still allowing cleanup steps to run.
+
+    def __init__(self, name, shell, command=None, build_args=()):
+        self.name = name
+        self._shell = shell
+        self._command = ["toodlepip"] if command is None else list(command)
+        self._build_args = list(build_args)
+
+    def upload(self, console, archive_path):
+        console.run_all("Uploading project to {0}".format(self.name), [], quiet=True)
+        with console.timings.record("project", "upload", entry=self.name):
+            remote_dir = self._shell.run(["mktemp", "-d"]).output.decode("utf8").strip()
+            remote_archive_path = "{0}/project.tar.gz".format(remote_dir)
+            with open(archive_path, "rb") as archive_file:
+                with self._shell.open(remote_archive_path, "wb") as remote_archive_file:
+                    shutil.copyfileobj(archive_file, remote_archive_file, 64 * 1024)
+            self._shell.run(
+                ["sh", "-c", "mkdir project && tar xzf project.tar.gz -C project && rm project.tar.gz"],
+                cwd=remote_dir,
+            )
+        return remote_dir
+
+    def build(self, console, remote_dir, entry_index, label=None):
+        if console.cancellation.is_cancelled:
+            return cancelled_result()
+
+        if label is None:
+            description = "Building on {0}".format(self.name)
+        else:
+            description = "Building {0} on {1}".format(label, self.name)
+        console.run_all(description, [], quiet=True)
+
+        toodlepip_command = self._command + [
+            "build",
+            "{0}/project".format(remote_dir),
+            "--entry={0}".format(entry_index),
+        ] + self._build_args
+        process = self._shell.spawn(
+            ["sh", "-c", 'exec "$@" 2>&1', "sh"] + toodlepip_command,
+            stdout=console,
+            allow_error=True,
+            store_pid=True,
+        )
+
+        interrupted = []
+
+        def _interrupt():
+            interrupted.append(True)
+            try:
+                process.send_signal(signal.SIGINT)
+            except (OSError, spur.RunProcessError):
+                # The build has already finished
+                pass
+
+        registration = console.cancellation.on_cancel(_interrupt)
+        try:
+            with console.timings.record("remote", self.name, entry=label):
+                return_code = process.wait_for_result().return_code
+        finally:
+            registration.remove()
+
+        if interrupted and return_code != 0:
+            return cancelled_result(return_code)
+        else:
+            return Result(return_code)
+
+    def remove(self, remote_dir):
+        self._shell.run(["rm", "-rf", remote_dir], allow_error=True)
@@ -0,0 +1,69 @@
+import os
+import json
+from datetime import timedelta
+
+from . import caches
+
+
+# Incremented whenever the way entries are built changes, so that results
+# recorded by older versions aren't replayed
+_version = 2
+
+
+def create_result_cache():
+    return ResultCache(caches.create_cache("results", max_age=timedelta(days=30)))
+
+
+class ResultCache(object):
+    # Records the result and output of each entry that passed, keyed by a
+    # hash of the project, the entry and its runtime, so that unchanged
+    # entries can be replayed rather than built again. Failures aren't
+    # recorded, since they may be caused by something outside the project,
+    # such as a network error, and should be retried.
+
+    def __init__(self, cache):
+        self._cache = cache
+
+    def key(self, tree_hash, project_config, entry, runtime_key=None):
+        return caches.hash_key(
+            _version,
+            tree_hash,
+            project_config.content_hash,
+            project_config.language,
+            None if entry.runtime is None else str(entry.runtime),
+            entry.env,
+            entry.global_env,
+            runtime_key,
+        )
+
+    def find(self, key):
+        with self._cache.use_found(key) as path:
+            if path is None:
+                return None
+            try:
+                with open(os.path.join(path, "result.json")) as result_file:
+                    result = json.load(result_file)
+                with open(os.path.join(path, "output"), "rb") as output_file:
+                    output = output_file.read()
+            except (IOError, OSError, ValueError):
+                return None
+        return CachedResult(result["return_code"], output)
+
+    def store(self, key, return_code, output, description=None):
+        if return_code != 0:
+            return
+        
+        def _write(path):
+            os.mkdir(path)
+            with open(os.path.join(path, "result.json"), "w") as result_file:
+                json.dump({"return_code": return_code}, result_file)
+            with open(os.path.join(path, "output"), "wb") as output_file:
+                output_file.write(output)
+
+        self._cache.get(key, _write, description=description)
+
+
+class CachedResult(object):
+    def __init__(self, return_code, output):
+        self.return_code = return_code
+        self.output = output
@@ -0,0 +1,189 @@
+import os
+import pipes
+import contextlib
+import xml.etree.ElementTree as ElementTree
+
+from . import json_files
+from .consoles import Command
+
+
+def create_test_sharder(project_path, shards):
+    import xdg.BaseDirectory
+
+    history_dir = xdg.BaseDirectory.save_data_path("toodlepip/test-durations")
+    return TestSharder(shards, DurationHistory(json_files.project_file_path(history_dir, project_path)))
+
+
+class TestSharder(object):
+    # Splits the tests run by a command into shards that are run at the
+    # same time, in the same runtime. Tests are split by file, and balanced
+    # using how long each file took in previous builds. The runtime finds
+    # the test runner used by the command, such as nose, which collects the
+    # test files, and writes a JUnit XML report for each shard that the
+    # durations are read from.
+
+    def __init__(self, shards, history):
+        self._shards = shards
+        self._history = history
+
+    @contextlib.contextmanager
+    def shard(self, session, runtime, project_dir, commands, setup):
+        from .temp import create_temp_dir
+
+        temp_dir = create_temp_dir()
+        try:
+            sharded = []
+            reports = []
+            for index, command in enumerate(commands):
+                test_runner = runtime.test_runner(command.actual, project_dir)
+                if test_runner is None:
+                    sharded.append(command)
+                else:
+                    command_dir = os.path.join(temp_dir.path, str(index))
+                    os.mkdir(command_dir)
+                    sharded_command, command_reports = self._shard_command(
+                        session,
+                        test_runner,
+                        project_dir,
+                        command,
+                        setup,
+                        command_dir,
+                    )
+                    sharded.append(sharded_command)
+                    reports += command_reports
+
+            yield sharded
+
+            durations = {}
+            for report_path in reports:
+                if os.path.exists(report_path):
+                    durations.update(read_junit_durations(report_path, project_dir))
+            if durations:
+                self._history.update(durations)
+        finally:
+            temp_dir.close()
+
+    def _shard_command(self, session, test_runner, project_dir, command, setup, command_dir):
+        collect_path = os.path.join(command_dir, "collected")
+        result = session.run(
+            None,
+            Command.shell(test_runner.collect_command(collect_path)),
+            quiet=True,
+            setup=setup,
+        )
+        if result.return_code != 0 or not os.path.exists(collect_path):
+            return command, []
+
+        # Any test that can't be found in a file would be left out of every
+        # shard, so the command is run without sharding
+        test_files = test_runner.read_collected(collect_path, project_dir)
+        if test_files is None:
+            return command, []
+        shards = split_into_shards(test_files, self._history.durations(), self._shards)
+        if len(shards) < 2:
+            return command, []
+
+        shard_commands = []
+        reports = []
+        for index, shard in enumerate(shards):
+            report_path = os.path.join(command_dir, "shard-{0}.xml".format(index))
+            shard_commands.append(test_runner.shard_command(shard, report_path))
+            reports.append(report_path)
+
+        sharded_command = Command(
+            display="{0} (in {1} shards)".format(command.display, len(shards)),
+            actual=_parallel_script(shard_commands, command_dir),
+        )
+        return sharded_command, reports
+
+
+def split_into_shards(test_files, durations, shards):
+    # Longest first, each file is added to the shard with the least work
+    # so far. Files with no recorded duration are assumed to take the mean
+    # of the recorded durations.
+    if not test_files:
+        return []
+
+    known_durations = [durations[test_file] for test_file in test_files if test_file in durations]
+    if known_durations:
+        default_duration = sum(known_durations) / len(known_durations)
+    else:
+        default_duration = 1.0
+
+    def _duration(test_file):
+        return durations.get(test_file, default_duration)
+
+    shard_count = min(shards, len(test_files))
+    loads = [0.0] * shard_count
+    result = [[] for index in range(shard_count)]
+    for test_file in sorted(test_files, key=lambda test_file: (-_duration(test_file), test_file)):
+        index = loads.index(min(loads))
+        result[index].append(test_file)
+        loads[index] += _duration(test_file)
+    return [sorted(shard) for shard in result]
+
+
+def _parallel_script(shard_commands, output_dir):
+    # Shards are run in the background with their output written to files,
+    # which are written out in order once every shard has finished. The
+    # script is run in a subshell so that it doesn't change the session's
+    # variables, and exits with the status of the first shard that failed.
+    lines = []
+    for index, shard_command in enumerate(shard_commands):
+        output_path = pipes.quote(os.path.join(output_dir, "shard-{0}.out".format(index)))
+        lines.append("({0}) > {1} 2>&1 &".format(shard_command, output_path))
+        lines.append("pid_{0}=$!".format(index))
+    lines.append("status=0")
+    for index in range(len(shard_commands)):
+        lines.append("wait $pid_{0}; shard_status=$?".format(index))
+        lines.append('if [ "$status" -eq 0 ]; then status=$shard_status; fi')
+    for index in range(len(shard_commands)):
+        output_path = pipes.quote(os.path.join(output_dir, "shard-{0}.out".format(index)))
+        lines.append("echo {0}".format(pipes.quote("Shard {0} of {1}:".format(index + 1, len(shard_commands)))))
+        lines.append("cat {0}".format(output_path))
+    lines.append('exit "$status"')
+    return "(\n{0}\n)".format("\n".join(lines))
+
+
+def read_junit_durations(path, project_dir):
+    # The total time of the tests in each file, found using the class names
+    # in the report, such as tests.build_tests.BuilderTests
+    durations = {}
+    for test_case in ElementTree.parse(path).getroot().findall(".//testcase"):
+        test_file = module_file(test_case.get("classname", ""), project_dir)
+        if test_file is not None:
+            durations[test_file] = durations.get(test_file, 0.0) + float(test_case.get("time") or 0)
+    return durations
+
+
+def read_junit_class_names(path):
+    return [
+        test_case.get("classname", "")
+        for test_case in ElementTree.parse(path).getroot().findall(".//testcase")
+    ]
+
+
+def module_file(name, project_dir):
+    # The path, relative to the project, of the module in a dotted name,
+    # which may continue with the names of classes or functions
+    parts = name.split(".")
+    for length in range(len(parts), 0, -1):
+        relative_path = os.path.join(*parts[:length]) + ".py"
+        if os.path.isfile(os.path.join(project_dir, relative_path)):
+            return relative_path
+    return None
+
+
+class DurationHistory(object):
+    def __init__(self, path):
+        self._file = json_files.JsonFile(path)
+
+    def durations(self):
+        return self._file.read()
+
+    def update(self, durations):
+        def _update(history):
+            history.update(durations)
+            return history
+
+        self._file.update(_update)
@@ -0,0 +1,10 @@
+import sys
+
+
+def is_string(value):
+    if sys.version_info[0] <= 2:
+        string_cls = basestring
+    else:
+        string_cls = str
+
+    return isinstance(value, string_cls)
@@ -1,12 +1,22 @@
+import os
+import hashlib
 from datetime import timedelta
 
-import xdg.BaseDirectory
-import tempman
-
 
 def create_temp_dir():
+    import xdg.BaseDirectory
+    import tempman
+    
     temp_root = tempman.root(
         xdg.BaseDirectory.save_data_path("toodlepip/tmp"),
         timeout=timedelta(days=1)
     )
     return temp_root.create_temp_dir()
+
+
+def workspace_dir(project_path):
+    import xdg.BaseDirectory
+    
+    project_path = os.path.abspath(project_path)
+    name = hashlib.sha1(project_path.encode("utf8")).hexdigest()[:16]
+    return xdg.BaseDirectory.save_data_path("toodlepip/workspaces/{0}".format(name))
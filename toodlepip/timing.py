@@ -0,0 +1,110 @@
+import time
+import json
+import threading
+import contextlib
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+class Timings(object):
+    def __init__(self):
+        self._start_time = time.time()
+        self._records = []
+        self._lock = threading.Lock()
+
+    @property
+    def records(self):
+        with self._lock:
+            return list(self._records)
+
+    @contextlib.contextmanager
+    def record(self, kind, name, entry=None, cpu_time=None):
+        if cpu_time is None:
+            cpu_time = process_cpu_time
+        start = time.time()
+        start_cpu = cpu_time()
+        try:
+            yield
+        finally:
+            end_cpu = cpu_time()
+            if start_cpu is None or end_cpu is None:
+                cpu = None
+            else:
+                cpu = end_cpu - start_cpu
+            self.add(kind, name, entry=entry, start=start, wall=time.time() - start, cpu=cpu)
+
+    def add(self, kind, name, entry=None, start=None, wall=None, cpu=None):
+        if start is None:
+            start = time.time()
+        with self._lock:
+            self._records.append(Timing(
+                kind=kind,
+                name=name,
+                entry=entry,
+                start=start - self._start_time,
+                wall=wall,
+                cpu=cpu,
+            ))
+
+    def write_report(self, path):
+        report = {
+            "total": time.time() - self._start_time,
+            "records": [record.to_json() for record in self.records],
+        }
+        with open(path, "w") as report_file:
+            json.dump(report, report_file, indent=2)
+
+    def summary(self):
+        records = sorted(self.records, key=lambda record: record.wall, reverse=True)
+        rows = [("wall", "cpu", "entry", "kind", "name")]
+        for record in records:
+            rows.append((
+                "{0:.2f}s".format(record.wall),
+                "-" if record.cpu is None else "{0:.2f}s".format(record.cpu),
+                "-" if record.entry is None else record.entry,
+                record.kind,
+                record.name,
+            ))
+
+        widths = [max(len(row[column]) for row in rows) for column in range(4)]
+        lines = []
+        for row in rows:
+            cells = [cell.ljust(width) for cell, width in zip(row, widths)]
+            lines.append("  ".join(cells + [row[4]]))
+        return "\n".join(lines) + "\n"
+
+
+class Timing(object):
+    def __init__(self, kind, name, entry, start, wall, cpu):
+        self.kind = kind
+        self.name = name
+        self.entry = entry
+        self.start = start
+        self.wall = wall
+        self.cpu = cpu
+
+    def to_json(self):
+        return {
+            "kind": self.kind,
+            "name": self.name,
+            "entry": self.entry,
+            "start": self.start,
+            "wall": self.wall,
+            "cpu": self.cpu,
+        }
+
+
+def process_cpu_time():
+    # Includes the CPU time of child processes that have been waited for.
+    # When entries are built in parallel, this includes the time spent on
+    # all entries.
+    if resource is None:
+        return None
+    total = 0
+    for who in [resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN]:
+        usage = resource.getrusage(who)
+        total += usage.ru_utime + usage.ru_stime
+    return total
@@ -0,0 +1,237 @@
+import os
+import errno
+import time
+import select
+import struct
+import ctypes
+import ctypes.util
+
+
+def create_watcher(path, debounce=0.2):
+    try:
+        return InotifyWatcher(path, debounce=debounce)
+    except (OSError, AttributeError):
+        # inotify isn't available on this platform, or the limit on the
+        # number of watches has been reached
+        return PollingWatcher(path, debounce=debounce)
+
+
+class _Watcher(object):
+    # Yields once for each batch of changes to files under path. Changes
+    # are debounced: a batch ends once no further changes have been seen
+    # for debounce seconds. Which files changed is worked out when the
+    # project is synced, so the watcher only needs to notice that something
+    # might have.
+
+    def __init__(self, debounce):
+        self._debounce = debounce
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def changes(self, cancelled=None):
+        if cancelled is None:
+            cancelled = lambda: False
+
+        while not cancelled():
+            if self._wait(0.1):
+                while self._wait(self._debounce) and not cancelled():
+                    pass
+                if not cancelled():
+                    yield
+
+    def close(self):
+        pass
+
+
+# Directories whose contents are never copied into the build, and so
+# aren't watched
+_ignored_directories = set([".git"])
+
+
+class _IgnoreRules(object):
+    # Files ignored by git, such as node_modules or .tox, aren't copied into
+    # the build, so aren't watched either. git only reports ignored files
+    # that exist, so the rules are read again before a change is reported.
+
+    def __init__(self, path):
+        self._path = path
+        self._include = None
+        self.refresh()
+
+    def refresh(self):
+        from . import files
+        self._include = files.copy_filter(self._path)
+
+    def includes(self, path):
+        relative_path = os.path.relpath(path, self._path)
+        if relative_path == ".":
+            return True
+        # git reports ignored directories rather than the files in them
+        while relative_path:
+            if os.path.basename(relative_path) in _ignored_directories or not self._include(relative_path):
+                return False
+            relative_path = os.path.dirname(relative_path)
+        return True
+
+
+_IN_MODIFY = 0x00000002
+_IN_ATTRIB = 0x00000004
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_DELETE_SELF = 0x00000400
+_IN_MOVE_SELF = 0x00000800
+_IN_Q_OVERFLOW = 0x00004000
+_IN_ISDIR = 0x40000000
+_IN_NONBLOCK = 0o4000
+_IN_CLOEXEC = 0o2000000
+
+_watch_mask = (
+    _IN_MODIFY | _IN_ATTRIB | _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO |
+    _IN_CREATE | _IN_DELETE | _IN_DELETE_SELF | _IN_MOVE_SELF
+)
+
+_event_header = struct.Struct("iIII")
+
+
+class InotifyWatcher(_Watcher):
+    def __init__(self, path, debounce=0.2):
+        super(InotifyWatcher, self).__init__(debounce)
+        self._ignore_rules = _IgnoreRules(path)
+        self._libc = _libc()
+        self._fd = self._libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if self._fd < 0:
+            _raise_errno()
+        self._watched_dirs = {}
+        try:
+            self._watch_tree(path)
+        except Exception:
+            self.close()
+            raise
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def _watch_tree(self, path):
+        # Directories created after the watch is added are watched when
+        # their creation is seen
+        for root, dirs, filenames in os.walk(path):
+            dirs[:] = [
+                name for name in dirs
+                if self._ignore_rules.includes(os.path.join(root, name))
+            ]
+            self._watch_dir(root)
+
+    def _watch_dir(self, path):
+        watch_descriptor = self._libc.inotify_add_watch(self._fd, path.encode("utf8"), _watch_mask)
+        if watch_descriptor < 0:
+            error = ctypes.get_errno()
+            # The directory may have been removed since it was seen
+            if error not in (errno.ENOENT, errno.ENOTDIR):
+                _raise_errno()
+        else:
+            self._watched_dirs[watch_descriptor] = path
+
+    def _wait(self, timeout):
+        readable, writable, errored = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return False
+
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except OSError as error:
+            if error.errno == errno.EAGAIN:
+                return False
+            raise
+
+        events = []
+        overflowed = False
+        offset = 0
+        while offset + _event_header.size <= len(data):
+            watch_descriptor, mask, cookie, length = _event_header.unpack_from(data, offset)
+            name = data[offset + _event_header.size:offset + _event_header.size + length].rstrip(b"\0")
+            offset += _event_header.size + length
+
+            parent = self._watched_dirs.get(watch_descriptor)
+            if mask & _IN_Q_OVERFLOW:
+                overflowed = True
+            elif parent is not None:
+                events.append((mask, os.path.join(parent, name.decode("utf8"))))
+
+        # Changes to ignored files, such as compiled Python files, don't
+        # change the build
+        if any(self._ignore_rules.includes(path) for mask, path in events):
+            self._ignore_rules.refresh()
+        
+        for mask, path in events:
+            is_created_dir = mask & _IN_ISDIR and mask & (_IN_CREATE | _IN_MOVED_TO)
+            if is_created_dir and self._ignore_rules.includes(path):
+                self._watch_tree(path)
+        
+        return overflowed or any(
+            mask & (_IN_DELETE_SELF | _IN_MOVE_SELF) or self._ignore_rules.includes(path)
+            for mask, path in events
+        )
+
+
+def _libc():
+    libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    # Raises AttributeError if inotify isn't available
+    libc.inotify_init1
+    libc.inotify_add_watch
+    return libc
+
+
+def _raise_errno():
+    error = ctypes.get_errno()
+    raise OSError(error, os.strerror(error))
+
+
+class PollingWatcher(_Watcher):
+    def __init__(self, path, debounce=0.2, interval=1):
+        super(PollingWatcher, self).__init__(debounce)
+        self._path = path
+        self._ignore_rules = _IgnoreRules(path)
+        self._interval = interval
+        self._last_scan = time.time()
+        self._signatures = self._scan()
+
+    def _wait(self, timeout):
+        time.sleep(min(timeout, self._interval))
+        if time.time() - self._last_scan < self._interval:
+            return False
+
+        self._last_scan = time.time()
+        signatures = self._scan()
+        if signatures != self._signatures:
+            self._ignore_rules.refresh()
+            signatures = self._scan()
+        changed = signatures != self._signatures
+        self._signatures = signatures
+        return changed
+
+    def _scan(self):
+        signatures = {}
+        for root, dirs, filenames in os.walk(self._path):
+            dirs[:] = [
+                name for name in dirs
+                if self._ignore_rules.includes(os.path.join(root, name))
+            ]
+            for name in dirs + filenames:
+                path = os.path.join(root, name)
+                if not self._ignore_rules.includes(path):
+                    continue
+                try:
+                    path_stat = os.lstat(path)
+                except OSError:
+                    continue
+                signatures[path] = (path_stat.st_size, path_stat.st_mtime, path_stat.st_mode)
+        return signatures